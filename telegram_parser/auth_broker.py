@@ -0,0 +1,513 @@
+"""
+Авторизация аккаунтов Telegram в отдельном процессе
+Клиенты Pyrogram, ожидающие код или пароль 2FA, живут только в брокере,
+поэтому HTTP-слой может работать в нескольких воркерах uvicorn
+
+    python -m auth_broker   # слушает AUTH_BROKER_SOCKET
+
+Воркеры обращаются к брокеру через Unix-сокет: одна строка JSON с запросом,
+одна строка JSON с ответом.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator
+
+from dotenv import load_dotenv
+from pyrogram import Client
+from pyrogram.errors import (
+    SessionPasswordNeeded,
+    PhoneCodeInvalid,
+    PhoneCodeExpired,
+    FloodWait,
+    PasswordHashInvalid
+)
+
+AUTH_TTL = 300  # 5 минут
+AUTH_MAX_PENDING = 100
+AUTH_CODE_INTERVAL = 60  # не чаще одного кода на номер в минуту
+
+# Самый длинный ответ брокера — session_string, но с запасом
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+class _PendingAuth:
+    """Ожидающая авторизация: подключённый клиент и срок, до которого ждём код"""
+
+    __slots__ = ("phone", "client", "phone_code_hash", "expires_at", "requires_2fa", "in_use")
+
+    def __init__(self, phone: str, client: Client, phone_code_hash: str, expires_at: float):
+        self.phone = phone
+        self.client = client
+        self.phone_code_hash = phone_code_hash
+        self.expires_at = expires_at
+        self.requires_2fa = False
+        self.in_use = 0
+
+
+class AuthFlow:
+    """
+    Авторизация по номеру телефона: отправка кода, проверка кода и пароля 2FA
+
+    Между шагами клиент Pyrogram остаётся подключённым, поэтому все шаги
+    одного номера должны выполняться в одном процессе.
+    Ожидающие клиенты хранятся в порядке последнего обращения (LRU); сроки
+    истечения лежат в min-куче, и фоновая задача просыпается к ближайшему из них.
+    Сверх max_pending вытесняется давно не использованный клиент, код на один
+    номер отправляется не чаще раза в code_interval секунд.
+    Шаги одного номера выполняются по очереди, разных номеров — параллельно.
+    """
+
+    def __init__(
+        self,
+        api_id: Optional[str],
+        api_hash: Optional[str],
+        ttl: float = AUTH_TTL,
+        max_pending: int = AUTH_MAX_PENDING,
+        code_interval: float = AUTH_CODE_INTERVAL,
+        disconnect_timeout: float = 5.0,
+        disconnect_concurrency: int = 8
+    ):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.code_interval = code_interval
+        self.disconnect_timeout = disconnect_timeout
+        self.clients: "OrderedDict[str, _PendingAuth]" = OrderedDict()
+        # (expires_at, seq, entry); записи удалённых клиентов пропускаются при извлечении
+        self._deadlines: List[tuple] = []
+        self._seq = itertools.count()
+        # phone → время последней отправки кода, в порядке отправки
+        self._last_sent: "OrderedDict[str, float]" = OrderedDict()
+        self._connecting = 0
+        # phone → [lock, сколько запросов его ждут]
+        self._locks: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._disconnects = asyncio.Semaphore(disconnect_concurrency)
+        self._expiry_task: Optional[asyncio.Task] = None
+        self.expired_total = 0
+        self.evicted_total = 0
+        self.rate_limited_total = 0
+
+    async def start(self):
+        """Запустить фоновое истечение ожидающих клиентов"""
+        if not self._expiry_task:
+            self._expiry_task = asyncio.create_task(self._expiry_loop())
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "local",
+            "pending": len(self.clients),
+            "max_pending": self.max_pending,
+            "ttl": self.ttl,
+            "expired_total": self.expired_total,
+            "evicted_total": self.evicted_total,
+            "rate_limited_total": self.rate_limited_total
+        }
+
+    async def close(self):
+        """Остановить истечение и отключить все ожидающие клиенты"""
+        if self._expiry_task:
+            self._expiry_task.cancel()
+            try:
+                await self._expiry_task
+            except asyncio.CancelledError:
+                pass
+            self._expiry_task = None
+
+        entries = list(self.clients.values())
+        self.clients.clear()
+        self._deadlines.clear()
+        await asyncio.gather(*(self._disconnect(entry.client) for entry in entries))
+
+    async def send_code(self, phone_number: str) -> Dict[str, Any]:
+        """Отправить код авторизации на номер телефона"""
+        async with self._phone_lock(phone_number):
+            return await self._send_code(phone_number)
+
+    async def verify_code(self, phone_number: str, phone_code_hash: str, phone_code: str) -> Dict[str, Any]:
+        """Проверить код авторизации"""
+        async with self._phone_lock(phone_number):
+            return await self._verify_code(phone_number, phone_code_hash, phone_code)
+
+    async def verify_2fa(self, phone_number: str, password: str) -> Dict[str, Any]:
+        """Проверить пароль двухфакторной аутентификации"""
+        async with self._phone_lock(phone_number):
+            return await self._verify_2fa(phone_number, password)
+
+    @asynccontextmanager
+    async def _phone_lock(self, phone_number: str) -> AsyncIterator[None]:
+        # Без блокировки два одновременных send_code одного номера подключили бы два клиента
+        phone = phone_number.strip()
+        entry = self._locks.get(phone)
+        if entry is None:
+            entry = self._locks[phone] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[phone]
+
+    async def _send_code(self, phone_number: str) -> Dict[str, Any]:
+        print(f"[AUTH] send_code called for phone: {phone_number}")
+        print(f"[AUTH] API_ID: {self.api_id}, API_HASH: {'set' if self.api_hash else 'not set'}")
+
+        if not self.api_id or not self.api_hash:
+            return {"success": False, "error": "TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"}
+
+        phone = phone_number.strip()
+
+        wait = self._code_wait(phone, time.monotonic())
+        if wait:
+            self.rate_limited_total += 1
+            return {"success": False, "error": f"Код уже отправлен. Повторить можно через {wait} секунд"}
+
+        # Повторный запрос кода заменяет прежний клиент номера
+        previous = self.clients.get(phone)
+        if previous:
+            if previous.in_use:
+                return {"success": False, "error": "Авторизация этого номера уже выполняется"}
+            del self.clients[phone]
+            await self._disconnect(previous.client)
+
+        if not await self._reserve_slot():
+            return {"success": False, "error": "Слишком много одновременных авторизаций. Повторите попытку позже"}
+
+        # Создаём клиент
+        client = Client(
+            name=f"auth_{phone.replace('+', '')}",
+            api_id=int(self.api_id),
+            api_hash=self.api_hash,
+            in_memory=True
+        )
+
+        try:
+            await client.connect()
+            sent_code = await client.send_code(phone)
+        except FloodWait as e:
+            await self._disconnect(client)
+            return {"success": False, "error": f"Слишком много попыток. Подождите {e.value} секунд"}
+        except Exception as e:
+            await self._disconnect(client)
+            return {"success": False, "error": str(e)}
+        finally:
+            self._connecting -= 1
+
+        await self._add(_PendingAuth(phone, client, sent_code.phone_code_hash, time.monotonic() + self.ttl))
+        self._last_sent[phone] = time.monotonic()
+        self._last_sent.move_to_end(phone)
+
+        print(f"[AUTH] Code sent successfully, phone_code_hash: {sent_code.phone_code_hash[:10]}...")
+        print(f"[AUTH] Active clients: {len(self.clients)}")
+
+        return {"success": True, "phone_code_hash": sent_code.phone_code_hash}
+
+    async def _verify_code(self, phone_number: str, phone_code_hash: str, phone_code: str) -> Dict[str, Any]:
+        print(f"[AUTH] verify_code called for phone: {phone_number}")
+
+        phone = phone_number.strip()
+        entry = self._checkout(phone)
+
+        if entry is None:
+            print(f"[AUTH] ERROR: Phone {phone} not found in auth clients!")
+            return {"success": False, "error": "Сессия авторизации истекла. Запросите код заново"}
+
+        client = entry.client
+
+        print(f"[AUTH] Calling sign_in for {phone} with code {phone_code}")
+
+        try:
+            result = await client.sign_in(
+                phone_number=phone,
+                phone_code_hash=phone_code_hash,
+                phone_code=phone_code
+            )
+            print(f"[AUTH] sign_in result: {result}")
+
+            # Успешная авторизация - получаем session_string
+            session_string = await client.export_session_string()
+            print(f"[AUTH] SUCCESS! Got session_string for {phone}")
+            await self._finish(entry)
+
+            return {"success": True, "session_string": session_string}
+
+        except SessionPasswordNeeded:
+            # Нужна 2FA - сохраняем клиент
+            print(f"[AUTH] 2FA required for {phone}")
+            entry.requires_2fa = True
+            return {"success": False, "requires_2fa": True}
+
+        except PhoneCodeInvalid:
+            print(f"[AUTH] ERROR: PhoneCodeInvalid for {phone}")
+            return {"success": False, "error": "Неверный код. Попробуйте ещё раз"}
+
+        except PhoneCodeExpired:
+            print(f"[AUTH] ERROR: PhoneCodeExpired for {phone}")
+            await self._finish(entry)
+            return {"success": False, "error": "Код истёк. Запросите новый"}
+
+        except Exception as e:
+            print(f"[AUTH] ERROR: Exception for {phone}: {type(e).__name__} - {e}")
+            return {"success": False, "error": str(e)}
+
+        finally:
+            entry.in_use -= 1
+
+    async def _verify_2fa(self, phone_number: str, password: str) -> Dict[str, Any]:
+        phone = phone_number.strip()
+        entry = self._checkout(phone)
+
+        if entry is None:
+            return {"success": False, "error": "Сессия авторизации истекла. Начните заново"}
+
+        client = entry.client
+
+        try:
+            await client.check_password(password)
+
+            # Успешная авторизация - получаем session_string
+            session_string = await client.export_session_string()
+            await self._finish(entry)
+
+            return {"success": True, "session_string": session_string}
+
+        except PasswordHashInvalid:
+            return {"success": False, "error": "Неверный пароль 2FA"}
+
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+        finally:
+            entry.in_use -= 1
+
+    def _code_wait(self, phone: str, now: float) -> int:
+        """Сколько секунд ждать следующего кода на номер (0 — можно отправлять)"""
+        # Отправки упорядочены по времени: устаревшие записи всегда в начале
+        horizon = now - self.code_interval
+        while self._last_sent:
+            oldest_phone, sent_at = next(iter(self._last_sent.items()))
+            if sent_at > horizon:
+                break
+            del self._last_sent[oldest_phone]
+
+        sent_at = self._last_sent.get(phone)
+        if sent_at is None or sent_at <= horizon:
+            return 0
+        return max(1, int(sent_at - horizon + 0.999))
+
+    async def _reserve_slot(self) -> bool:
+        """Занять место под нового клиента, при необходимости вытеснив давно не использованный"""
+        while len(self.clients) + self._connecting >= self.max_pending:
+            victim = next((entry for entry in self.clients.values() if not entry.in_use), None)
+            if victim is None:
+                return False
+            del self.clients[victim.phone]
+            self.evicted_total += 1
+            print(f"[AUTH] Evicted pending auth for {victim.phone} (limit {self.max_pending})")
+            await self._disconnect(victim.client)
+        self._connecting += 1
+        return True
+
+    async def _add(self, entry: _PendingAuth):
+        previous = self.clients.get(entry.phone)
+        self.clients[entry.phone] = entry
+        heapq.heappush(self._deadlines, (entry.expires_at, next(self._seq), entry))
+        if self._deadlines[0][2] is entry:
+            self._wakeup.set()
+        # Записи удалённых клиентов копятся в куче только до следующей перестройки
+        if len(self._deadlines) > 2 * len(self.clients) + 64:
+            self._deadlines = [item for item in self._deadlines if self.clients.get(item[2].phone) is item[2]]
+            heapq.heapify(self._deadlines)
+        # Заменённый клиент больше недоступен через clients — отключаем его здесь
+        if previous is not None and previous is not entry:
+            await self._disconnect(previous.client)
+
+    def _checkout(self, phone: str) -> Optional[_PendingAuth]:
+        entry = self.clients.get(phone)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        self.clients.move_to_end(phone)
+        entry.in_use += 1
+        return entry
+
+    async def _finish(self, entry: _PendingAuth):
+        """Авторизация завершена: убрать клиент и отключить его"""
+        if self.clients.get(entry.phone) is entry:
+            del self.clients[entry.phone]
+        await self._disconnect(entry.client)
+
+    async def _disconnect(self, client: Client):
+        # Не больше disconnect_concurrency отключений одновременно, каждое — не дольше таймаута
+        async with self._disconnects:
+            try:
+                await asyncio.wait_for(client.disconnect(), timeout=self.disconnect_timeout)
+            except Exception as e:
+                print(f"[AUTH] Failed to disconnect auth client: {type(e).__name__} - {e}")
+
+    async def _expiry_loop(self):
+        while True:
+            timeout = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+            self._wakeup.clear()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            now = time.monotonic()
+            victims = []
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, entry = heapq.heappop(self._deadlines)
+                if self.clients.get(entry.phone) is not entry:
+                    continue
+                if entry.in_use:
+                    # Шаг авторизации ещё выполняется — проверим чуть позже
+                    heapq.heappush(self._deadlines, (now + 1.0, next(self._seq), entry))
+                    continue
+                del self.clients[entry.phone]
+                victims.append(entry)
+
+            if victims:
+                self.expired_total += len(victims)
+                print(f"[AUTH] Expired {len(victims)} pending auth clients")
+                await asyncio.gather(*(self._disconnect(entry.client) for entry in victims))
+
+
+class AuthBrokerClient:
+    """
+    Тот же интерфейс, что у AuthFlow, но шаги выполняет процесс-брокер
+
+    На каждый вызов открывается отдельное соединение с Unix-сокетом:
+    авторизаций немного, а так воркеру не нужно следить за общим соединением.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+
+    async def send_code(self, phone_number: str) -> Dict[str, Any]:
+        return await self._call("send_code", phone_number=phone_number)
+
+    async def verify_code(self, phone_number: str, phone_code_hash: str, phone_code: str) -> Dict[str, Any]:
+        return await self._call(
+            "verify_code", phone_number=phone_number, phone_code_hash=phone_code_hash, phone_code=phone_code
+        )
+
+    async def verify_2fa(self, phone_number: str, password: str) -> Dict[str, Any]:
+        return await self._call("verify_2fa", phone_number=phone_number, password=password)
+
+    async def stats(self) -> Dict[str, Any]:
+        result = await self._call("stats")
+        result["mode"] = "broker"
+        return result
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _call(self, op: str, **args) -> Dict[str, Any]:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_SIZE), timeout=5.0
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"[AUTH] Auth broker unavailable at {self.path}: {type(e).__name__} - {e}")
+            return {"success": False, "error": "Сервис авторизации недоступен. Повторите попытку позже"}
+
+        try:
+            writer.write(json.dumps({"op": op, "args": args}).encode() + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+            if not line:
+                raise ConnectionError("auth broker closed connection")
+            return json.loads(line)
+        except (OSError, ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            print(f"[AUTH] Auth broker call {op} failed: {type(e).__name__} - {e}")
+            return {"success": False, "error": "Сервис авторизации недоступен. Повторите попытку позже"}
+        finally:
+            writer.close()
+
+
+class AuthBroker:
+    """Сервер брокера: принимает запросы воркеров и выполняет их в AuthFlow"""
+
+    OPS = ("send_code", "verify_code", "verify_2fa", "stats")
+
+    def __init__(self, flow: AuthFlow, path: str):
+        self.flow = flow
+        self.path = path
+
+    async def serve(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_MESSAGE_SIZE)
+        # Сокет доступен только пользователю сервиса: через него проходят session_string
+        os.chmod(self.path, 0o600)
+        print(f"[AUTH] Broker listening on {self.path}")
+
+        await self.flow.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.flow.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            response = await self._dispatch(json.loads(line))
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except Exception as e:
+            print(f"[AUTH] Broker request failed: {type(e).__name__} - {e}")
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get("op")
+        args = request.get("args") or {}
+        if op not in self.OPS:
+            return {"success": False, "error": f"Unknown operation: {op}"}
+        # Шаги одного номера AuthFlow сам выполняет по очереди
+        return await getattr(self.flow, op)(**args)
+
+
+def main():
+    load_dotenv()
+    data_dir = os.getenv("PARSER_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    path = os.getenv("AUTH_BROKER_SOCKET") or os.path.join(data_dir, "auth_broker.sock")
+    flow = AuthFlow(
+        os.getenv("TELEGRAM_API_ID"),
+        os.getenv("TELEGRAM_API_HASH"),
+        ttl=float(os.getenv("AUTH_TTL", str(AUTH_TTL))),
+        max_pending=int(os.getenv("AUTH_MAX_PENDING", str(AUTH_MAX_PENDING))),
+        code_interval=float(os.getenv("AUTH_CODE_INTERVAL", str(AUTH_CODE_INTERVAL)))
+    )
+    try:
+        asyncio.run(AuthBroker(flow, path).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
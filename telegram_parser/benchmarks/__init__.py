@@ -0,0 +1,4 @@
+"""
+Офлайн-бенчмарки и нагрузочные тесты парсера
+Запускаются из каталога telegram_parser: python -m benchmarks.<модуль>
+"""
@@ -0,0 +1,21 @@
+"""
+Приложение main с поддельным Telegram вместо настоящих сессий
+
+    uvicorn benchmarks.fake_app:app --port 8100 --workers 2
+
+Параметры поддельного Telegram — переменные FAKE_TG_* (см. FakeTelegramConfig),
+остальные настройки сервиса — как обычно (SYNC_WORKERS, SESSION_RATE, BOT_API_URL ...).
+"""
+
+import os
+from functools import partial
+
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("TELEGRAM_API_HASH", "loadtest")
+
+import main
+from benchmarks.fake_telegram import FakeClientPool, FakeTelegram, FakeTelegramConfig
+
+main.ClientPool = partial(FakeClientPool, telegram=FakeTelegram(FakeTelegramConfig.from_env()))
+
+app = main.app
@@ -0,0 +1,203 @@
+"""
+Поддельный Telegram для нагрузочных тестов
+Клиент с интерфейсом Pyrogram (get_chat, get_chat_history, get_messages) поверх
+синтетической истории, с задержками и FloodWait по заданной вероятности
+"""
+
+import asyncio
+import os
+import random
+import zlib
+from typing import Dict, List, Optional
+
+from pyrogram import enums, raw, types
+from pyrogram.errors import FloodWait, UsernameNotOccupied
+
+from benchmarks import synthetic
+from client_pool import ClientPool
+from parser import HISTORY_PAGE_SIZE
+
+
+class FakeTelegramConfig:
+    """Параметры поддельного Telegram (по умолчанию — из переменных FAKE_TG_*)"""
+
+    def __init__(
+        self,
+        history: int = 1000,
+        latency: float = 0.05,
+        page_latency: float = 0.1,
+        start_latency: float = 0.3,
+        flood_rate: float = 0.0,
+        flood_seconds: int = 2,
+        members: int = 25000,
+        seed: int = 42
+    ):
+        self.history = history
+        self.latency = latency
+        self.page_latency = page_latency
+        self.start_latency = start_latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.members = members
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> "FakeTelegramConfig":
+        return cls(
+            history=int(os.getenv("FAKE_TG_HISTORY", "1000")),
+            latency=float(os.getenv("FAKE_TG_LATENCY", "0.05")),
+            page_latency=float(os.getenv("FAKE_TG_PAGE_LATENCY", "0.1")),
+            start_latency=float(os.getenv("FAKE_TG_START_LATENCY", "0.3")),
+            flood_rate=float(os.getenv("FAKE_TG_FLOOD_RATE", "0")),
+            flood_seconds=int(os.getenv("FAKE_TG_FLOOD_SECONDS", "2")),
+            members=int(os.getenv("FAKE_TG_MEMBERS", "25000")),
+            seed=int(os.getenv("FAKE_TG_SEED", "42"))
+        )
+
+
+class FakeTelegram:
+    """
+    Общее состояние поддельного Telegram: каналы и их история
+
+    Канал существует для любого username, кроме начинающихся с "missing".
+    История канала генерируется один раз и переиспользуется всеми клиентами.
+    """
+
+    def __init__(self, config: FakeTelegramConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._history: Dict[int, List[types.Message]] = {}
+        self.calls: Dict[str, int] = {}
+        self.flood_waits = 0
+
+    def chat_id(self, username: str) -> int:
+        return -1000000000000 - zlib.crc32(username.lower().encode())
+
+    def chat(self, username: str) -> types.Chat:
+        return types.Chat(
+            id=self.chat_id(username),
+            type=enums.ChatType.CHANNEL,
+            title=f"Channel {username}",
+            username=username,
+            members_count=self.config.members,
+            description="Synthetic channel for load tests"
+        )
+
+    def history(self, chat_id: int) -> List[types.Message]:
+        """История канала от новых сообщений к старым"""
+        messages = self._history.get(chat_id)
+        if messages is None:
+            messages = self._history[chat_id] = synthetic.build_mixed(self.config.history, seed=chat_id)
+        return messages
+
+    async def rpc(self, method: str, latency: Optional[float] = None):
+        """Задержка вызова (±50%) и FloodWait с заданной вероятностью"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.config.flood_rate and self._rng.random() < self.config.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.config.flood_seconds)
+        latency = self.config.latency if latency is None else latency
+        if latency:
+            await asyncio.sleep(latency * self._rng.uniform(0.5, 1.5))
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.calls, flood_waits=self.flood_waits, channels=len(self._history))
+
+
+class _FakeStorage:
+    async def update_peers(self, peers):
+        pass
+
+
+class FakeClient:
+    """Клиент с интерфейсом Pyrogram, который используют парсер и пул"""
+
+    def __init__(self, telegram: FakeTelegram, name: str):
+        self.telegram = telegram
+        self.name = name
+        self.storage = _FakeStorage()
+        self.is_connected = False
+        self.is_initialized = False
+        self._usernames: Dict[int, str] = {}
+
+    async def connect(self) -> bool:
+        # Подключение и InitConnection
+        await asyncio.sleep(self.telegram.config.start_latency)
+        self.is_connected = True
+        return True
+
+    async def start(self):
+        # Как Client.start: после подключения — updates.GetState и get_me
+        await self.connect()
+        await self.telegram.rpc("get_state")
+        await self.telegram.rpc("get_me")
+        self.is_initialized = True
+        return self
+
+    async def stop(self):
+        self.is_connected = self.is_initialized = False
+        return self
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    async def get_chat(self, chat_id):
+        await self.telegram.rpc("get_chat")
+        if isinstance(chat_id, int):
+            username = self._usernames.get(chat_id)
+        else:
+            username = chat_id.lstrip("@")
+            if username.startswith("missing"):
+                raise UsernameNotOccupied()
+            self._usernames[self.telegram.chat_id(username)] = username
+        return self.telegram.chat(username or str(chat_id))
+
+    async def resolve_peer(self, peer_id):
+        return raw.types.InputPeerChannel(channel_id=abs(peer_id) % 10 ** 12, access_hash=peer_id * 7)
+
+    async def get_chat_history(self, chat_id, limit: int = 0, offset_id: int = 0, offset_date=None):
+        messages = self.telegram.history(chat_id)
+        served = 0
+        for message in messages:
+            if offset_id and message.id >= offset_id:
+                continue
+            if not offset_id and offset_date and offset_date.timestamp() > 0 and message.date >= offset_date:
+                continue
+            if limit and served >= limit:
+                return
+            if served % HISTORY_PAGE_SIZE == 0:
+                await self.telegram.rpc("get_chat_history", self.telegram.config.page_latency)
+            served += 1
+            yield message
+
+    async def stream_media(self, media, limit: int = 0, offset: int = 0):
+        """Файл из нулевых байт размера file_size, кусками по 1 МБ (как у Pyrogram)"""
+        remaining = getattr(media, "file_size", None) or 64 * 1024
+        while remaining > 0:
+            await self.telegram.rpc("stream_media")
+            chunk = min(remaining, 1024 * 1024)
+            remaining -= chunk
+            yield bytes(chunk)
+
+    async def get_messages(self, chat_id, message_ids, replies: int = 1):
+        await self.telegram.rpc("get_messages")
+        by_id = {message.id: message for message in self.telegram.history(chat_id)}
+        if isinstance(message_ids, int):
+            return by_id.get(message_ids) or types.Message(id=message_ids, empty=True)
+        return [by_id.get(message_id) or types.Message(id=message_id, empty=True) for message_id in message_ids]
+
+
+class FakeClientPool(ClientPool):
+    """ClientPool, который создаёт FakeClient вместо подключения к Telegram"""
+
+    def __init__(self, *args, telegram: FakeTelegram, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telegram = telegram
+
+    def _create_client(self, key: str, session_string: str) -> FakeClient:
+        return FakeClient(self.telegram, name=f"pool_{key[:12]}")
+
+    def stats(self):
+        result = super().stats()
+        result["fake_telegram"] = self.telegram.stats()
+        return result
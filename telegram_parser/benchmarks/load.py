@@ -0,0 +1,305 @@
+"""
+Нагрузочный драйвер для /channel-info, /message-stats и /sync
+Поднимает заглушки Bot API и callback, запускает сервис с поддельным Telegram
+(benchmarks.fake_app) в отдельном процессе и измеряет p50/p99 и пропускную способность
+
+    cd telegram_parser
+    python -m benchmarks.load --requests 200 --concurrency 20 --workers 2
+    python -m benchmarks.load --endpoints sync --sync-limit 1000 --flood-rate 0.02
+
+С --app-url драйвер нагружает уже запущенный сервис (например, uvicorn benchmarks.fake_app:app).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.stubs import CallbackReceiver, bot_api_app
+
+ENDPOINTS = ("channel-info", "message-stats", "sync")
+BOT_TOKEN = "0000000000:LOADTEST"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(endpoint: str, latencies: List[float], errors: int, elapsed: float, posts: int = 0) -> Dict[str, Any]:
+    total = len(latencies) + errors
+    result = {
+        "endpoint": endpoint,
+        "requests": total,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p90_ms": _ms(percentile(latencies, 90)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None)
+    }
+    if posts:
+        result["posts"] = posts
+        result["posts_per_sec"] = posts / elapsed if elapsed else None
+    return result
+
+
+class LoadDriver:
+    """Запросы одного типа с фиксированной конкурентностью"""
+
+    def __init__(self, args: argparse.Namespace, app_url: str, callback_url: str, receiver: CallbackReceiver):
+        self.args = args
+        self.app_url = app_url
+        self.callback_url = callback_url
+        self.receiver = receiver
+        self.rng = random.Random(args.seed)
+
+    def _session(self, i: int) -> str:
+        return f"loadtest-session-{i % self.args.sessions}"
+
+    def _channel(self, i: int) -> str:
+        return f"loadchan{i % self.args.channels}"
+
+    async def run(self, endpoint: str) -> Dict[str, Any]:
+        latencies: List[float] = []
+        errors = 0
+        posts = 0
+        counter = iter(range(self.args.requests))
+
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.app_url, limits=limits, timeout=self.args.timeout) as client:
+            request = getattr(self, "_" + endpoint.replace("-", "_"))
+
+            async def worker():
+                nonlocal errors, posts
+                for i in counter:
+                    started = time.perf_counter()
+                    try:
+                        ok, count = await request(client, i)
+                    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                        print(f"[LOAD] {endpoint} #{i}: {type(e).__name__} - {e}")
+                        ok, count = False, 0
+                    if ok:
+                        latencies.append(time.perf_counter() - started)
+                        posts += count
+                    else:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+        return summarize(endpoint, latencies, errors, elapsed, posts)
+
+    async def _channel_info(self, client: httpx.AsyncClient, i: int):
+        response = await client.post("/channel-info", json={
+            "channel_username": self._channel(i),
+            "session_string": self._session(i)
+        })
+        return response.status_code == 200 and response.json().get("success"), 0
+
+    async def _message_stats(self, client: httpx.AsyncClient, i: int):
+        ids = self.rng.sample(range(1, self.args.history + 1), min(self.args.stats_ids, self.args.history))
+        response = await client.post("/message-stats", json={
+            "channel_username": self._channel(i),
+            "session_string": self._session(i),
+            "message_ids": ids
+        })
+        return response.status_code == 200 and response.json().get("success"), 0
+
+    async def _sync(self, client: httpx.AsyncClient, i: int):
+        # Уникальный channel_site_id — чтобы задачи не объединялись и callback можно было сопоставить
+        sync_id = str(uuid.uuid4())
+        done = self.receiver.expect(sync_id)
+        response = await client.post("/sync", json={
+            "channel_site_id": sync_id,
+            "channel_username": self._channel(i),
+            "session_string": self._session(i),
+            "bot_token": BOT_TOKEN,
+            "callback_url": self.callback_url,
+            "limit": self.args.sync_limit,
+            "delivery": self.args.delivery,
+            "page_size": self.args.page_size,
+            "parallel": self.args.parallel
+        })
+        if response.status_code != 200:
+            return False, 0
+        result = await asyncio.wait_for(done, timeout=self.args.sync_timeout)
+        return result["status"] == "success", result["posts"]
+
+
+async def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def start_app(
+    args: argparse.Namespace,
+    port: int,
+    bot_api_url: str,
+    data_dir: str,
+    extra_env: Optional[Dict[str, str]] = None
+) -> subprocess.Popen:
+    """Запустить сервис с поддельным Telegram в отдельном процессе"""
+    env = dict(os.environ)
+    env.update({
+        "BOT_API_URL": bot_api_url,
+        "PARSER_DATA_DIR": data_dir,
+        "FAKE_TG_HISTORY": str(args.history),
+        "FAKE_TG_LATENCY": str(args.tg_latency),
+        "FAKE_TG_PAGE_LATENCY": str(args.tg_page_latency),
+        "FAKE_TG_START_LATENCY": str(args.tg_start_latency),
+        "FAKE_TG_FLOOD_RATE": str(args.flood_rate),
+        "FAKE_TG_FLOOD_SECONDS": str(args.flood_seconds),
+        "FAKE_TG_SEED": str(args.seed)
+    })
+    env.update(extra_env or {})
+    command = [
+        sys.executable, "-m", "uvicorn", "benchmarks.fake_app:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(args.workers), "--log-level", "warning"
+    ]
+    output = None if args.app_log else subprocess.DEVNULL
+    return subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        stdout=output,
+        stderr=output
+    )
+
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url + "/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Service at {url} did not start in {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    receiver = CallbackReceiver(latency=args.callback_latency)
+    bot_api_port, callback_port, app_port = _free_port(), _free_port(), _free_port()
+    servers = [
+        await serve(bot_api_app(args.getfile_latency, args.getfile_error_rate, args.seed), bot_api_port),
+        await serve(receiver.app, callback_port)
+    ]
+
+    process = None
+    app_url = args.app_url
+    with tempfile.TemporaryDirectory(prefix="parser-load-") as data_dir:
+        try:
+            if not app_url:
+                app_url = f"http://127.0.0.1:{app_port}"
+                process = start_app(args, app_port, f"http://127.0.0.1:{bot_api_port}", data_dir)
+            await wait_ready(app_url)
+
+            driver = LoadDriver(args, app_url, f"http://127.0.0.1:{callback_port}/callback", receiver)
+            results = []
+            print(f"{'endpoint':<14} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            for endpoint in args.endpoints.split(","):
+                result = await driver.run(endpoint)
+                results.append(result)
+                print(_format_row(result), flush=True)
+
+            print(f"\nCallback receiver: {receiver.requests} requests, {receiver.bytes / 1e6:.1f} MB")
+            return results
+        finally:
+            if process:
+                process.terminate()
+                process.wait(timeout=30)
+            for server in servers:
+                server.should_exit = True
+            await asyncio.sleep(0.2)
+
+
+def _format_row(result: Dict[str, Any]) -> str:
+    row = (
+        f"{result['endpoint']:<14} {result['requests']:>6} {result['errors']:>5} {result['throughput']:>8.1f} "
+        + " ".join(f"{result[key]:>9.1f}" if result[key] is not None else f"{'-':>9}"
+                   for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms"))
+    )
+    if "posts_per_sec" in result:
+        row += f"  {result['posts_per_sec']:,.0f} posts/s"
+    return row
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return seconds * 1000 if seconds is not None else None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервиса с поддельным Telegram")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="через запятую: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждый endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=5, help="сколько разных session_string использовать")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn у сервиса")
+    parser.add_argument("--app-url", help="нагружать уже запущенный сервис вместо запуска своего")
+    parser.add_argument("--app-log", action="store_true", help="показывать вывод сервиса")
+    parser.add_argument("--timeout", type=float, default=60.0, help="таймаут HTTP-запроса, сек")
+    parser.add_argument("--seed", type=int, default=42)
+
+    group = parser.add_argument_group("поддельный Telegram")
+    group.add_argument("--history", type=int, default=1000, help="постов в каждом канале")
+    group.add_argument("--tg-latency", type=float, default=0.05, help="задержка get_chat / get_messages, сек")
+    group.add_argument("--tg-page-latency", type=float, default=0.1, help="задержка страницы истории, сек")
+    group.add_argument("--tg-start-latency", type=float, default=0.3, help="время запуска клиента, сек")
+    group.add_argument("--flood-rate", type=float, default=0.0, help="вероятность FloodWait на вызов")
+    group.add_argument("--flood-seconds", type=int, default=2)
+
+    group = parser.add_argument_group("Bot API и callback")
+    group.add_argument("--getfile-latency", type=float, default=0.05)
+    group.add_argument("--getfile-error-rate", type=float, default=0.0)
+    group.add_argument("--callback-latency", type=float, default=0.0)
+
+    group = parser.add_argument_group("запросы")
+    group.add_argument("--stats-ids", type=int, default=20, help="id в одном /message-stats")
+    group.add_argument("--sync-limit", type=int, default=500)
+    group.add_argument("--sync-timeout", type=float, default=600.0)
+    group.add_argument("--delivery", default="single", choices=("single", "pages", "ndjson"))
+    group.add_argument("--page-size", type=int, default=100)
+    group.add_argument("--parallel", action="store_true", help="параллельное чтение истории в /sync")
+
+    parser.add_argument("--json", dest="json_path", help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Задержка первого запроса /channel-info после запуска сервиса
+Для каждого режима запускает новый процесс сервиса с поддельным Telegram и измеряет
+время до готовности, первый запрос (клиент сессии ещё не подключён или прогрет)
+и следующий запрос той же сессии к другому каналу (клиент уже в пуле)
+
+    cd telegram_parser
+    python -m benchmarks.startup --runs 5
+
+Режимы: full — Client.start() (GetState, get_me, диспетчер обновлений),
+fast — CLIENT_FAST_START, warmup — быстрый запуск и CLIENT_WARMUP_FILE с этой сессией.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.load import start_app, wait_ready, _free_port
+
+MODES = ("full", "fast", "warmup")
+SESSION = "startup-session"
+
+
+async def measure(args: argparse.Namespace, mode: str, run: int) -> Dict[str, float]:
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="parser-startup-") as data_dir:
+        env = {"CLIENT_FAST_START": "false" if mode == "full" else "true"}
+        if mode == "warmup":
+            warmup_file = os.path.join(data_dir, "warmup_sessions")
+            with open(warmup_file, "w") as f:
+                f.write(SESSION + "\n")
+            env["CLIENT_WARMUP_FILE"] = warmup_file
+
+        started = time.perf_counter()
+        process = start_app(args, port, "http://127.0.0.1:9", data_dir, extra_env=env)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            await wait_ready(url)
+            ready = time.perf_counter() - started
+
+            async with httpx.AsyncClient(base_url=url, timeout=60.0) as client:
+                if mode == "warmup":
+                    await _wait_warm(client)
+                timings = {"ready_ms": ready * 1000}
+                for name, channel in (("first_ms", f"startup{run}a"), ("second_ms", f"startup{run}b")):
+                    request_started = time.perf_counter()
+                    response = await client.post("/channel-info", json={
+                        "channel_username": channel,
+                        "session_string": SESSION
+                    })
+                    if not response.json().get("success"):
+                        raise RuntimeError(f"/channel-info failed: {response.text}")
+                    timings[name] = (time.perf_counter() - request_started) * 1000
+                return timings
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+async def _wait_warm(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pool = (await client.get("/health")).json().get("client_pool") or {}
+        if pool.get("warm"):
+            return
+        await asyncio.sleep(0.05)
+    raise RuntimeError("Warmup did not finish")
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    print(f"{'mode':<8} {'ready ms':>9} {'first ms':>9} {'second ms':>10}")
+    for mode in args.modes.split(","):
+        runs = [await measure(args, mode, i) for i in range(args.runs)]
+        result = {"mode": mode}
+        for key in ("ready_ms", "first_ms", "second_ms"):
+            result[key] = statistics.median(timing[key] for timing in runs)
+        results.append(result)
+        print(f"{mode:<8} {result['ready_ms']:>9.1f} {result['first_ms']:>9.1f} {result['second_ms']:>10.1f}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка первого /channel-info: full, fast и warmup")
+    parser.add_argument("--modes", default=",".join(MODES), help="через запятую: " + ", ".join(MODES))
+    parser.add_argument("--runs", type=int, default=5, help="запусков сервиса на режим (берётся медиана)")
+    parser.add_argument("--app-log", action="store_true", help="показывать вывод сервиса")
+    parser.add_argument("--seed", type=int, default=42)
+
+    group = parser.add_argument_group("поддельный Telegram")
+    group.add_argument("--tg-latency", type=float, default=0.05, help="задержка одного вызова, сек")
+    group.add_argument("--tg-start-latency", type=float, default=0.3, help="подключение клиента, сек")
+
+    parser.add_argument("--json", dest="json_path", help="сохранить результаты в файл")
+    args = parser.parse_args()
+    # Параметры start_app, которые здесь не меняются
+    args.workers, args.history, args.tg_page_latency = 1, 100, 0.1
+    args.flood_rate, args.flood_seconds = 0.0, 2
+
+    results = asyncio.run(run(args))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Локальные заглушки внешних сервисов для нагрузочных тестов
+Bot API (getFile) и приёмник callback вместо Rails
+"""
+
+import asyncio
+import gzip
+import json
+import random
+import time
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def bot_api_app(latency: float = 0.05, error_rate: float = 0.0, seed: int = 42) -> FastAPI:
+    """Bot API: getFile отвечает file_path с задержкой (±50%), error_rate — доля ответов 429"""
+    app = FastAPI()
+    rng = random.Random(seed)
+    app.state.calls = 0
+
+    @app.get("/bot{token}/getFile")
+    async def get_file(token: str, file_id: str):
+        app.state.calls += 1
+        if latency:
+            await asyncio.sleep(latency * rng.uniform(0.5, 1.5))
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1"},
+                status_code=429
+            )
+        return {"ok": True, "result": {"file_id": file_id, "file_path": f"photos/{file_id[-16:]}.jpg"}}
+
+    return app
+
+
+class CallbackReceiver:
+    """
+    Приёмник callback: разбирает JSON, страницы и NDJSON (в том числе сжатые)
+    и отмечает момент, когда синхронизация доставлена целиком
+
+    Синхронизации различаются по channel_site_id, который задаёт нагрузочный драйвер.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self._posts: Dict[str, int] = {}
+        self._done: Dict[str, asyncio.Future] = {}
+        self.app = FastAPI()
+        self.app.post("/callback")(self._receive)
+
+    def expect(self, sync_id: str) -> asyncio.Future:
+        """Future, которое завершится итогом синхронизации {"status", "posts", "finished_at"}"""
+        future = asyncio.get_running_loop().create_future()
+        self._done[sync_id] = future
+        return future
+
+    async def _receive(self, request: Request):
+        body = await request.body()
+        self.requests += 1
+        self.bytes += len(body)
+        body = _decode(body, request.headers.get("content-encoding"))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            lines = [json.loads(line) for line in body.splitlines() if line]
+            header, complete = lines[0], lines[-1]
+            self._finish(header.get("channel_site_id"), "success", complete.get("total_posts", len(lines) - 2))
+            return {"success": True}
+
+        data = json.loads(body)
+        sync_id = data.get("channel_site_id")
+        if data.get("status") != "success":
+            self._finish(sync_id, "error", self._posts.pop(sync_id, 0))
+        elif "page" in data and not data.get("complete"):
+            self._posts[sync_id] = self._posts.get(sync_id, 0) + len(data.get("posts") or [])
+        else:
+            self._finish(sync_id, "success", self._posts.pop(sync_id, 0) + len(data.get("posts") or []))
+        return {"success": True}
+
+    def _finish(self, sync_id: Optional[str], status: str, posts: int):
+        future = self._done.pop(sync_id, None)
+        if future and not future.done():
+            future.set_result({"status": status, "posts": posts, "finished_at": time.perf_counter()})
+
+
+def _decode(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
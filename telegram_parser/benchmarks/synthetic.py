@@ -0,0 +1,162 @@
+"""
+Синтетические сообщения Pyrogram для бенчмарков
+Настоящие объекты pyrogram.types, детерминированные по seed — результаты сравнимы между коммитами
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from pyrogram import enums, types
+
+BASE_DATE = datetime(2024, 1, 1)
+
+WORDS = (
+    "канал", "новости", "обзор", "релиз", "подписчики", "telegram", "python", "сегодня",
+    "обновление", "статистика", "контент", "пост", "видео", "ссылка", "подробнее", "итоги"
+)
+ENTITY_TYPES = (
+    enums.MessageEntityType.BOLD,
+    enums.MessageEntityType.ITALIC,
+    enums.MessageEntityType.CODE,
+    enums.MessageEntityType.HASHTAG,
+    enums.MessageEntityType.TEXT_LINK,
+    enums.MessageEntityType.MENTION,
+)
+EMOJI = ("👍", "🔥", "❤", "😁", "🤔", "👎", "🎉", "😢")
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _entities(rng: random.Random, text: str, count: int) -> List[types.MessageEntity]:
+    result = []
+    for _ in range(count):
+        entity_type = rng.choice(ENTITY_TYPES)
+        offset = rng.randrange(0, max(1, len(text) - 10))
+        result.append(types.MessageEntity(
+            type=entity_type,
+            offset=offset,
+            length=rng.randint(1, 10),
+            url="https://example.com/" + str(rng.randrange(10 ** 6)) if entity_type == enums.MessageEntityType.TEXT_LINK else None
+        ))
+    return result
+
+
+def _file_ids(kind: str, i: int):
+    return f"{kind}AAxkBAAI{i:010d}AAHmZQ", f"AQAD{kind}{i:08d}"
+
+
+def _thumb(kind: str, i: int) -> types.Thumbnail:
+    file_id, file_unique_id = _file_ids(kind + "t", i)
+    return types.Thumbnail(file_id=file_id, file_unique_id=file_unique_id, width=320, height=180, file_size=12_000)
+
+
+def _message(i: int, **fields) -> types.Message:
+    return types.Message(
+        id=i,
+        date=BASE_DATE + timedelta(minutes=i),
+        views=(i * 37) % 100000,
+        forwards=i % 13,
+        **fields
+    )
+
+
+def text_only(rng: random.Random, i: int) -> types.Message:
+    """Короткий текстовый пост с парой entities"""
+    text = _text(rng, 40)
+    return _message(i, text=text, entities=_entities(rng, text, 2))
+
+
+def heavy_entities(rng: random.Random, i: int) -> types.Message:
+    """Длинный пост с плотным форматированием"""
+    text = _text(rng, 300)
+    return _message(i, text=text, entities=_entities(rng, text, 60))
+
+
+def photo(rng: random.Random, i: int) -> types.Message:
+    """Фото с подписью"""
+    file_id, file_unique_id = _file_ids("photo", i)
+    caption = _text(rng, 25)
+    return _message(
+        i,
+        media=enums.MessageMediaType.PHOTO,
+        photo=types.Photo(
+            file_id=file_id, file_unique_id=file_unique_id,
+            width=1280, height=720, file_size=180_000, date=BASE_DATE,
+            thumbs=[_thumb("photo", i)]
+        ),
+        caption=caption,
+        caption_entities=_entities(rng, caption, 3),
+        has_media_spoiler=i % 10 == 0
+    )
+
+
+def video(rng: random.Random, i: int) -> types.Message:
+    """Видео с подписью"""
+    file_id, file_unique_id = _file_ids("video", i)
+    caption = _text(rng, 25)
+    return _message(
+        i,
+        media=enums.MessageMediaType.VIDEO,
+        video=types.Video(
+            file_id=file_id, file_unique_id=file_unique_id,
+            width=1920, height=1080, duration=rng.randint(5, 600), file_size=25_000_000,
+            thumbs=[_thumb("video", i)]
+        ),
+        caption=caption,
+        caption_entities=_entities(rng, caption, 3)
+    )
+
+
+def document(rng: random.Random, i: int) -> types.Message:
+    """Документ с подписью"""
+    file_id, file_unique_id = _file_ids("doc", i)
+    caption = _text(rng, 10)
+    return _message(
+        i,
+        media=enums.MessageMediaType.DOCUMENT,
+        document=types.Document(
+            file_id=file_id, file_unique_id=file_unique_id,
+            file_name=f"report_{i}.pdf", mime_type="application/pdf", file_size=2_000_000
+        ),
+        caption=caption
+    )
+
+
+def reactions(rng: random.Random, i: int) -> types.Message:
+    """Текстовый пост с реакциями, в том числе custom emoji"""
+    text = _text(rng, 40)
+    items = [types.Reaction(emoji=emoji, count=rng.randint(1, 5000)) for emoji in rng.sample(EMOJI, 5)]
+    items += [types.Reaction(custom_emoji_id=5_000_000_000 + rng.randrange(10 ** 6), count=rng.randint(1, 500)) for _ in range(3)]
+    return _message(
+        i,
+        text=text,
+        entities=_entities(rng, text, 2),
+        reactions=types.MessageReactions(reactions=items)
+    )
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, int], types.Message]] = {
+    "text": text_only,
+    "entities": heavy_entities,
+    "photo": photo,
+    "video": video,
+    "document": document,
+    "reactions": reactions,
+}
+
+
+def build(scenario: str, count: int, seed: int = 42) -> List[types.Message]:
+    """count сообщений одного сценария (id убывают, как в истории канала)"""
+    rng = random.Random(f"{seed}:{scenario}")
+    factory = SCENARIOS[scenario]
+    return [factory(rng, count - i) for i in range(count)]
+
+
+def build_mixed(count: int, seed: int = 42) -> List[types.Message]:
+    """Смесь всех сценариев по очереди — примерно как в реальном канале"""
+    rng = random.Random(f"{seed}:mixed")
+    factories = list(SCENARIOS.values())
+    return [factories[i % len(factories)](rng, count - i) for i in range(count)]
@@ -0,0 +1,182 @@
+"""
+Микробенчмарки преобразования сообщений и сериализации callback
+Без сети и Telegram: на синтетических сообщениях Pyrogram из benchmarks.synthetic
+
+    cd telegram_parser
+    python -m benchmarks.transform --sizes 1000,10000,100000 --json before.json
+    python -m benchmarks.transform --sizes 1000,10000,100000 --compare before.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import synthetic
+from parser import TelegramChannelParser
+from records import dumps as dumps_json
+
+DEFAULT_SIZES = "1000,10000"
+
+# Бенчмарк: (подготовка входа из сообщений, функция от входа)
+Benchmark = Tuple[Callable[[list], Any], Callable[[Any], Any]]
+
+
+def _benchmarks(parser: TelegramChannelParser) -> Dict[str, Tuple[str, Benchmark]]:
+    """Имя бенчмарка → (сценарий сообщений, бенчмарк)"""
+
+    def parse_messages(messages):
+        return [parser._parse_message(message) for message in messages]
+
+    def parse_entities(entity_lists):
+        return [parser._parse_entities(entities) for entities in entity_lists]
+
+    def parse_reactions(reaction_lists):
+        return [parser._parse_reactions(reactions) for reactions in reaction_lists]
+
+    def parsed_posts(messages):
+        posts = parse_messages(messages)
+        for post in posts:
+            for item in post.media:
+                item.url = f"https://api.telegram.org/file/bot0000:TOKEN/photos/{item.file_unique_id}.jpg"
+        return {"channel_site_id": "00000000-0000-0000-0000-000000000000", "status": "success", "posts": posts}
+
+    result: Dict[str, Tuple[str, Benchmark]] = {
+        f"parse_message/{scenario}": (scenario, (lambda messages: messages, parse_messages))
+        for scenario in synthetic.SCENARIOS
+    }
+    result["parse_entities/entities"] = (
+        "entities", (lambda messages: [m.entities for m in messages], parse_entities)
+    )
+    result["parse_reactions/reactions"] = (
+        "reactions", (lambda messages: [m.reactions for m in messages], parse_reactions)
+    )
+    result["serialize/mixed"] = ("mixed", (parsed_posts, dumps_json))
+    return result
+
+
+def measure(fn: Callable[[Any], Any], data: Any, size: int, repeat: int) -> Dict[str, Any]:
+    """Лучшее время из repeat прогонов и пиковая память одного прогона"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    output = fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "size": size,
+        "seconds": best,
+        "ops_per_sec": size / best if best else None,
+        "peak_bytes": peak,
+        "bytes_per_message": peak / size
+    }
+    if isinstance(output, bytes):
+        result["output_bytes"] = len(output)
+    return result
+
+
+def run(sizes: List[int], repeat: int, only: Optional[str] = None, seed: int = 42) -> List[Dict[str, Any]]:
+    parser = TelegramChannelParser(api_id=0, api_hash="", session_string="")
+    benchmarks = _benchmarks(parser)
+    results = []
+
+    for size in sizes:
+        messages: Dict[str, list] = {}
+        for name, (scenario, (prepare, fn)) in benchmarks.items():
+            if only and only not in name:
+                continue
+            if scenario not in messages:
+                messages[scenario] = (
+                    synthetic.build_mixed(size, seed) if scenario == "mixed" else synthetic.build(scenario, size, seed)
+                )
+            data = prepare(messages[scenario])
+            result = measure(fn, data, size, repeat)
+            result["name"] = name
+            results.append(result)
+            print(_format_row(result), flush=True)
+        messages.clear()
+
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str):
+    """Сравнить с сохранённым прогоном (--json) — разница ops/sec и памяти в процентах"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+
+    print(f"\nСравнение с {baseline_path} (коммит {baseline.get('commit') or '?'})")
+    print(f"{'benchmark':<28} {'size':>7} {'ops/s':>12} {'Δ ops/s':>9} {'B/msg':>9} {'Δ mem':>8}")
+    for result in results:
+        old = previous.get((result["name"], result["size"]))
+        if not old:
+            continue
+        speed = (result["ops_per_sec"] / old["ops_per_sec"] - 1) * 100
+        memory = (result["bytes_per_message"] / old["bytes_per_message"] - 1) * 100 if old["bytes_per_message"] else 0
+        print(
+            f"{result['name']:<28} {result['size']:>7} {result['ops_per_sec']:>12,.0f} "
+            f"{speed:>+8.1f}% {result['bytes_per_message']:>9,.0f} {memory:>+7.1f}%"
+        )
+
+
+def _format_row(result: Dict[str, Any]) -> str:
+    row = (
+        f"{result['name']:<28} {result['size']:>7} {result['ops_per_sec']:>12,.0f} ops/s "
+        f"{result['seconds'] / result['size'] * 1e6:>8.2f} µs/op "
+        f"{result['peak_bytes'] / 1e6:>8.1f} MB peak {result['bytes_per_message']:>7,.0f} B/msg"
+    )
+    if "output_bytes" in result:
+        row += f" {result['output_bytes'] / result['size']:>6,.0f} B/msg JSON"
+    return row
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки преобразования сообщений")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="размеры через запятую (например 1000,10000,100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько прогонов, берётся лучший")
+    parser.add_argument("--only", help="запускать только бенчмарки, в имени которых есть эта строка")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="сохранить результаты в файл")
+    parser.add_argument("--compare", help="сравнить с результатами из файла --json")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.repeat, args.only, args.seed)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "results": results
+            }, f, indent=2)
+        print(f"\nРезультаты сохранены в {args.json_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
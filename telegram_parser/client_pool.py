@@ -0,0 +1,314 @@
+"""
+Пул долгоживущих клиентов Pyrogram
+Держит запущенные клиенты между запросами, ключ — хеш session_string
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, AsyncIterator, List
+
+from pyrogram import Client
+from pyrogram.errors import Unauthorized, AuthKeyUnregistered
+
+
+def session_key(session_string: str) -> str:
+    """Ключ сессии для реестров: session_string в открытом виде не храним"""
+    return hashlib.sha256(session_string.encode()).hexdigest()[:32]
+
+
+async def start_client(client: Client, fast_start: bool = True):
+    """
+    Подключить клиент Pyrogram
+
+    Client.start() после подключения вызывает updates.GetState и get_me и запускает
+    диспетчер обновлений — парсеру это не нужно. В быстром режиме выполняется только
+    connect() (ключ авторизации из session_string и InitConnection), после которого уже
+    работают get_chat, get_messages и скачивание файлов. Неавторизованная сессия в быстром
+    режиме — ошибка, а не интерактивный запрос номера телефона.
+    """
+    if not fast_start:
+        await client.start()
+        return
+
+    try:
+        authorized = await client.connect()
+    except BaseException:
+        if client.is_connected:
+            await client.disconnect()
+        raise
+    if not authorized:
+        await client.disconnect()
+        raise AuthKeyUnregistered()
+
+
+class _PooledClient:
+    """Запись пула: клиент, счётчик использований и время последнего обращения"""
+
+    __slots__ = ("client", "in_use", "last_used", "ready", "broken")
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.ready = asyncio.Event()
+        self.broken: Optional[BaseException] = None
+
+
+class ClientPool:
+    """
+    Реестр запущенных клиентов Pyrogram
+
+    Выдаёт уже подключённые клиенты по session_string, вытесняет простаивающие
+    по LRU/TTL и ограничивает общее количество открытых соединений.
+    """
+
+    def __init__(
+        self,
+        api_id: int,
+        api_hash: str,
+        max_clients: int = 20,
+        idle_ttl: float = 600.0,
+        reap_interval: float = 30.0,
+        fast_start: bool = True
+    ):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+        self.fast_start = fast_start
+        self._clients: "OrderedDict[str, _PooledClient]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._slot_freed = asyncio.Condition(self._lock)
+        self._reaper: Optional[asyncio.Task] = None
+        self._warmup: Optional[asyncio.Task] = None
+        # Остановки вытесненных клиентов, идущие в фоне
+        self._stopping: set = set()
+        # Сессии из списка прогрева не отключаются по простою
+        self._pinned: set = set()
+        self._closed = False
+        self.started_total = 0
+        self.start_seconds_total = 0.0
+        self.evicted_total = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        """Запустить фоновое вытеснение простаивающих клиентов"""
+        self._closed = False
+        if not self._reaper:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    def warmup(self, session_strings: List[str], concurrency: int = 4):
+        """
+        Заранее подключить клиенты сессий (в фоне, не задерживая запуск приложения)
+
+        Запрос, пришедший во время прогрева, дожидается того же подключения.
+        Прогретые сессии не отключаются по простою (но могут быть вытеснены,
+        если пул заполнен).
+        """
+        session_strings = list(dict.fromkeys(session_strings))[:self.max_clients]
+        if not session_strings:
+            return
+        self._pinned.update(session_key(session_string) for session_string in session_strings)
+        self._warmup = asyncio.create_task(self._warmup_loop(session_strings, concurrency))
+
+    async def close(self):
+        """Остановить все клиенты пула (вызывается при завершении приложения)"""
+        self._closed = True
+        if self._warmup:
+            self._warmup.cancel()
+            try:
+                await self._warmup
+            except asyncio.CancelledError:
+                pass
+            self._warmup = None
+        if self._reaper:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+
+        async with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+
+        await asyncio.gather(*(self._stop_client(entry) for entry in entries))
+        await asyncio.gather(*self._stopping)
+
+    @asynccontextmanager
+    async def acquire(self, session_string: str) -> AsyncIterator[Client]:
+        """
+        Получить запущенный клиент для session_string
+
+        Клиент остаётся в пуле после выхода из контекста. Если во время
+        использования соединение оказалось сломано, клиент удаляется из пула.
+        """
+        key = session_key(session_string)
+        entry = await self._checkout(key, session_string)
+        try:
+            yield entry.client
+        except (ConnectionError, OSError, Unauthorized) as e:
+            entry.broken = e
+            raise
+        finally:
+            await self._checkin(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пула"""
+        return {
+            "open": len(self._clients),
+            "in_use": sum(1 for entry in self._clients.values() if entry.in_use),
+            "max_clients": self.max_clients,
+            "idle_ttl": self.idle_ttl,
+            "fast_start": self.fast_start,
+            "warm": sum(
+                1 for key, entry in self._clients.items()
+                if key in self._pinned and entry.ready.is_set() and entry.broken is None
+            ),
+            "started_total": self.started_total,
+            "start_avg_ms": round(self.start_seconds_total / self.started_total * 1000, 1) if self.started_total else None,
+            "evicted_total": self.evicted_total,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    async def _checkout(self, key: str, session_string: str) -> _PooledClient:
+        async with self._lock:
+            if self._closed:
+                raise RuntimeError("Client pool is closed")
+
+            while True:
+                entry = self._clients.get(key)
+                if entry and entry.broken is None:
+                    self.hits += 1
+                    entry.in_use += 1
+                    self._clients.move_to_end(key)
+                    created = False
+                    break
+
+                if entry is None and len(self._clients) >= self.max_clients:
+                    victim_key = self._lru_idle_key()
+                    if victim_key is None:
+                        # Все клиенты заняты — ждём освобождения слота
+                        # (пока ждём, клиент для этого ключа мог появиться)
+                        await self._slot_freed.wait()
+                        continue
+                    victim = self._clients.pop(victim_key)
+                    self.evicted_total += 1
+                    task = asyncio.create_task(self._stop_client(victim))
+                    self._stopping.add(task)
+                    task.add_done_callback(self._stopping.discard)
+                    continue
+
+                self.misses += 1
+                entry = _PooledClient(self._create_client(key, session_string))
+                entry.in_use = 1
+                self._clients[key] = entry
+                created = True
+                break
+
+        if created:
+            try:
+                started = time.monotonic()
+                await self._start_client(entry.client)
+                self.start_seconds_total += time.monotonic() - started
+                self.started_total += 1
+            except BaseException as e:
+                entry.broken = e
+                entry.ready.set()
+                await self._checkin(key, entry)
+                raise
+            entry.ready.set()
+        else:
+            await entry.ready.wait()
+            if entry.broken is not None:
+                await self._checkin(key, entry)
+                raise entry.broken
+
+        return entry
+
+    async def _checkin(self, key: str, entry: _PooledClient):
+        async with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            drop = entry.broken is not None and entry.in_use == 0
+            if drop and self._clients.get(key) is entry:
+                del self._clients[key]
+            self._slot_freed.notify_all()
+
+        if drop:
+            await self._stop_client(entry)
+
+    def _lru_idle_key(self) -> Optional[str]:
+        for key, entry in self._clients.items():
+            if entry.in_use == 0:
+                return key
+        return None
+
+    def _create_client(self, key: str, session_string: str) -> Client:
+        return Client(
+            name=f"pool_{key[:12]}",
+            api_id=self.api_id,
+            api_hash=self.api_hash,
+            session_string=session_string,
+            in_memory=True,
+            # Сервер не присылает обновления: клиент пула их не обрабатывает
+            no_updates=self.fast_start
+        )
+
+    async def _start_client(self, client: Client):
+        await start_client(client, self.fast_start)
+
+    async def _stop_client(self, entry: _PooledClient):
+        # Ждём завершения запуска, чтобы не останавливать клиент на полпути
+        await entry.ready.wait()
+        client = entry.client
+        try:
+            if client.is_initialized:
+                await client.stop()
+            elif client.is_connected:
+                await client.disconnect()
+        except Exception as e:
+            print(f"[POOL] Failed to stop client: {type(e).__name__} - {e}")
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            deadline = time.monotonic() - self.idle_ttl
+            async with self._lock:
+                expired = [
+                    key for key, entry in self._clients.items()
+                    if entry.in_use == 0 and entry.last_used < deadline and key not in self._pinned
+                ]
+                victims = [self._clients.pop(key) for key in expired]
+                self.evicted_total += len(victims)
+                if victims:
+                    self._slot_freed.notify_all()
+
+            for victim in victims:
+                await self._stop_client(victim)
+
+    async def _warmup_loop(self, session_strings: List[str], concurrency: int):
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        started = time.monotonic()
+
+        async def connect(session_string: str) -> bool:
+            async with semaphore:
+                try:
+                    async with self.acquire(session_string):
+                        return True
+                except Exception as e:
+                    print(f"[POOL] Warmup failed for session {session_key(session_string)[:8]}: {type(e).__name__} - {e}")
+                    return False
+
+        results = await asyncio.gather(*(connect(session_string) for session_string in session_strings))
+        print(
+            f"[POOL] Warmup: {sum(results)}/{len(results)} clients connected "
+            f"in {time.monotonic() - started:.2f}s (fast_start={self.fast_start})"
+        )
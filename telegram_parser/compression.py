@@ -0,0 +1,140 @@
+"""
+Сжатие тела callback в Rails
+gzip или zstd с порогом размера: маленькие ответы уходят как есть
+"""
+
+import gzip
+import zlib
+from typing import Dict, Any, Optional, AsyncIterator, Tuple
+from urllib.parse import urlsplit
+
+import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен — без пакета используется gzip
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+NONE = "none"
+ENCODINGS = (GZIP, ZSTD, NONE)
+
+
+class CallbackCompressor:
+    """
+    Сжатие callback и счётчики переданных байт
+
+    Если адрес ответил 415 Unsupported Media Type на сжатое тело, кодировка
+    для этого хоста запоминается как неподдерживаемая и дальше не используется.
+    """
+
+    def __init__(
+        self,
+        encoding: str = NONE,
+        min_size: int = 16 * 1024,
+        gzip_level: int = 6,
+        zstd_level: int = 3
+    ):
+        self.encoding = self._available(encoding)
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self._rejected: Dict[str, set] = {}
+        self.requests = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def choose(self, url: str, encoding: Optional[str] = None) -> Optional[str]:
+        """Кодировка для запроса: явно заданная или общая, если адрес её принимает"""
+        encoding = self._available(encoding or self.encoding)
+        if encoding == NONE or encoding in self._rejected.get(_host(url), ()):
+            return None
+        return encoding
+
+    def reject(self, url: str, encoding: str):
+        """Адрес не принимает кодировку — больше её не использовать"""
+        self._rejected.setdefault(_host(url), set()).add(encoding)
+        print(f"[CALLBACK] {_host(url)} rejected {encoding} body, sending uncompressed from now on")
+
+    def compress(self, body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """
+        Сжать тело, если оно не меньше порога
+
+        Returns:
+            (тело, значение Content-Encoding или None)
+        """
+        if not encoding or len(body) < self.min_size:
+            return body, None
+        if encoding == ZSTD:
+            return zstandard.ZstdCompressor(level=self.zstd_level).compress(body), ZSTD
+        return gzip.compress(body, compresslevel=self.gzip_level), GZIP
+
+    async def compress_stream(self, chunks: AsyncIterator[bytes], encoding: Optional[str]) -> AsyncIterator[bytes]:
+        """
+        Сжимать потоковое тело на лету (размер заранее неизвестен, поэтому без порога)
+
+        Без кодировки тело передаётся как есть — только учитывается его объём.
+        """
+        compressor = None
+        if encoding == ZSTD:
+            compressor = zstandard.ZstdCompressor(level=self.zstd_level).compressobj()
+        elif encoding:
+            compressor = _gzip_compressobj(self.gzip_level)
+
+        raw = sent = 0
+        async for chunk in chunks:
+            raw += len(chunk)
+            data = compressor.compress(chunk) if compressor else chunk
+            if data:
+                sent += len(data)
+                yield data
+        if compressor:
+            data = compressor.flush()
+            sent += len(data)
+            yield data
+        self.record(raw, sent, encoding)
+        print(f"[CALLBACK] Streamed bytes: {raw}" + (f", {encoding}: {sent}" if encoding else ""))
+
+    def record(self, raw_bytes: int, sent_bytes: int, encoding: Optional[str]):
+        """Учесть отправленный запрос"""
+        self.requests += 1
+        self.raw_bytes += raw_bytes
+        self.sent_bytes += sent_bytes
+        metrics.CALLBACK_BYTES.labels("raw").inc(raw_bytes)
+        metrics.CALLBACK_BYTES.labels("sent").inc(sent_bytes)
+        if encoding:
+            self.compressed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики сжатия"""
+        return {
+            "encoding": self.encoding,
+            "min_size": self.min_size,
+            "zstd_available": zstandard is not None,
+            "requests": self.requests,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "sent_bytes": self.sent_bytes,
+            "ratio": round(self.sent_bytes / self.raw_bytes, 3) if self.raw_bytes else None,
+            "rejected": {host: sorted(encodings) for host, encodings in self._rejected.items()}
+        }
+
+    def _available(self, encoding: str) -> str:
+        encoding = (encoding or NONE).lower()
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported callback compression: {encoding}")
+        if encoding == ZSTD and zstandard is None:
+            print("[CALLBACK] zstandard is not installed, falling back to gzip")
+            return GZIP
+        return encoding
+
+
+def _gzip_compressobj(level: int):
+    # wbits=31 — формат gzip (заголовок и CRC), совместимый с gzip.decompress
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
@@ -0,0 +1,171 @@
+"""
+Доставка результатов синхронизации в callback Rails
+Страницами по N постов или одним потоковым NDJSON-запросом
+"""
+
+import time
+import uuid
+from typing import Dict, Any, Optional, AsyncIterator, Awaitable, Callable, List
+
+import httpx
+
+import metrics
+from compression import CallbackCompressor
+from records import Post, dumps as dumps_json
+
+# Как часто сообщать о прогрессе (в постах)
+PROGRESS_EVERY = 50
+
+
+class HighWaterMark:
+    """Считает отправленные посты и запоминает самый свежий (новый курсор)"""
+
+    def __init__(
+        self,
+        message_id: Optional[int] = None,
+        date: Optional[int] = None,
+        on_progress: Optional[Callable[[int], None]] = None
+    ):
+        self.message_id = message_id
+        self.date = date
+        self.count = 0
+        self.on_progress = on_progress
+
+    async def track(self, posts: AsyncIterator[Post]) -> AsyncIterator[Post]:
+        """Пропустить посты через себя, обновляя курсор"""
+        async for post in posts:
+            self.count += 1
+            if post.message_id and (self.message_id is None or post.message_id > self.message_id):
+                self.message_id = post.message_id
+            if post.date and (self.date is None or post.date > self.date):
+                self.date = post.date
+            if self.on_progress and self.count % PROGRESS_EVERY == 0:
+                self.on_progress(self.count)
+            yield post
+
+        if self.on_progress:
+            self.on_progress(self.count)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"message_id": self.message_id, "date": self.date}
+
+
+async def deliver_pages(
+    send: Callable[[str, dict], Awaitable[bool]],
+    url: str,
+    envelope: Dict[str, Any],
+    posts: AsyncIterator[Post],
+    page_size: int,
+    high_water_mark: HighWaterMark,
+    completion: Optional[Callable[[], Dict[str, Any]]] = None
+) -> bool:
+    """
+    Отправить посты в callback страницами
+
+    Каждая страница — обычный callback со status=success, своими posts,
+    sync_id и порядковым номером page. Последняя страница (с оставшимися
+    постами, возможно пустая) помечается complete=true и содержит общее
+    количество постов, high_water_mark и поля completion() (если задан).
+
+    Returns:
+        True, если Rails принял все страницы
+    """
+    sync_id = str(uuid.uuid4())
+    page = 0
+    batch: List[Post] = []
+
+    async def flush(complete: bool) -> bool:
+        nonlocal page, batch
+        page += 1
+        data = dict(envelope)
+        data.update({
+            "status": "success",
+            "sync_id": sync_id,
+            "page": page,
+            "complete": complete,
+            "posts": batch
+        })
+        if complete:
+            data["total_posts"] = high_water_mark.count
+            data["high_water_mark"] = high_water_mark.as_dict()
+            if completion:
+                data.update(completion())
+        batch = []
+        return await send(url, data)
+
+    async for post in high_water_mark.track(posts):
+        batch.append(post)
+        if len(batch) >= page_size:
+            if not await flush(complete=False):
+                return False
+
+    # Последние посты уходят вместе с маркером завершения
+    return await flush(complete=True)
+
+
+async def deliver_ndjson(
+    client: httpx.AsyncClient,
+    url: str,
+    envelope: Dict[str, Any],
+    posts: AsyncIterator[Post],
+    high_water_mark: HighWaterMark,
+    compressor: Optional[CallbackCompressor] = None,
+    encoding: Optional[str] = None,
+    completion: Optional[Callable[[], Dict[str, Any]]] = None
+) -> bool:
+    """
+    Отправить посты одним запросом с потоковым телом application/x-ndjson
+
+    Первая строка — заголовок ({"type": "header", ...envelope}),
+    далее по строке на пост ({"type": "post", "post": {...}}),
+    последняя — {"type": "complete", "total_posts": N, "high_water_mark": {...}}
+    и поля completion() (если задан).
+    Если задана кодировка (gzip или zstd), тело сжимается на лету.
+
+    Returns:
+        True, если Rails принял запрос
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        header = dict(envelope)
+        header.update({"type": "header", "status": "success"})
+        yield _ndjson_line(header)
+        async for post in high_water_mark.track(posts):
+            yield _ndjson_line({"type": "post", "post": post})
+        complete = {
+            "type": "complete",
+            "total_posts": high_water_mark.count,
+            "high_water_mark": high_water_mark.as_dict()
+        }
+        if completion:
+            complete.update(completion())
+        yield _ndjson_line(complete)
+
+    headers = {"Content-Type": "application/x-ndjson"}
+    content = body()
+    if compressor:
+        content = compressor.compress_stream(content, encoding)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+    started = time.perf_counter()
+    try:
+        print(f"[CALLBACK] Streaming NDJSON to {url}" + (f" ({encoding})" if encoding else ""))
+        response = await client.post(url, content=content, headers=headers)
+        if encoding and response.status_code == 415:
+            # Поток уже прочитан — повторить нельзя, но следующие запросы пойдут без сжатия
+            compressor.reject(url, encoding)
+        response.raise_for_status()
+        metrics.CALLBACK_SECONDS.labels("ndjson", "success").observe(time.perf_counter() - started)
+        print(f"[CALLBACK] NDJSON stream accepted, posts: {high_water_mark.count}, status: {response.status_code}")
+        return True
+    except httpx.HTTPError as e:
+        metrics.CALLBACK_SECONDS.labels("ndjson", "error").observe(time.perf_counter() - started)
+        # Ошибки чтения истории пробрасываются дальше — их обработает вызывающий код
+        print(f"[CALLBACK] Failed to stream NDJSON callback: {e}")
+        print(f"[CALLBACK] callback_url={url}")
+        return False
+
+
+def _ndjson_line(data: Dict[str, Any]) -> bytes:
+    return dumps_json(data) + b"\n"
@@ -0,0 +1,167 @@
+"""
+Кеш file_id → file_path для Telegram Bot API
+Память (LRU) перед локальной SQLite, чтобы повторные синхронизации не вызывали getFile
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# Ссылки Bot API на скачивание гарантированно живут не меньше часа,
+# поэтому держим file_path чуть меньше этого срока
+DEFAULT_TTL = 55 * 60
+
+# Файлы больше 20 МБ Bot API не отдаёт никогда — такой ответ можно помнить долго
+TOO_BIG_TTL = 7 * 24 * 3600
+
+# Прочие отказы (файл недоступен, неверный file_id) — повторяем реже, но не навсегда
+NEGATIVE_TTL = 30 * 60
+
+# Через сколько записей удалять из базы истёкшие строки (иначе она растёт до перезапуска)
+PURGE_EVERY = 1000
+
+
+class FileUrlCache:
+    """
+    Двухуровневый кеш результатов getFile
+
+    Ключ — отпечаток бота + file_unique_id (или file_id, если unique id нет).
+    Хранится только file_path, токен бота в кеш не попадает.
+    Отрицательные записи (file_path = None) сохраняют отказ Bot API.
+    Истёкшие строки удаляются при открытии и каждые purge_every записей.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+        too_big_ttl: float = TOO_BIG_TTL,
+        memory_size: int = 10000,
+        purge_every: int = PURGE_EVERY
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.too_big_ttl = too_big_ttl
+        self.memory_size = memory_size
+        self.purge_every = purge_every
+        self._writes = 0
+        self._memory: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    def open(self):
+        """Открыть (и при необходимости создать) базу"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_paths ("
+            " key TEXT PRIMARY KEY,"
+            " file_path TEXT,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._purge()
+
+    def close(self):
+        """Закрыть базу"""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def make_key(bot_token: str, file_id: str, file_unique_id: Optional[str] = None) -> str:
+        """Ключ кеша: file_path зависит от бота, поэтому в ключ входит хеш токена"""
+        bot = hashlib.sha256(bot_token.encode()).hexdigest()[:16]
+        if file_unique_id:
+            return f"{bot}:u:{file_unique_id}"
+        return f"{bot}:f:{file_id}"
+
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        """
+        Найти file_path в кеше
+
+        Returns:
+            (найдено, file_path); file_path = None у отрицательной записи
+        """
+        now = time.time()
+
+        cached = self._memory.get(key)
+        if cached is not None:
+            file_path, expires_at = cached
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                if file_path is None:
+                    self.negative_hits += 1
+                return True, file_path
+            del self._memory[key]
+
+        if self._db:
+            row = self._db.execute(
+                "SELECT file_path, expires_at FROM file_paths WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                if row[0] is None:
+                    self.negative_hits += 1
+                return True, row[0]
+
+        self.misses += 1
+        return False, None
+
+    def set(self, key: str, file_path: str):
+        """Сохранить успешный результат getFile"""
+        self._store(key, file_path, time.time() + self.ttl)
+
+    def set_negative(self, key: str, too_big: bool = False):
+        """Запомнить отказ Bot API для файла"""
+        ttl = self.too_big_ttl if too_big else self.negative_ttl
+        self._store(key, None, time.time() + ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий и промахов"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "purged": self.purged,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None
+        }
+
+    def _store(self, key: str, file_path: Optional[str], expires_at: float):
+        self._remember(key, file_path, expires_at)
+        if self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_paths (key, file_path, expires_at) VALUES (?, ?, ?)",
+                (key, file_path, expires_at)
+            )
+            self._writes += 1
+            if self._writes >= self.purge_every:
+                self._purge()
+
+    def _purge(self):
+        self._writes = 0
+        cursor = self._db.execute("DELETE FROM file_paths WHERE expires_at < ?", (time.time(),))
+        self.purged += cursor.rowcount
+
+    def _remember(self, key: str, file_path: Optional[str], expires_at: float):
+        self._memory[key] = (file_path, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
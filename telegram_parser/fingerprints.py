@@ -0,0 +1,242 @@
+"""
+Отпечатки постов для синхронизации в режиме diff
+Для каждого канала хранится message_id → 64-битный хеш содержимого поста и tombstones
+удалённых постов; при повторной синхронизации в Rails уходят только новые и изменённые посты
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Any, Optional, AsyncIterator, List
+
+from records import Post, dumps as dumps_json
+
+
+def fingerprint(post: Post) -> int:
+    """Хеш того, что видит читатель: текст, форматирование, файлы, время редактирования (без views и реакций)"""
+    content = dumps_json([
+        post.text,
+        post.entities,
+        [item.file_unique_id for item in post.media],
+        post.has_media_spoiler,
+        post.edit_date
+    ])
+    return int.from_bytes(hashlib.blake2b(content, digest_size=8).digest(), "little", signed=True)
+
+
+class ChannelFingerprints:
+    """
+    Индекс одного канала в упакованных массивах
+
+    ids отсортированы по возрастанию, hashes — в том же порядке; на пост уходит
+    16 байт, поэтому канал на 100 тысяч постов занимает около 1,6 МБ.
+    """
+
+    __slots__ = ("ids", "hashes", "tombstones")
+
+    def __init__(self, ids: array = None, hashes: array = None, tombstones: array = None):
+        self.ids = ids if ids is not None else array("q")
+        self.hashes = hashes if hashes is not None else array("q")
+        self.tombstones = tombstones if tombstones is not None else array("q")
+
+    def get(self, message_id: int) -> Optional[int]:
+        index = bisect_left(self.ids, message_id)
+        if index < len(self.ids) and self.ids[index] == message_id:
+            return self.hashes[index]
+        return None
+
+    def is_deleted(self, message_id: int) -> bool:
+        return _contains(self.tombstones, message_id)
+
+
+class FingerprintStore:
+    """
+    Индексы отпечатков в локальной SQLite: одна строка (три BLOB) на канал
+
+    Ключ — как у курсоров: username канала, тип импорта и id получателя в Rails.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Открыть (и при необходимости создать) базу"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " channel TEXT NOT NULL,"
+            " import_type TEXT NOT NULL,"
+            " target_id TEXT NOT NULL,"
+            " ids BLOB NOT NULL,"
+            " hashes BLOB NOT NULL,"
+            " tombstones BLOB NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (channel, import_type, target_id))"
+        )
+
+    def close(self):
+        """Закрыть базу"""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def load(self, channel_username: str, import_type: str, target_id: Optional[str]) -> ChannelFingerprints:
+        """Индекс канала (пустой, если канал ещё не синхронизировался в режиме diff)"""
+        row = self._db.execute(
+            "SELECT ids, hashes, tombstones FROM fingerprints"
+            " WHERE channel = ? AND import_type = ? AND target_id = ?",
+            _key(channel_username, import_type, target_id)
+        ).fetchone()
+        if not row:
+            return ChannelFingerprints()
+        return ChannelFingerprints(*(_unpack(blob) for blob in row))
+
+    def save(self, channel_username: str, import_type: str, target_id: Optional[str], index: ChannelFingerprints):
+        self._db.execute(
+            "INSERT OR REPLACE INTO fingerprints (channel, import_type, target_id, ids, hashes, tombstones, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _key(channel_username, import_type, target_id) + (
+                index.ids.tobytes(), index.hashes.tobytes(), index.tombstones.tobytes(), time.time()
+            )
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(ids)), 0) / 8 FROM fingerprints"
+        ).fetchone() if self._db else (0, 0)
+        return {"channels": row[0], "posts": row[1]}
+
+
+class DiffTracker:
+    """
+    Сравнение прочитанных постов с индексом канала
+
+    filter() пропускает дальше только новые и изменённые посты. Удалёнными считаются
+    посты из индекса, которых не оказалось в прочитанном диапазоне id: от самого
+    старого прочитанного поста до самого нового (или до конца канала, если история
+    читалась с последнего сообщения). Посты за пределами диапазона остаются в индексе как есть.
+    """
+
+    def __init__(self, index: ChannelFingerprints, read_from_top: bool = True):
+        self.index = index
+        self.read_from_top = read_from_top
+        # Прочитанные посты в порядке чтения (от новых к старым)
+        self._seen_ids = array("q")
+        self._seen_hashes = array("q")
+        self.created = 0
+        self.edited_ids: List[int] = []
+        self.unchanged = 0
+        self._merged: Optional[ChannelFingerprints] = None
+        self._deleted_ids: List[int] = []
+
+    async def filter(self, posts: AsyncIterator[Post]) -> AsyncIterator[Post]:
+        async for post in posts:
+            value = fingerprint(post)
+            self._seen_ids.append(post.message_id)
+            self._seen_hashes.append(value)
+
+            previous = self.index.get(post.message_id)
+            if previous is None:
+                self.created += 1
+            elif previous != value:
+                self.edited_ids.append(post.message_id)
+            else:
+                self.unchanged += 1
+                continue
+            yield post
+
+    def summary(self) -> Dict[str, Any]:
+        """Поля завершающего callback: счётчики, id изменённых и удалённых постов"""
+        self._merge()
+        return {
+            "diff": {
+                "created": self.created,
+                "edited": len(self.edited_ids),
+                "deleted": len(self._deleted_ids),
+                "unchanged": self.unchanged
+            },
+            "edited_ids": self.edited_ids,
+            "deleted_ids": self._deleted_ids
+        }
+
+    def result(self) -> ChannelFingerprints:
+        """Новый индекс канала (сохраняется после того, как Rails принял изменения)"""
+        self._merge()
+        return self._merged
+
+    def _merge(self):
+        if self._merged is not None:
+            return
+
+        if not self._seen_ids:
+            # Ничего не прочитано — судить об удалении не по чему
+            self._merged = self.index
+            return
+
+        # История читается от новых к старым: обычно достаточно развернуть массивы
+        seen_ids, seen_hashes = self._seen_ids, self._seen_hashes
+        seen_ids.reverse()
+        seen_hashes.reverse()
+        if any(seen_ids[i] >= seen_ids[i + 1] for i in range(len(seen_ids) - 1)):
+            pairs = sorted(dict(zip(seen_ids, seen_hashes)).items())
+            seen_ids = array("q", (message_id for message_id, _ in pairs))
+            seen_hashes = array("q", (value for _, value in pairs))
+
+        low = seen_ids[0]
+        high = None if self.read_from_top else seen_ids[-1]
+        old_ids, old_hashes = self.index.ids, self.index.hashes
+        ids, hashes = array("q"), array("q")
+        deleted: List[int] = []
+
+        # Слияние двух отсортированных последовательностей: прочитанное заменяет старое,
+        # старое внутри прочитанного диапазона, но не прочитанное — удалено
+        position = 0
+        for message_id, value in zip(seen_ids, seen_hashes):
+            while position < len(old_ids) and old_ids[position] < message_id:
+                self._keep_or_delete(old_ids[position], old_hashes[position], low, high, ids, hashes, deleted)
+                position += 1
+            if position < len(old_ids) and old_ids[position] == message_id:
+                position += 1
+            ids.append(message_id)
+            hashes.append(value)
+        while position < len(old_ids):
+            self._keep_or_delete(old_ids[position], old_hashes[position], low, high, ids, hashes, deleted)
+            position += 1
+
+        # Tombstone снимается, если пост снова прочитан
+        tombstones = array("q", sorted(
+            [message_id for message_id in self.index.tombstones if not _contains(seen_ids, message_id)] + deleted
+        ))
+        self._deleted_ids = deleted
+        self._merged = ChannelFingerprints(ids, hashes, tombstones)
+
+    @staticmethod
+    def _keep_or_delete(message_id: int, value: int, low: int, high: Optional[int], ids, hashes, deleted):
+        if message_id >= low and (high is None or message_id <= high):
+            deleted.append(message_id)
+        else:
+            ids.append(message_id)
+            hashes.append(value)
+
+
+def _contains(values: array, value: int) -> bool:
+    index = bisect_left(values, value)
+    return index < len(values) and values[index] == value
+
+
+def _unpack(blob: bytes) -> array:
+    values = array("q")
+    values.frombytes(blob)
+    return values
+
+
+def _key(channel_username: str, import_type: str, target_id: Optional[str]) -> tuple:
+    return channel_username.lstrip("@").lower(), import_type or "", target_id or ""
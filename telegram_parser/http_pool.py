@@ -0,0 +1,87 @@
+"""
+Общие HTTP-клиенты с пулом keep-alive соединений
+Один клиент на каждый внешний адрес: Telegram Bot API и callback в Rails
+"""
+
+from typing import Dict, Any, Optional
+
+import httpx
+
+
+class HttpPool:
+    """
+    Пул долгоживущих httpx.AsyncClient
+
+    Создаётся при старте приложения и передаётся в парсер и send_callback,
+    чтобы не открывать новое TLS-соединение на каждый запрос.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        bot_api_timeout: float = 10.0,
+        callback_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        http2: bool = False
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.bot_api_timeout = httpx.Timeout(bot_api_timeout, connect=connect_timeout)
+        self.callback_timeout = httpx.Timeout(callback_timeout, connect=connect_timeout)
+        self.http2 = http2
+        self.bot_api: Optional[httpx.AsyncClient] = None
+        self.callback: Optional[httpx.AsyncClient] = None
+        self._counters: Dict[str, Dict[str, int]] = {
+            "bot_api": {"requests": 0, "errors": 0},
+            "callback": {"requests": 0, "errors": 0}
+        }
+
+    async def start(self):
+        """Создать клиенты"""
+        self.bot_api = self._build_client("bot_api", self.bot_api_timeout)
+        self.callback = self._build_client("callback", self.callback_timeout)
+
+    async def close(self):
+        """Закрыть все соединения"""
+        for client in (self.bot_api, self.callback):
+            if client:
+                await client.aclose()
+        self.bot_api = None
+        self.callback = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Настроенные лимиты и счётчики запросов по каждому клиенту
+
+        Число открытых соединений не показывается: у httpx нет публичного API к пулу.
+        """
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "bot_api": dict(self._counters["bot_api"]),
+            "callback": dict(self._counters["callback"])
+        }
+
+    def _build_client(self, name: str, timeout: httpx.Timeout) -> httpx.AsyncClient:
+        counters = self._counters[name]
+
+        async def on_request(request: httpx.Request):
+            counters["requests"] += 1
+
+        async def on_response(response: httpx.Response):
+            if response.status_code >= 400:
+                counters["errors"] += 1
+
+        return httpx.AsyncClient(
+            limits=self.limits,
+            timeout=timeout,
+            http2=self.http2,
+            event_hooks={"request": [on_request], "response": [on_response]}
+        )
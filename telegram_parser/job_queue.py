@@ -0,0 +1,383 @@
+"""
+Очередь задач синхронизации
+Локальная SQLite-очередь с пулом async-воркеров: задачи переживают перезапуск,
+повторные запросы для того же канала объединяются с уже идущей задачей
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable, Awaitable, List, Tuple, Set, Iterable
+
+# Статусы задачи
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FLOOD_WAIT = "flood_wait"  # выполняется, но ждёт окончания FloodWait
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class JobReporter:
+    """Через него обработчик сообщает прогресс задачи и ожидание FloodWait"""
+
+    def __init__(self, queue: "SyncJobQueue", job_id: str):
+        self._queue = queue
+        self._job_id = job_id
+        # Состояние каналов пакетной задачи (см. channels())
+        self.channel_results: List[Dict[str, Any]] = []
+
+    def progress(self, count: int):
+        """Сколько постов уже обработано (ожидание FloodWait при этом закончилось)"""
+        self._queue._update(self._job_id, progress=count, flood_wait_until=None)
+
+    def flood_wait(self, seconds: int):
+        """Telegram попросил подождать — задача не упала, а ждёт"""
+        self._queue._update(self._job_id, flood_wait_until=time.time() + seconds)
+
+    def channels(self, channels: List[Dict[str, Any]]) -> List["ChannelReporter"]:
+        """
+        Пакетная задача: отдельный отчёт для каждого канала
+
+        channels — описания каналов (попадают в result задачи как есть). Пока задача
+        выполняется, в result видны статус и прогресс каждого канала, а progress
+        задачи — сумма по каналам.
+        """
+        self.channel_results = [dict(channel, status=QUEUED, posts=0) for channel in channels]
+        self._save_channels()
+        return [ChannelReporter(self, index) for index in range(len(self.channel_results))]
+
+    def _save_channels(self, **fields):
+        self._queue._update(
+            self._job_id,
+            progress=sum(channel["posts"] for channel in self.channel_results),
+            result=json.dumps({"status": RUNNING, "channels": self.channel_results}),
+            **fields
+        )
+
+
+class ChannelReporter:
+    """Отчёт одного канала пакетной задачи (тот же интерфейс, что у JobReporter)"""
+
+    def __init__(self, job: JobReporter, index: int):
+        self._job = job
+        self._channel = job.channel_results[index]
+
+    def progress(self, count: int):
+        self._channel.update(status=RUNNING, posts=count)
+        self._job._save_channels(flood_wait_until=None)
+
+    def flood_wait(self, seconds: int):
+        self._job.flood_wait(seconds)
+
+    def finish(self, result: Dict[str, Any]):
+        """Итог канала: status, posts, error и high_water_mark из результата синхронизации"""
+        self._channel.update(
+            status=DONE if result.get("status") == "success" else FAILED,
+            posts=result.get("posts") or 0,
+            error=result.get("error"),
+            high_water_mark=result.get("high_water_mark")
+        )
+        self._job._save_channels()
+
+
+class SyncJobQueue:
+    """
+    Долговременная очередь задач /sync
+
+    Payload задачи (включая session_string) хранится в SQLite в каталоге данных
+    сервиса, чтобы задачу можно было продолжить после перезапуска процесса.
+    Когда задача завершается, session_string из payload удаляется.
+
+    Одну базу могут обслуживать несколько процессов (воркеры uvicorn): задачу
+    забирает ровно один из них, а пока она выполняется, процесс продлевает её
+    heartbeat. Задачи, чей heartbeat не обновлялся дольше lease (процесс упал),
+    возвращаются в очередь. При штатной остановке процесс возвращает свои задачи сразу.
+    Задача, прерванная так max_attempts раз (процесс падает на ней), завершается
+    со статусом failed, и её payload передаётся в on_abandoned.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handler: Callable[[Dict[str, Any], JobReporter], Awaitable[Dict[str, Any]]],
+        workers: int = 2,
+        poll_interval: float = 5.0,
+        retention: float = 7 * 24 * 3600,
+        lease: float = 60.0,
+        max_attempts: int = 3,
+        on_abandoned: Optional[Callable[[Dict[str, Any], str], Awaitable[None]]] = None
+    ):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.on_abandoned = on_abandoned
+        self._db: Optional[sqlite3.Connection] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        # Задачи, которые выполняет этот процесс (для heartbeat)
+        self._running: Set[str] = set()
+        # Уведомления о брошенных задачах (on_abandoned)
+        self._notifications: set = set()
+
+    async def start(self):
+        """Открыть базу, вернуть прерванные задачи в очередь и запустить воркеров"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sync_jobs ("
+            " id TEXT PRIMARY KEY,"
+            " dedupe_key TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " progress INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " flood_wait_until REAL,"
+            " heartbeat_at REAL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sync_jobs)")}
+        if "flood_wait_until" not in columns:
+            self._db.execute("ALTER TABLE sync_jobs ADD COLUMN flood_wait_until REAL")
+        if "heartbeat_at" not in columns:
+            self._db.execute("ALTER TABLE sync_jobs ADD COLUMN heartbeat_at REAL")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sync_jobs_status ON sync_jobs (status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sync_jobs_dedupe ON sync_jobs (dedupe_key, status)")
+
+        self._requeue_stale()
+        self._db.execute(
+            "DELETE FROM sync_jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - self.retention)
+        )
+        # Завершённые задачи из прежних версий ещё хранят session_string
+        self._db.execute(
+            "UPDATE sync_jobs SET payload = json_remove(payload, '$.session_string')"
+            " WHERE status IN (?, ?) AND json_extract(payload, '$.session_string') IS NOT NULL",
+            (DONE, FAILED)
+        )
+
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._wakeup.set()
+
+    async def close(self):
+        """Остановить воркеров. Незавершённые задачи возвращаются в очередь и продолжатся в другом процессе или после перезапуска"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._notifications:
+            await asyncio.gather(*self._notifications, return_exceptions=True)
+        if self._db and self._running:
+            # Штатная остановка — не вина задачи, попытку не засчитываем
+            self._db.execute(
+                "UPDATE sync_jobs SET status = ?, attempts = MAX(attempts - 1, 0)"
+                f" WHERE status = ? AND id IN ({_placeholders(self._running)})",
+                (QUEUED, RUNNING) + tuple(self._running)
+            )
+            self._running.clear()
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def enqueue(self, payload: Dict[str, Any], dedupe_key: str) -> Tuple[str, bool]:
+        """
+        Поставить задачу в очередь
+
+        Returns:
+            (job_id, merged) — merged=True, если такая задача уже в очереди или выполняется
+        """
+        job_id = str(uuid.uuid4())
+        # Проверка и вставка — в одной транзакции с блокировкой записи: другой процесс
+        # с той же базой не поставит такую же задачу между ними
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT id FROM sync_jobs WHERE dedupe_key = ? AND status IN (?, ?)"
+                " ORDER BY created_at LIMIT 1",
+                (dedupe_key,) + ACTIVE_STATUSES
+            ).fetchone()
+            if not row:
+                self._db.execute(
+                    "INSERT INTO sync_jobs (id, dedupe_key, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, dedupe_key, QUEUED, json.dumps(payload), time.time())
+                )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+        if row:
+            return row[0], True
+        self._wakeup.set()
+        return job_id, False
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи (без payload — в нём session_string)"""
+        row = self._db.execute(
+            "SELECT id, status, progress, result, error, attempts, created_at, started_at, finished_at,"
+            " (SELECT COUNT(*) FROM sync_jobs AS q WHERE q.status = ? AND q.created_at < sync_jobs.created_at),"
+            " flood_wait_until"
+            " FROM sync_jobs WHERE id = ?",
+            (QUEUED, job_id)
+        ).fetchone()
+        if not row:
+            return None
+
+        # Пока идёт FloodWait, задача показывается как ожидающая, а не упавшая
+        status = row[1]
+        flood_wait_until = row[10] if row[10] and row[10] > time.time() else None
+        if status == RUNNING and flood_wait_until:
+            status = FLOOD_WAIT
+
+        return {
+            "job_id": row[0],
+            "status": status,
+            "progress": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "attempts": row[5],
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+            "queue_position": row[9] if row[1] == QUEUED else None,
+            "flood_wait_until": flood_wait_until
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Количество задач по статусам"""
+        counts = dict(self._db.execute(
+            "SELECT status, COUNT(*) FROM sync_jobs GROUP BY status"
+        ).fetchall()) if self._db else {}
+        return {
+            "workers": self.workers,
+            QUEUED: counts.get(QUEUED, 0),
+            RUNNING: counts.get(RUNNING, 0),
+            DONE: counts.get(DONE, 0),
+            FAILED: counts.get(FAILED, 0)
+        }
+
+    def _claim(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        now = time.time()
+        row = self._db.execute(
+            "UPDATE sync_jobs SET status = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1"
+            " WHERE id = (SELECT id FROM sync_jobs WHERE status = ? ORDER BY created_at LIMIT 1)"
+            " RETURNING id, payload",
+            (RUNNING, now, now, QUEUED)
+        ).fetchone()
+        if not row:
+            return None
+        self._running.add(row[0])
+        return row[0], json.loads(row[1])
+
+    def _requeue_stale(self):
+        """Вернуть в очередь задачи процессов, которые перестали продлевать heartbeat"""
+        now = time.time()
+        stale = "status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+        # Задача, на которой процесс падает раз за разом, иначе возвращалась бы в очередь бесконечно
+        error = f"Процесс останавливался во время выполнения задачи (попыток: {self.max_attempts})"
+        abandoned = self._db.execute(
+            "UPDATE sync_jobs SET status = ?, error = ?, finished_at = ?, flood_wait_until = NULL,"
+            " payload = json_remove(payload, '$.session_string')"
+            f" WHERE {stale} AND attempts >= ? RETURNING id, payload",
+            (FAILED, error, now, RUNNING, now - self.lease, self.max_attempts)
+        ).fetchall()
+        for job_id, payload in abandoned:
+            print(f"[QUEUE] Job {job_id} abandoned after {self.max_attempts} attempts")
+            if self.on_abandoned:
+                task = asyncio.create_task(self._notify_abandoned(job_id, json.loads(payload), error))
+                self._notifications.add(task)
+                task.add_done_callback(self._notifications.discard)
+
+        resumed = self._db.execute(
+            f"UPDATE sync_jobs SET status = ? WHERE {stale}",
+            (QUEUED, RUNNING, now - self.lease)
+        ).rowcount
+        if resumed:
+            print(f"[QUEUE] Resuming {resumed} interrupted jobs")
+            self._wakeup.set()
+
+    async def _notify_abandoned(self, job_id: str, payload: Dict[str, Any], error: str):
+        try:
+            await self.on_abandoned(payload, error)
+        except Exception as e:
+            print(f"[QUEUE] Failed to report abandoned job {job_id}: {type(e).__name__} - {e}")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if self._running:
+                self._db.execute(
+                    f"UPDATE sync_jobs SET heartbeat_at = ? WHERE id IN ({_placeholders(self._running)})",
+                    (time.time(),) + tuple(self._running)
+                )
+            self._requeue_stale()
+
+    def _update(self, job_id: str, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(
+            f"UPDATE sync_jobs SET {assignments} WHERE id = ?",
+            tuple(fields.values()) + (job_id,)
+        )
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str]):
+        # session_string нужен только для выполнения — в завершённой задаче его не храним
+        self._db.execute(
+            "UPDATE sync_jobs SET status = ?, result = ?, error = ?, finished_at = ?, flood_wait_until = NULL,"
+            " payload = json_remove(payload, '$.session_string')"
+            " WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+    async def _worker(self, number: int):
+        while True:
+            claimed = self._claim()
+            if not claimed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, payload = claimed
+            print(f"[QUEUE] Worker {number} started job {job_id}")
+            try:
+                result = await self.handler(payload, JobReporter(self, job_id))
+            except asyncio.CancelledError:
+                # Процесс останавливается — задача будет продолжена после перезапуска
+                raise
+            except Exception as e:
+                print(f"[QUEUE] Job {job_id} crashed: {type(e).__name__} - {e}")
+                self._finish(job_id, FAILED, None, str(e))
+                self._running.discard(job_id)
+                continue
+
+            # partial — пакетная задача, в которой часть каналов не синхронизировалась
+            status = DONE if result.get("status") in ("success", "partial") else FAILED
+            self._finish(job_id, status, result, result.get("error"))
+            self._running.discard(job_id)
+            print(f"[QUEUE] Job {job_id} finished: {status}")
+
+
+def _placeholders(values: Iterable) -> str:
+    return ", ".join("?" for _ in values)
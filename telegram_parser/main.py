@@ -5,54 +5,309 @@ Telegram Channel Parser Microservice
 
 import os
 import asyncio
-import json
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 import time
+from contextlib import asynccontextmanager
+from functools import partial
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-import httpx
-from pyrogram import Client
-from pyrogram.errors import (
-    SessionPasswordNeeded,
-    PhoneCodeInvalid,
-    PhoneCodeExpired,
-    FloodWait,
-    PasswordHashInvalid
+from pyrogram.errors import FloodWait
+
+from parser import TelegramChannelParser, STATS_BATCH_SIZE
+from auth_broker import AuthFlow, AuthBrokerClient
+from client_pool import ClientPool, session_key
+from http_pool import HttpPool
+from file_cache import FileUrlCache
+from media_store import MediaStore, load_secret
+from peer_cache import PeerCache
+from response_cache import ResponseCache
+from sync_cursors import SyncCursorStore
+from fingerprints import FingerprintStore, DiffTracker
+from delivery import HighWaterMark, deliver_pages, deliver_ndjson
+from job_queue import SyncJobQueue, JobReporter
+from rate_limiter import SessionRateLimiter
+from stats_watcher import StatsWatcher
+from stats_batcher import StatsBatcher
+from records import dumps as dumps_json
+import metrics
+from compression import CallbackCompressor, ENCODINGS as COMPRESSION_ENCODINGS
+
+load_dotenv()
+
+# Конфигурация
+API_ID = os.getenv("TELEGRAM_API_ID")
+API_HASH = os.getenv("TELEGRAM_API_HASH")
+
+# Пул запущенных клиентов Pyrogram (ключ — хеш session_string)
+CLIENT_POOL_MAX = int(os.getenv("CLIENT_POOL_MAX", "20"))
+CLIENT_POOL_IDLE_TTL = float(os.getenv("CLIENT_POOL_IDLE_TTL", "600"))
+# Быстрый запуск клиентов: только подключение, без диспетчера обновлений, GetState и get_me
+CLIENT_FAST_START = os.getenv("CLIENT_FAST_START", "true").lower() == "true"
+# Файл со session_string (по одной на строку), клиенты которых подключаются при старте
+CLIENT_WARMUP_FILE = os.getenv("CLIENT_WARMUP_FILE")
+CLIENT_WARMUP_CONCURRENCY = int(os.getenv("CLIENT_WARMUP_CONCURRENCY", "4"))
+
+# Общие keep-alive HTTP-клиенты для Bot API и callback в Rails
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+BOT_API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", "10"))
+CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+# Сжатие тела callback: none, gzip или zstd; тела меньше порога (байт) не сжимаются
+CALLBACK_COMPRESSION = os.getenv("CALLBACK_COMPRESSION", "none")
+CALLBACK_COMPRESSION_MIN_BYTES = int(os.getenv("CALLBACK_COMPRESSION_MIN_BYTES", "16384"))
+
+# Адрес Bot API для getFile и ссылок на файлы
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org")
+
+# Сколько запросов getFile к Bot API выполнять параллельно во время синхронизации
+MEDIA_RESOLVE_CONCURRENCY = int(os.getenv("MEDIA_RESOLVE_CONCURRENCY", "8"))
+
+# Локальные данные сервиса (кеши, очереди)
+DATA_DIR = os.getenv("PARSER_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+# Медиа, скачанное через Pyrogram (download_media=true в /sync): каталог, публичный адрес
+# раздачи (GET /media/...), сколько файлов и сколько байт качать одновременно, максимальный размер файла
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.path.join(DATA_DIR, "media"))
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "/media")
+# Ключ подписи ссылок на медиа; без него ключ создаётся в PARSER_DATA_DIR/media_secret
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET")
+MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv("MEDIA_DOWNLOAD_CONCURRENCY", "4"))
+MEDIA_DOWNLOAD_BUDGET_MB = float(os.getenv("MEDIA_DOWNLOAD_BUDGET_MB", "64"))
+MEDIA_MAX_FILE_MB = float(os.getenv("MEDIA_MAX_FILE_MB", "50"))
+# Сколько места может занимать каталог медиа (0 — без ограничения); сверх него удаляются давно не использованные файлы
+MEDIA_MAX_DISK_MB = float(os.getenv("MEDIA_MAX_DISK_MB", "10240"))
+
+# Кеш file_id → file_path для Bot API
+FILE_CACHE_TTL = float(os.getenv("FILE_CACHE_TTL", str(55 * 60)))
+FILE_CACHE_MEMORY_SIZE = int(os.getenv("FILE_CACHE_MEMORY_SIZE", "10000"))
+
+# Очередь синхронизаций: сколько каналов синхронизировать одновременно
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "2"))
+# Сколько раз задача может прерваться падением процесса, прежде чем считаться неудачной
+SYNC_MAX_ATTEMPTS = int(os.getenv("SYNC_MAX_ATTEMPTS", "3"))
+
+# Темп запросов к Telegram на одну сессию и повтор после FloodWait
+SESSION_RATE = float(os.getenv("SESSION_RATE", "5"))
+SESSION_BURST = int(os.getenv("SESSION_BURST", "10"))
+FLOOD_WAIT_MAX = float(os.getenv("FLOOD_WAIT_MAX", "300"))  # для фоновых синхронизаций
+FLOOD_WAIT_MAX_INTERACTIVE = float(os.getenv("FLOOD_WAIT_MAX_INTERACTIVE", "30"))  # для /channel-info, /message-stats
+FLOOD_WAIT_RETRIES = int(os.getenv("FLOOD_WAIT_RETRIES", "3"))
+
+# Параллельное чтение истории (parallel=true в /sync): сколько батчей id одной сессии читать одновременно
+HISTORY_CONCURRENCY = int(os.getenv("HISTORY_CONCURRENCY", "4"))
+
+# Пакетная синхронизация (/sync/batch): сколько каналов одной сессии синхронизировать одновременно
+SYNC_BATCH_CONCURRENCY = int(os.getenv("SYNC_BATCH_CONCURRENCY", "3"))
+
+# Статистика сообщений: сколько батчей по 100 id и сколько каналов запрашивать одновременно
+STATS_CONCURRENCY = int(os.getenv("STATS_CONCURRENCY", "4"))
+STATS_CHANNELS_CONCURRENCY = int(os.getenv("STATS_CHANNELS_CONCURRENCY", "4"))
+# Окно объединения одновременных /message-stats одного канала, мс (0 — не объединять)
+STATS_BATCH_WINDOW_MS = float(os.getenv("STATS_BATCH_WINDOW_MS", "10"))
+
+# Наблюдение за статистикой: как часто проверять, пора ли опрашивать сообщения
+WATCH_TICK = float(os.getenv("WATCH_TICK", "5"))
+WATCH_CONCURRENCY = int(os.getenv("WATCH_CONCURRENCY", "4"))
+WATCH_MIN_INTERVAL = float(os.getenv("WATCH_MIN_INTERVAL", "60"))
+# Срок наблюдения без ttl; повторная регистрация его продлевает
+WATCH_DEFAULT_TTL = float(os.getenv("WATCH_DEFAULT_TTL", str(7 * 24 * 3600)))
+
+# Авторизация аккаунтов: с AUTH_BROKER_SOCKET — через отдельный процесс auth_broker
+# (обязательно при нескольких воркерах uvicorn), без него — в этом процессе
+AUTH_BROKER_SOCKET = os.getenv("AUTH_BROKER_SOCKET")
+# Сколько ждать код (сек), сколько авторизаций держать одновременно и как часто слать код на один номер
+AUTH_TTL = float(os.getenv("AUTH_TTL", "300"))
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "100"))
+AUTH_CODE_INTERVAL = float(os.getenv("AUTH_CODE_INTERVAL", "60"))
+
+# Кеш разрешённых username каналов (id + access_hash) для каждой сессии
+PEER_CACHE_TTL = float(os.getenv("PEER_CACHE_TTL", str(6 * 3600)))
+
+# Кеш ответов /channel-info: сколько секунд ответ свежий и сколько после этого ещё отдаётся,
+# пока в фоне запрашивается новый
+CHANNEL_INFO_TTL = float(os.getenv("CHANNEL_INFO_TTL", "60"))
+CHANNEL_INFO_STALE_TTL = float(os.getenv("CHANNEL_INFO_STALE_TTL", "600"))
+
+client_pool: Optional[ClientPool] = None
+http_pool: Optional[HttpPool] = None
+file_cache: Optional[FileUrlCache] = None
+media_store: Optional[MediaStore] = None
+peer_cache = PeerCache(ttl=PEER_CACHE_TTL)
+channel_info_cache = ResponseCache(ttl=CHANNEL_INFO_TTL, stale_ttl=CHANNEL_INFO_STALE_TTL)
+sync_cursors: Optional[SyncCursorStore] = None
+fingerprints: Optional[FingerprintStore] = None
+sync_queue: Optional[SyncJobQueue] = None
+stats_watcher: Optional[StatsWatcher] = None
+auth_service = AuthBrokerClient(AUTH_BROKER_SOCKET) if AUTH_BROKER_SOCKET else AuthFlow(
+    API_ID,
+    API_HASH,
+    ttl=AUTH_TTL,
+    max_pending=AUTH_MAX_PENDING,
+    code_interval=AUTH_CODE_INTERVAL
+)
+callback_compressor = CallbackCompressor(
+    encoding=CALLBACK_COMPRESSION,
+    min_size=CALLBACK_COMPRESSION_MIN_BYTES
+)
+rate_limiter = SessionRateLimiter(
+    rate=SESSION_RATE,
+    burst=SESSION_BURST,
+    max_flood_wait=FLOOD_WAIT_MAX,
+    max_retries=FLOOD_WAIT_RETRIES,
+    concurrency=HISTORY_CONCURRENCY
 )
 
-from parser import TelegramChannelParser
 
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создать общие ресурсы при старте и закрыть их при остановке"""
+    global client_pool, http_pool, file_cache, media_store, sync_cursors, fingerprints, sync_queue, stats_watcher
+
+    http_pool = HttpPool(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        bot_api_timeout=BOT_API_TIMEOUT,
+        callback_timeout=CALLBACK_TIMEOUT,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        http2=HTTP2_ENABLED
+    )
+    await http_pool.start()
+    await auth_service.start()
+
+    file_cache = FileUrlCache(
+        path=os.path.join(DATA_DIR, "file_cache.sqlite3"),
+        ttl=FILE_CACHE_TTL,
+        memory_size=FILE_CACHE_MEMORY_SIZE
+    )
+    file_cache.open()
+
+    media_store = MediaStore(
+        root=MEDIA_DIR,
+        base_url=MEDIA_BASE_URL,
+        secret=MEDIA_URL_SECRET.encode() if MEDIA_URL_SECRET else load_secret(os.path.join(DATA_DIR, "media_secret")),
+        concurrency=MEDIA_DOWNLOAD_CONCURRENCY,
+        byte_budget=int(MEDIA_DOWNLOAD_BUDGET_MB * 1024 * 1024),
+        max_file_size=int(MEDIA_MAX_FILE_MB * 1024 * 1024),
+        max_disk_bytes=int(MEDIA_MAX_DISK_MB * 1024 * 1024)
+    )
+    media_store.open()
+
+    sync_cursors = SyncCursorStore(os.path.join(DATA_DIR, "sync_cursors.sqlite3"))
+    sync_cursors.open()
+
+    fingerprints = FingerprintStore(os.path.join(DATA_DIR, "fingerprints.sqlite3"))
+    fingerprints.open()
+
+    if API_ID and API_HASH:
+        client_pool = ClientPool(
+            api_id=int(API_ID),
+            api_hash=API_HASH,
+            max_clients=CLIENT_POOL_MAX,
+            idle_ttl=CLIENT_POOL_IDLE_TTL,
+            fast_start=CLIENT_FAST_START
+        )
+        await client_pool.start()
+        if CLIENT_WARMUP_FILE:
+            client_pool.warmup(read_warmup_sessions(CLIENT_WARMUP_FILE), concurrency=CLIENT_WARMUP_CONCURRENCY)
+
+        sync_queue = SyncJobQueue(
+            path=os.path.join(DATA_DIR, "sync_jobs.sqlite3"),
+            handler=run_sync_job,
+            workers=SYNC_WORKERS,
+            max_attempts=SYNC_MAX_ATTEMPTS,
+            on_abandoned=report_abandoned_job
+        )
+        await sync_queue.start()
+
+        stats_watcher = StatsWatcher(
+            path=os.path.join(DATA_DIR, "stats_watches.sqlite3"),
+            fetch_stats=fetch_watched_stats,
+            send=send_callback,
+            tick=WATCH_TICK,
+            concurrency=WATCH_CONCURRENCY,
+            default_ttl=WATCH_DEFAULT_TTL
+        )
+        await stats_watcher.start()
+
+    try:
+        yield
+    finally:
+        if stats_watcher:
+            await stats_watcher.close()
+            stats_watcher = None
+        if sync_queue:
+            await sync_queue.close()
+            sync_queue = None
+        if client_pool:
+            await client_pool.close()
+            client_pool = None
+        await http_pool.close()
+        http_pool = None
+        file_cache.close()
+        file_cache = None
+        media_store = None
+        sync_cursors.close()
+        sync_cursors = None
+        fingerprints.close()
+        fingerprints = None
+        await channel_info_cache.close()
+        await stats_batcher.close()
+        await auth_service.close()
+        metrics.mark_process_dead()
+
+
+def read_warmup_sessions(path: str) -> List[str]:
+    """session_string из файла прогрева: по одной на строку, пустые строки и # — пропускаются"""
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    except OSError as e:
+        print(f"[POOL] Can't read warmup sessions from {path}: {e}")
+        return []
+
 
 app = FastAPI(
     title="Telegram Channel Parser",
     description="Microservice для парсинга истории Telegram каналов",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Конфигурация
-API_ID = os.getenv("TELEGRAM_API_ID")
-API_HASH = os.getenv("TELEGRAM_API_HASH")
 
-# Хранилище активных клиентов для авторизации (in-memory, с TTL)
-# Структура: {phone_number: {"client": Client, "expires_at": timestamp}}
-auth_clients: Dict[str, Dict[str, Any]] = {}
-AUTH_TTL = 300  # 5 минут
+@app.get("/media/{path:path}")
+async def get_media(path: str, sig: str = ""):
+    """Скачанное медиа: /media/<2 символа хеша>/<file_unique_id><ext>?sig=<подпись>"""
+    file_path = media_store.file_path(path, sig) if media_store else None
+    if not file_path:
+        # Неверная подпись и отсутствующий файл неразличимы
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    return FileResponse(file_path)
 
 
-def cleanup_expired_clients():
-    """Удалить устаревшие клиенты авторизации"""
-    now = time.time()
-    expired = [phone for phone, data in auth_clients.items() if data["expires_at"] < now]
-    for phone in expired:
-        try:
-            asyncio.create_task(auth_clients[phone]["client"].disconnect())
-        except:
-            pass
-        del auth_clients[phone]
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    """Гистограмма задержек по шаблону маршрута (/sync/{job_id}, а не конкретный id)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            request.method,
+            route.path if route else "unmatched",
+            str(status)
+        ).observe(time.perf_counter() - started)
 
 
 class SyncRequest(BaseModel):
@@ -65,12 +320,80 @@ class SyncRequest(BaseModel):
     callback_url: str
     limit: Optional[int] = 1000
     import_type: Optional[str] = "channel_site"  # channel_site или style_samples
+    # Инкрементальная синхронизация: только посты новее курсора
+    since_message_id: Optional[int] = None
+    since_date: Optional[int] = None  # unix timestamp
+    incremental: bool = False  # взять курсор из последней успешной синхронизации
+    # Импорт периода: только посты не новее until_date (unix timestamp); курсор не двигается
+    until_date: Optional[int] = None
+    # Читать диапазоны id параллельно (большие каналы)
+    parallel: bool = False
+    # Скачать медиа через Pyrogram в хранилище сервиса (local_url, thumb_url в медиа постов)
+    download_media: bool = False
+    # Отправить только новые и изменённые посты (сравнение с прошлой синхронизацией в режиме diff)
+    diff: bool = False
+    # Доставка: single — один JSON со всеми постами, pages — страницами по page_size,
+    # ndjson — один потоковый запрос application/x-ndjson
+    delivery: Optional[Literal["single", "pages", "ndjson"]] = "single"
+    page_size: Optional[int] = 100
+    # Сжатие callback: gzip, zstd или none (по умолчанию — CALLBACK_COMPRESSION)
+    compression: Optional[str] = None
+
+
+class SyncBatchChannel(BaseModel):
+    """Канал пакетной синхронизации: свои идентификаторы и, при необходимости, свои параметры"""
+    channel_username: str
+    channel_site_id: Optional[str] = None
+    project_id: Optional[str] = None
+    import_type: Optional[str] = None  # по умолчанию — import_type пакета
+    callback_url: Optional[str] = None  # по умолчанию — callback_url пакета
+    limit: Optional[int] = None
+    since_message_id: Optional[int] = None
+
+
+class SyncBatchRequest(BaseModel):
+    """Запрос на синхронизацию нескольких каналов одной сессии"""
+    session_string: str
+    bot_token: Optional[str] = None
+    callback_url: Optional[str] = None
+    channels: List[SyncBatchChannel]
+    # Общие параметры каналов (как в SyncRequest)
+    limit: Optional[int] = 1000
+    import_type: Optional[str] = "channel_site"
+    since_date: Optional[int] = None
+    until_date: Optional[int] = None
+    incremental: bool = False
+    parallel: bool = False
+    download_media: bool = False
+    diff: bool = False
+    delivery: Optional[Literal["single", "pages", "ndjson"]] = "single"
+    page_size: Optional[int] = 100
+    compression: Optional[str] = None
+    # Сколько каналов синхронизировать одновременно (не больше SYNC_BATCH_CONCURRENCY)
+    concurrency: Optional[int] = None
 
 
 class SyncResponse(BaseModel):
     """Ответ на запрос синхронизации"""
     status: str
     message: str
+    job_id: Optional[str] = None
+    merged: bool = False  # присоединён к уже идущей задаче job_id (status по-прежнему started)
+
+
+class SyncJobResponse(BaseModel):
+    """Статус задачи синхронизации"""
+    job_id: str
+    status: str  # queued, running, flood_wait, done, failed
+    progress: int  # сколько постов уже обработано
+    queue_position: Optional[int] = None
+    flood_wait_until: Optional[float] = None  # unix time окончания FloodWait
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 
 class SendCodeRequest(BaseModel):
@@ -125,12 +448,47 @@ class MessageStatsResponse(BaseModel):
     success: bool
     stats: Optional[List[Dict[str, Any]]] = None
     error: Optional[str] = None
+    retry_after: Optional[int] = None  # секунд до окончания FloodWait
+
+
+class BatchMessageStatsRequest(BaseModel):
+    """Запрос статистики сообщений сразу по нескольким каналам"""
+    session_string: str
+    channels: Dict[str, List[int]]  # {channel_username: [message_ids]}
+
+
+class BatchMessageStatsResponse(BaseModel):
+    """Ответ со статистикой по каналам"""
+    success: bool
+    stats: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    errors: Optional[Dict[str, str]] = None  # ошибки отдельных каналов
+    error: Optional[str] = None
+    retry_after: Optional[int] = None  # секунд до окончания FloodWait
+
+
+class WatchRequest(BaseModel):
+    """Регистрация наблюдения за статистикой сообщений"""
+    channel_username: str
+    message_ids: List[int]
+    session_string: str
+    callback_url: str
+    interval: Optional[float] = 300  # базовый интервал опроса свежих постов, сек
+    ttl: Optional[float] = None  # через сколько секунд снять наблюдение (по умолчанию — WATCH_DEFAULT_TTL)
+
+
+class WatchResponse(BaseModel):
+    """Ответ на регистрацию наблюдения"""
+    success: bool
+    watch_id: Optional[str] = None
+    messages: int = 0
+    error: Optional[str] = None
 
 
 class ChannelInfoRequest(BaseModel):
     """Запрос на получение информации о канале"""
     channel_username: str
     session_string: str
+    force_refresh: bool = False  # не отдавать ответ из кеша
 
 
 class ChannelInfoResponse(BaseModel):
@@ -138,13 +496,49 @@ class ChannelInfoResponse(BaseModel):
     success: bool
     channel: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    retry_after: Optional[int] = None  # секунд до окончания FloodWait
+    cache: Optional[str] = None  # hit, stale, miss или refresh
+    cache_age: Optional[float] = None  # возраст ответа, сек
 
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    cleanup_expired_clients()
-    return {"status": "ok", "service": "telegram-parser"}
+    """Health check endpoint: только счётчики в памяти процесса, без SQLite и брокера"""
+    return {
+        "status": "ok",
+        "service": "telegram-parser",
+        "pid": os.getpid(),
+        "client_pool": client_pool.stats() if client_pool else None,
+        "http_pool": http_pool.stats() if http_pool else None,
+        "callback_compression": callback_compressor.stats(),
+        "file_cache": file_cache.stats() if file_cache else None,
+        "media_store": media_store.stats() if media_store else None,
+        "peer_cache": peer_cache.stats(),
+        "channel_info_cache": channel_info_cache.stats(),
+        "stats_batcher": stats_batcher.stats(),
+        "rate_limiter": rate_limiter.stats()
+    }
+
+
+@app.get("/health/details")
+async def health_details():
+    """Подробная статистика: запрос к брокеру авторизации и подсчёты по таблицам SQLite"""
+    result = await health_check()
+    result.update({
+        "auth": await auth_service.stats(),
+        "fingerprints": fingerprints.stats() if fingerprints else None,
+        "sync_queue": sync_queue.stats() if sync_queue else None,
+        "stats_watcher": stats_watcher.stats() if stats_watcher else None
+    })
+    return result
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики в формате Prometheus"""
+    auth_stats = await auth_service.stats()
+    metrics.AUTH_CLIENTS.set(auth_stats.get("pending") or 0)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
 
 
 @app.post("/auth/send-code", response_model=SendCodeResponse)
@@ -152,57 +546,7 @@ async def send_code(request: SendCodeRequest):
     """
     Отправить код авторизации на номер телефона
     """
-    print(f"[AUTH] send_code called for phone: {request.phone_number}")
-    print(f"[AUTH] API_ID: {API_ID}, API_HASH: {'set' if API_HASH else 'not set'}")
-
-    if not API_ID or not API_HASH:
-        return SendCodeResponse(
-            success=False,
-            error="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"
-        )
-
-    cleanup_expired_clients()
-    phone = request.phone_number.strip()
-
-    # Создаём клиент
-    client = Client(
-        name=f"auth_{phone.replace('+', '')}",
-        api_id=int(API_ID),
-        api_hash=API_HASH,
-        in_memory=True
-    )
-
-    try:
-        await client.connect()
-        sent_code = await client.send_code(phone)
-
-        # Сохраняем клиент в память
-        auth_clients[phone] = {
-            "client": client,
-            "phone_code_hash": sent_code.phone_code_hash,
-            "expires_at": time.time() + AUTH_TTL
-        }
-
-        print(f"[AUTH] Code sent successfully, phone_code_hash: {sent_code.phone_code_hash[:10]}...")
-        print(f"[AUTH] Active clients: {list(auth_clients.keys())}")
-
-        return SendCodeResponse(
-            success=True,
-            phone_code_hash=sent_code.phone_code_hash
-        )
-
-    except FloodWait as e:
-        await client.disconnect()
-        return SendCodeResponse(
-            success=False,
-            error=f"Слишком много попыток. Подождите {e.value} секунд"
-        )
-    except Exception as e:
-        await client.disconnect()
-        return SendCodeResponse(
-            success=False,
-            error=str(e)
-        )
+    return SendCodeResponse(**await auth_service.send_code(request.phone_number))
 
 
 @app.post("/auth/verify-code", response_model=VerifyCodeResponse)
@@ -210,77 +554,9 @@ async def verify_code(request: VerifyCodeRequest):
     """
     Проверить код авторизации
     """
-    print(f"[AUTH] verify_code called for phone: {request.phone_number}")
-    print(f"[AUTH] Active clients before cleanup: {list(auth_clients.keys())}")
-
-    cleanup_expired_clients()
-    phone = request.phone_number.strip()
-
-    print(f"[AUTH] Active clients after cleanup: {list(auth_clients.keys())}")
-    print(f"[AUTH] Looking for phone: {phone}")
-
-    if phone not in auth_clients:
-        print(f"[AUTH] ERROR: Phone {phone} not found in auth_clients!")
-        return VerifyCodeResponse(
-            success=False,
-            error="Сессия авторизации истекла. Запросите код заново"
-        )
-
-    client_data = auth_clients[phone]
-    client = client_data["client"]
-
-    print(f"[AUTH] Calling sign_in for {phone} with code {request.phone_code}")
-
-    try:
-        result = await client.sign_in(
-            phone_number=phone,
-            phone_code_hash=request.phone_code_hash,
-            phone_code=request.phone_code
-        )
-        print(f"[AUTH] sign_in result: {result}")
-
-        # Успешная авторизация - получаем session_string
-        session_string = await client.export_session_string()
-        print(f"[AUTH] SUCCESS! Got session_string for {phone}")
-        await client.disconnect()
-        del auth_clients[phone]
-
-        return VerifyCodeResponse(
-            success=True,
-            session_string=session_string
-        )
-
-    except SessionPasswordNeeded:
-        # Нужна 2FA - сохраняем клиент
-        print(f"[AUTH] 2FA required for {phone}")
-        auth_clients[phone]["requires_2fa"] = True
-        return VerifyCodeResponse(
-            success=False,
-            requires_2fa=True
-        )
-
-    except PhoneCodeInvalid:
-        print(f"[AUTH] ERROR: PhoneCodeInvalid for {phone}")
-        return VerifyCodeResponse(
-            success=False,
-            error="Неверный код. Попробуйте ещё раз"
-        )
-
-    except PhoneCodeExpired:
-        print(f"[AUTH] ERROR: PhoneCodeExpired for {phone}")
-        await client.disconnect()
-        del auth_clients[phone]
-        return VerifyCodeResponse(
-            success=False,
-            error="Код истёк. Запросите новый"
-        )
-
-    except Exception as e:
-        print(f"[AUTH] ERROR: Exception for {phone}: {type(e).__name__} - {e}")
-        return VerifyCodeResponse(
-            success=False,
-            error=str(e)
-        )
+    return VerifyCodeResponse(**await auth_service.verify_code(
+        request.phone_number, request.phone_code_hash, request.phone_code
+    ))
 
 
 @app.post("/auth/verify-2fa", response_model=Verify2FAResponse)
@@ -288,42 +564,7 @@ async def verify_2fa(request: Verify2FARequest):
     """
     Проверить пароль двухфакторной аутентификации
     """
-    cleanup_expired_clients()
-    phone = request.phone_number.strip()
-
-    if phone not in auth_clients:
-        return Verify2FAResponse(
-            success=False,
-            error="Сессия авторизации истекла. Начните заново"
-        )
-
-    client_data = auth_clients[phone]
-    client = client_data["client"]
-
-    try:
-        await client.check_password(request.password)
-
-        # Успешная авторизация - получаем session_string
-        session_string = await client.export_session_string()
-        await client.disconnect()
-        del auth_clients[phone]
-
-        return Verify2FAResponse(
-            success=True,
-            session_string=session_string
-        )
-
-    except PasswordHashInvalid:
-        return Verify2FAResponse(
-            success=False,
-            error="Неверный пароль 2FA"
-        )
-
-    except Exception as e:
-        return Verify2FAResponse(
-            success=False,
-            error=str(e)
-        )
+    return Verify2FAResponse(**await auth_service.verify_2fa(request.phone_number, request.password))
 
 
 @app.post("/channel-info", response_model=ChannelInfoResponse)
@@ -339,27 +580,49 @@ async def get_channel_info(request: ChannelInfoRequest):
             error="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"
         )
 
-    parser = None
-    try:
-        parser = TelegramChannelParser(
-            api_id=int(API_ID),
-            api_hash=API_HASH,
-            session_string=request.session_string
-        )
+    async def fetch_channel_info() -> Dict[str, Any]:
+        async with client_pool.acquire(request.session_string) as client:
+            parser = TelegramChannelParser(
+                api_id=int(API_ID),
+                api_hash=API_HASH,
+                session_string=request.session_string,
+                client=client,
+                peer_cache=peer_cache,
+                rate_limiter=rate_limiter,
+                max_flood_wait=FLOOD_WAIT_MAX_INTERACTIVE
+            )
 
-        await parser.start()
+            return await parser.get_channel_info(
+                channel_username=request.channel_username
+            )
 
-        channel_info = await parser.get_channel_info(
-            channel_username=request.channel_username
+    try:
+        # Свежий ответ — из кеша без клиента; устаревший — из кеша с обновлением в фоне
+        channel_info, cache_state, cache_age = await channel_info_cache.get(
+            (session_key(request.session_string), request.channel_username.lstrip("@").lower()),
+            fetch_channel_info,
+            force=request.force_refresh
         )
 
-        print(f"[CHANNEL] Got info: {channel_info.get('title')} - {channel_info.get('members_count')} members")
+        print(
+            f"[CHANNEL] Got info ({cache_state}): "
+            f"{channel_info.get('title')} - {channel_info.get('members_count')} members"
+        )
 
         return ChannelInfoResponse(
             success=True,
-            channel=channel_info
+            channel=channel_info,
+            cache=cache_state,
+            cache_age=round(cache_age, 1)
         )
 
+    except FloodWait as e:
+        print(f"[CHANNEL] FloodWait: {e.value}s")
+        return ChannelInfoResponse(
+            success=False,
+            error=f"Слишком много запросов к Telegram. Повторите через {e.value} секунд",
+            retry_after=int(e.value)
+        )
     except ValueError as e:
         print(f"[CHANNEL] ValueError: {e}")
         return ChannelInfoResponse(
@@ -372,9 +635,6 @@ async def get_channel_info(request: ChannelInfoRequest):
             success=False,
             error=str(e)
         )
-    finally:
-        if parser:
-            await parser.stop()
 
 
 @app.post("/message-stats", response_model=MessageStatsResponse)
@@ -396,19 +656,12 @@ async def get_message_stats(request: MessageStatsRequest):
             error="message_ids не может быть пустым"
         )
 
-    parser = None
     try:
-        parser = TelegramChannelParser(
-            api_id=int(API_ID),
-            api_hash=API_HASH,
-            session_string=request.session_string
-        )
-
-        await parser.start()
-
-        stats = await parser.get_messages_stats(
-            channel_username=request.channel_username,
-            message_ids=request.message_ids
+        # Одновременные запросы того же канала объединяются в общие вызовы get_messages
+        stats = await stats_batcher.get(
+            request.session_string,
+            request.channel_username,
+            request.message_ids
         )
 
         print(f"[STATS] Got stats for {len(stats)} messages")
@@ -418,6 +671,13 @@ async def get_message_stats(request: MessageStatsRequest):
             stats=stats
         )
 
+    except FloodWait as e:
+        print(f"[STATS] FloodWait: {e.value}s")
+        return MessageStatsResponse(
+            success=False,
+            error=f"Слишком много запросов к Telegram. Повторите через {e.value} секунд",
+            retry_after=int(e.value)
+        )
     except ValueError as e:
         print(f"[STATS] ValueError: {e}")
         return MessageStatsResponse(
@@ -430,15 +690,191 @@ async def get_message_stats(request: MessageStatsRequest):
             success=False,
             error=str(e)
         )
-    finally:
-        if parser:
-            await parser.stop()
+
+
+async def fetch_message_stats(
+    session_string: str,
+    channel_username: str,
+    message_ids: List[int]
+) -> List[Dict[str, Any]]:
+    """Статистика сообщений одного канала (одна пачка StatsBatcher)"""
+    async with client_pool.acquire(session_string) as client:
+        parser = TelegramChannelParser(
+            api_id=int(API_ID),
+            api_hash=API_HASH,
+            session_string=session_string,
+            client=client,
+            peer_cache=peer_cache,
+            rate_limiter=rate_limiter,
+            max_flood_wait=FLOOD_WAIT_MAX_INTERACTIVE,
+            stats_concurrency=STATS_CONCURRENCY
+        )
+
+        return await parser.get_messages_stats(
+            channel_username=channel_username,
+            message_ids=message_ids
+        )
+
+
+stats_batcher = StatsBatcher(
+    fetch=fetch_message_stats,
+    window=STATS_BATCH_WINDOW_MS / 1000,
+    max_ids=STATS_BATCH_SIZE
+)
+
+
+@app.post("/message-stats/batch", response_model=BatchMessageStatsResponse)
+async def get_message_stats_batch(request: BatchMessageStatsRequest):
+    """
+    Получить статистику сообщений по нескольким каналам одним запросом
+
+    Каналы обрабатываются параллельно на одном клиенте; ошибка одного канала
+    не мешает остальным и возвращается в errors.
+    """
+    total_ids = sum(len(ids) for ids in request.channels.values())
+    print(f"[STATS] Batch request for {len(request.channels)} channels, {total_ids} message_ids")
+
+    if not API_ID or not API_HASH:
+        return BatchMessageStatsResponse(
+            success=False,
+            error="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"
+        )
+
+    if not total_ids:
+        return BatchMessageStatsResponse(
+            success=False,
+            error="message_ids не может быть пустым"
+        )
+
+    stats: Dict[str, List[Dict[str, Any]]] = {}
+    errors: Dict[str, str] = {}
+    retry_after: Optional[int] = None
+
+    try:
+        async with client_pool.acquire(request.session_string) as client:
+            parser = TelegramChannelParser(
+                api_id=int(API_ID),
+                api_hash=API_HASH,
+                session_string=request.session_string,
+                client=client,
+                peer_cache=peer_cache,
+                rate_limiter=rate_limiter,
+                max_flood_wait=FLOOD_WAIT_MAX_INTERACTIVE,
+                stats_concurrency=STATS_CONCURRENCY
+            )
+            semaphore = asyncio.Semaphore(STATS_CHANNELS_CONCURRENCY)
+
+            async def fetch_channel(channel_username: str, message_ids: List[int]):
+                nonlocal retry_after
+                if not message_ids:
+                    stats[channel_username] = []
+                    return
+                try:
+                    async with semaphore:
+                        stats[channel_username] = await parser.get_messages_stats(
+                            channel_username=channel_username,
+                            message_ids=message_ids
+                        )
+                except FloodWait as e:
+                    retry_after = max(retry_after or 0, int(e.value))
+                    errors[channel_username] = f"Слишком много запросов к Telegram. Повторите через {e.value} секунд"
+                except Exception as e:
+                    print(f"[STATS] Error for {channel_username}: {type(e).__name__} - {e}")
+                    errors[channel_username] = str(e)
+
+            await asyncio.gather(*(
+                fetch_channel(channel_username, message_ids)
+                for channel_username, message_ids in request.channels.items()
+            ))
+
+    except Exception as e:
+        print(f"[STATS] Batch error: {type(e).__name__} - {e}")
+        return BatchMessageStatsResponse(
+            success=False,
+            error=str(e)
+        )
+
+    print(f"[STATS] Batch done: {len(stats)} channels ok, {len(errors)} failed")
+
+    return BatchMessageStatsResponse(
+        success=bool(stats),
+        stats=stats,
+        errors=errors or None,
+        retry_after=retry_after
+    )
+
+
+@app.post("/watches", response_model=WatchResponse)
+async def create_watch(request: WatchRequest):
+    """
+    Зарегистрировать наблюдение за статистикой сообщений
+
+    Сервис сам опрашивает Telegram: свежие посты — каждые interval секунд,
+    старые — всё реже. В callback_url отправляются только сообщения, у которых
+    изменились views, forwards или реакции: {"watch_id", "channel_username", "stats": [...]}.
+    """
+    if not request.message_ids:
+        return WatchResponse(success=False, error="message_ids не может быть пустым")
+
+    if not stats_watcher:
+        return WatchResponse(success=False, error="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены")
+
+    watch_id, messages = stats_watcher.register(
+        session_string=request.session_string,
+        channel_username=request.channel_username,
+        message_ids=request.message_ids,
+        callback_url=request.callback_url,
+        interval=max(WATCH_MIN_INTERVAL, request.interval or WATCH_MIN_INTERVAL),
+        ttl=request.ttl
+    )
+    print(f"[WATCH] Registered {watch_id} for {request.channel_username}, messages={messages}")
+
+    return WatchResponse(success=True, watch_id=watch_id, messages=messages)
+
+
+@app.get("/watches/{watch_id}")
+async def get_watch(watch_id: str):
+    """
+    Описание наблюдения и время следующего опроса
+    """
+    watch = stats_watcher.get(watch_id) if stats_watcher else None
+    if not watch:
+        raise HTTPException(status_code=404, detail="Наблюдение не найдено")
+    return watch
+
+
+@app.delete("/watches/{watch_id}")
+async def delete_watch(watch_id: str):
+    """
+    Снять наблюдение
+    """
+    if not stats_watcher or not stats_watcher.remove(watch_id):
+        raise HTTPException(status_code=404, detail="Наблюдение не найдено")
+    return {"success": True}
+
+
+async def fetch_watched_stats(session_string: str, channel_username: str, message_ids: List[int]) -> List[Dict[str, Any]]:
+    """Получить статистику для наблюдателя (фоновый режим: FloodWait пережидается)"""
+    async with client_pool.acquire(session_string) as client:
+        parser = TelegramChannelParser(
+            api_id=int(API_ID),
+            api_hash=API_HASH,
+            session_string=session_string,
+            client=client,
+            peer_cache=peer_cache,
+            rate_limiter=rate_limiter,
+            stats_concurrency=STATS_CONCURRENCY
+        )
+        return await parser.get_messages_stats(
+            channel_username=channel_username,
+            message_ids=message_ids
+        )
 
 
 @app.post("/sync", response_model=SyncResponse)
-async def sync_channel(request: SyncRequest, background_tasks: BackgroundTasks):
+async def sync_channel(request: SyncRequest):
     """
-    Запустить синхронизацию канала в фоне
+    Поставить синхронизацию канала в очередь
     """
     print(f"[SYNC] Request received: channel={request.channel_username}, import_type={request.import_type}")
     print(f"[SYNC] project_id={request.project_id}, callback_url={request.callback_url}")
@@ -450,25 +886,241 @@ async def sync_channel(request: SyncRequest, background_tasks: BackgroundTasks):
             detail="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"
         )
 
-    # Запускаем парсинг в фоне
-    background_tasks.add_task(
-        process_channel_sync,
-        request.channel_site_id,
-        request.project_id,
-        request.channel_username,
-        request.session_string,
-        request.bot_token,
-        request.callback_url,
-        request.limit,
-        request.import_type
+    if request.compression and request.compression.lower() not in COMPRESSION_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"compression должен быть одним из: {', '.join(COMPRESSION_ENCODINGS)}"
+        )
+
+    # Повторный запрос того же канала, типа импорта и сессии присоединяется к уже идущей задаче
+    target_id = request.project_id if request.import_type == "style_samples" else request.channel_site_id
+    dedupe_key = "|".join([
+        session_key(request.session_string),
+        request.channel_username.lstrip("@").lower(),
+        request.import_type or "",
+        target_id or ""
+    ])
+    if request.until_date:
+        # Импорты разных периодов одного канала не объединяются
+        dedupe_key += f"|{request.since_date or ''}-{request.until_date}"
+    job_id, merged = sync_queue.enqueue(request.model_dump(), dedupe_key)
+
+    if merged:
+        print(f"[SYNC] Merged into in-flight job {job_id}")
+        return SyncResponse(
+            status="started",
+            message=f"Синхронизация канала {request.channel_username} уже выполняется",
+            job_id=job_id,
+            merged=True
+        )
+
+    return SyncResponse(
+        status="started",
+        message=f"Синхронизация канала {request.channel_username} запущена",
+        job_id=job_id
     )
 
+
+@app.post("/sync/batch", response_model=SyncResponse)
+async def sync_channels_batch(request: SyncBatchRequest):
+    """
+    Поставить в очередь синхронизацию нескольких каналов одной сессии
+
+    Каналы выполняются одной задачей на общем клиенте Pyrogram; каждый канал
+    доставляется в свой callback так же, как при /sync. Прогресс и итог
+    по каналам — в result задачи (GET /sync/{job_id}).
+    """
+    print(f"[SYNC] Batch request received: {len(request.channels)} channels")
+
+    if not API_ID or not API_HASH:
+        raise HTTPException(
+            status_code=500,
+            detail="TELEGRAM_API_ID и TELEGRAM_API_HASH не настроены"
+        )
+
+    if not request.channels:
+        raise HTTPException(status_code=400, detail="channels не может быть пустым")
+
+    missing_callback = [channel.channel_username for channel in request.channels
+                        if not (channel.callback_url or request.callback_url)]
+    if missing_callback:
+        raise HTTPException(
+            status_code=400,
+            detail=f"callback_url не задан для каналов: {', '.join(missing_callback)}"
+        )
+
+    if request.compression and request.compression.lower() not in COMPRESSION_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"compression должен быть одним из: {', '.join(COMPRESSION_ENCODINGS)}"
+        )
+
+    # Тот же набор каналов той же сессии, пока задача в очереди или выполняется, объединяется
+    channel_keys = sorted(
+        "/".join([
+            channel.channel_username.lstrip("@").lower(),
+            channel.import_type or request.import_type or "",
+            channel.project_id or channel.channel_site_id or ""
+        ])
+        for channel in request.channels
+    )
+    dedupe_key = "|".join([session_key(request.session_string), "batch"] + channel_keys)
+    job_id, merged = sync_queue.enqueue(request.model_dump(), dedupe_key)
+
+    if merged:
+        print(f"[SYNC] Merged batch into in-flight job {job_id}")
+        return SyncResponse(
+            status="started",
+            message=f"Синхронизация {len(request.channels)} каналов уже выполняется",
+            job_id=job_id,
+            merged=True
+        )
+
     return SyncResponse(
         status="started",
-        message=f"Синхронизация канала {request.channel_username} запущена"
+        message=f"Синхронизация {len(request.channels)} каналов запущена",
+        job_id=job_id
     )
 
 
+@app.get("/sync/{job_id}", response_model=SyncJobResponse)
+async def get_sync_job(job_id: str):
+    """
+    Статус и прогресс задачи синхронизации
+    """
+    job = sync_queue.get(job_id) if sync_queue else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    return SyncJobResponse(**job)
+
+
+async def run_sync_job(payload: Dict[str, Any], reporter: JobReporter) -> Dict[str, Any]:
+    """Выполнить задачу из очереди (payload — поля SyncRequest или SyncBatchRequest)"""
+    if "channels" in payload:
+        return await run_sync_batch(payload, reporter)
+    return await run_channel_sync(payload, reporter)
+
+
+async def report_abandoned_job(payload: Dict[str, Any], error: str):
+    """Задача брошена после max_attempts прерываний — сообщить об ошибке в callback каждого канала"""
+    if "channels" in payload:
+        shared = {key: value for key, value in payload.items() if key not in ("channels", "concurrency")}
+        channels = [
+            dict(shared, **{key: value for key, value in channel.items() if value is not None})
+            for channel in payload["channels"]
+        ]
+    else:
+        channels = [payload]
+    for channel_payload in channels:
+        if channel_payload.get("callback_url"):
+            await send_callback(
+                channel_payload["callback_url"],
+                sync_error_data(channel_payload, error),
+                compression=channel_payload.get("compression")
+            )
+
+
+async def run_sync_batch(payload: Dict[str, Any], reporter: JobReporter) -> Dict[str, Any]:
+    """
+    Синхронизировать каналы пакета на одном клиенте
+
+    Клиент берётся из пула один раз и удерживается до конца пакета, поэтому
+    синхронизации каналов получают его из пула без нового подключения и не
+    вытесняются другими сессиями. Ошибка одного канала не останавливает остальные.
+    """
+    shared = {key: value for key, value in payload.items() if key not in ("channels", "concurrency")}
+    channels = []
+    for channel in payload["channels"]:
+        channel_payload = dict(shared)
+        channel_payload.update({key: value for key, value in channel.items() if value is not None})
+        channels.append(channel_payload)
+
+    reporters = reporter.channels([
+        {
+            "channel_username": channel["channel_username"],
+            "channel_site_id": channel.get("channel_site_id"),
+            "project_id": channel.get("project_id")
+        }
+        for channel in channels
+    ])
+    concurrency = max(1, min(payload.get("concurrency") or SYNC_BATCH_CONCURRENCY, SYNC_BATCH_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+    print(f"[SYNC] Batch of {len(channels)} channels, concurrency={concurrency}")
+
+    async def run_channel(channel_payload: Dict[str, Any], channel_reporter) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await run_channel_sync(channel_payload, channel_reporter)
+            except Exception as e:
+                print(f"[SYNC] Batch channel {channel_payload['channel_username']} crashed: {type(e).__name__} - {e}")
+                result = {"status": "error", "posts": 0, "error": str(e)}
+        channel_reporter.finish(result)
+        return result
+
+    try:
+        async with client_pool.acquire(payload["session_string"]):
+            results = await asyncio.gather(*(
+                run_channel(channel_payload, channel_reporter)
+                for channel_payload, channel_reporter in zip(channels, reporters)
+            ))
+    except Exception as e:
+        # Клиент не запустился — каналы не начинались, сообщаем об ошибке в callback каждого
+        print(f"[SYNC] Batch failed to start client: {type(e).__name__} - {e}")
+        for channel_payload, channel_reporter in zip(channels, reporters):
+            await send_callback(
+                channel_payload["callback_url"],
+                sync_error_data(channel_payload, str(e)),
+                compression=channel_payload.get("compression")
+            )
+            channel_reporter.finish({"status": "error", "error": str(e)})
+        return {"status": "error", "posts": 0, "error": str(e), "channels": reporter.channel_results}
+
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    summary = {
+        "status": "success" if succeeded == len(results) else ("partial" if succeeded else "error"),
+        "posts": sum(result.get("posts") or 0 for result in results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "channels": reporter.channel_results
+    }
+    if not succeeded:
+        summary["error"] = "Ни один канал не синхронизирован"
+    return summary
+
+
+async def run_channel_sync(payload: Dict[str, Any], reporter) -> Dict[str, Any]:
+    """Синхронизировать один канал (payload — поля SyncRequest)"""
+    delivery = payload.get("delivery") or "single"
+    started = time.perf_counter()
+    with metrics.SYNCS_IN_FLIGHT.track_inprogress():
+        result = await process_channel_sync(
+            channel_site_id=payload.get("channel_site_id"),
+            project_id=payload.get("project_id"),
+            channel_username=payload["channel_username"],
+            session_string=payload["session_string"],
+            bot_token=payload.get("bot_token"),
+            callback_url=payload["callback_url"],
+            limit=payload.get("limit") or 1000,
+            import_type=payload.get("import_type") or "channel_site",
+            since_message_id=payload.get("since_message_id"),
+            since_date=payload.get("since_date"),
+            until_date=payload.get("until_date"),
+            parallel=payload.get("parallel", False),
+            download_media=payload.get("download_media", False),
+            diff=payload.get("diff", False),
+            incremental=payload.get("incremental", False),
+            delivery=delivery,
+            page_size=payload.get("page_size") or 100,
+            compression=payload.get("compression"),
+            reporter=reporter
+        )
+
+    metrics.SYNC_SECONDS.labels(delivery, result["status"]).observe(time.perf_counter() - started)
+    metrics.SYNC_POSTS.labels(delivery).observe(result.get("posts") or 0)
+    return result
+
+
 async def process_channel_sync(
     channel_site_id: Optional[str],
     project_id: Optional[str],
@@ -477,120 +1129,223 @@ async def process_channel_sync(
     bot_token: str,
     callback_url: str,
     limit: int,
-    import_type: str
-):
+    import_type: str,
+    since_message_id: Optional[int] = None,
+    since_date: Optional[int] = None,
+    until_date: Optional[int] = None,
+    parallel: bool = False,
+    download_media: bool = False,
+    diff: bool = False,
+    incremental: bool = False,
+    delivery: str = "single",
+    page_size: int = 100,
+    compression: Optional[str] = None,
+    reporter: Optional[JobReporter] = None
+) -> Dict[str, Any]:
     """
     Фоновая задача: парсит канал и отправляет результаты в callback
+
+    Returns:
+        Итог синхронизации для статуса задачи в очереди
     """
-    print(f"[SYNC] Starting channel sync: {channel_username}")
-    parser = None
+    print(f"[SYNC] Starting channel sync: {channel_username}, delivery={delivery}, parallel={parallel}, diff={diff}")
+    target_id = project_id if import_type == "style_samples" else channel_site_id
+
+    # Курсор из прошлой синхронизации, если Rails не передал свой
+    if incremental and since_message_id is None and since_date is None:
+        cursor = sync_cursors.get(channel_username, import_type, target_id)
+        if cursor:
+            since_message_id = cursor["message_id"]
+            print(f"[SYNC] Incremental mode, since_message_id={since_message_id}")
+
+    # Формируем данные в зависимости от типа импорта
+    if import_type == "style_samples":
+        # Для импорта стиля отправляем project_id и channel_username
+        envelope = {"project_id": project_id, "channel_username": channel_username}
+    else:
+        # Для channel_site отправляем channel_site_id
+        envelope = {"channel_site_id": channel_site_id}
+
+    # Новый high-water mark: самый свежий пост или прежний курсор, если новых нет
+    high_water_mark = HighWaterMark(
+        since_message_id,
+        since_date,
+        on_progress=reporter.progress if reporter else None
+    )
+
     try:
-        parser = TelegramChannelParser(
-            api_id=int(API_ID),
-            api_hash=API_HASH,
-            session_string=session_string,
-            bot_token=bot_token
-        )
-
-        print(f"[SYNC] Parser created, starting...")
-        await parser.start()
-        print(f"[SYNC] Parser started, fetching history...")
-
-        # Получаем историю канала
-        posts = await parser.get_channel_history(channel_username, limit=limit)
-        print(f"[SYNC] Got {len(posts)} posts from {channel_username}")
-
-        # Формируем данные в зависимости от типа импорта
-        if import_type == "style_samples":
-            # Для импорта стиля отправляем project_id и channel_username
-            callback_data = {
-                "project_id": project_id,
-                "channel_username": channel_username,
-                "status": "success",
-                "posts": posts
-            }
-        else:
-            # Для channel_site отправляем channel_site_id
-            callback_data = {
-                "channel_site_id": channel_site_id,
-                "status": "success",
-                "posts": posts
-            }
-
-        # Отправляем результаты в Rails
-        print(f"[SYNC] Sending callback to {callback_url}")
-        await send_callback(callback_url, callback_data)
-        print(f"[SYNC] Callback sent successfully")
+        # Режим diff: дальше проходят только посты, которых нет в индексе или которые изменились.
+        # Индекс читается внутри try: ошибка SQLite или битый индекс тоже уходят в callback
+        tracker = DiffTracker(
+            fingerprints.load(channel_username, import_type, target_id),
+            read_from_top=not until_date
+        ) if diff else None
+
+        async with client_pool.acquire(session_string) as client:
+            parser = TelegramChannelParser(
+                api_id=int(API_ID),
+                api_hash=API_HASH,
+                session_string=session_string,
+                bot_token=bot_token,
+                bot_api_url=BOT_API_URL,
+                client=client,
+                http_client=http_pool.bot_api,
+                media_concurrency=MEDIA_RESOLVE_CONCURRENCY,
+                file_cache=file_cache,
+                peer_cache=peer_cache,
+                rate_limiter=rate_limiter,
+                on_flood_wait=reporter.flood_wait if reporter else None,
+                history_concurrency=HISTORY_CONCURRENCY,
+                media_store=media_store if download_media else None
+            )
+
+            print(f"[SYNC] Client acquired, fetching history...")
+
+            posts = parser.iter_channel_history(
+                channel_username,
+                limit=limit,
+                since_message_id=since_message_id,
+                since_date=since_date,
+                until_date=until_date,
+                parallel=parallel
+            )
+            if tracker:
+                posts = tracker.filter(posts)
+
+            # Отправляем результаты в Rails
+            print(f"[SYNC] Sending callback to {callback_url}")
+            send = partial(send_callback, compression=compression)
+            if delivery == "pages":
+                delivered = await deliver_pages(
+                    send, callback_url, envelope, posts, max(1, page_size or 100), high_water_mark,
+                    completion=tracker.summary if tracker else None
+                )
+            elif delivery == "ndjson":
+                delivered = await deliver_ndjson(
+                    http_pool.callback, callback_url, envelope, posts, high_water_mark,
+                    compressor=callback_compressor,
+                    encoding=callback_compressor.choose(callback_url, compression),
+                    completion=tracker.summary if tracker else None
+                )
+            else:
+                collected = [post async for post in high_water_mark.track(posts)]
+                print(f"[SYNC] Got {len(collected)} posts from {channel_username}")
+                callback_data = dict(envelope)
+                callback_data.update({
+                    "status": "success",
+                    "posts": collected,
+                    "high_water_mark": high_water_mark.as_dict()
+                })
+                if tracker:
+                    callback_data.update(tracker.summary())
+                delivered = await send(callback_url, callback_data)
+
+        print(f"[SYNC] Processed {high_water_mark.count} posts from {channel_username}, delivered={delivered}")
+
+        # Курсор двигаем только после того, как Rails принял посты
+        # (импорт периода в прошлом курсор не трогает)
+        if delivered and high_water_mark.message_id and not until_date:
+            sync_cursors.set(
+                channel_username,
+                import_type,
+                target_id,
+                high_water_mark.message_id,
+                high_water_mark.date
+            )
+            print(f"[SYNC] Callback sent successfully, cursor={high_water_mark.message_id}")
+
+        # Индекс отпечатков — тоже только после того, как Rails принял изменения,
+        # иначе следующая синхронизация посчитала бы неотправленные посты уже известными
+        if delivered and tracker:
+            fingerprints.save(channel_username, import_type, target_id, tracker.result())
+
+        result = {
+            "status": "success" if delivered else "error",
+            "posts": high_water_mark.count,
+            "high_water_mark": high_water_mark.as_dict()
+        }
+        if tracker:
+            result["diff"] = tracker.summary()["diff"]
+        if not delivered:
+            result["error"] = "Callback не доставлен"
+        return result
 
     except Exception as e:
         # Отправляем ошибку
         print(f"[SYNC] ERROR: {type(e).__name__} - {e}")
-        error_data = {
-            "status": "error",
-            "error": str(e)
-        }
-        if import_type == "style_samples":
-            error_data["project_id"] = project_id
-        else:
-            error_data["channel_site_id"] = channel_site_id
+        error_data = sync_error_data(
+            {"import_type": import_type, "project_id": project_id, "channel_site_id": channel_site_id},
+            str(e)
+        )
+        await send_callback(callback_url, error_data, compression=compression)
+        return {"status": "error", "posts": high_water_mark.count, "error": str(e)}
 
-        await send_callback(callback_url, error_data)
-    finally:
-        if parser:
-            await parser.stop()
-
-
-def make_json_serializable(obj):
-    """Рекурсивно преобразовать объект в JSON-сериализуемый формат"""
-    if obj is None:
-        return None
-    if isinstance(obj, (str, int, float, bool)):
-        return obj
-    if isinstance(obj, (datetime,)):
-        return obj.isoformat()
-    if isinstance(obj, dict):
-        return {str(k): make_json_serializable(v) for k, v in obj.items()}
-    if isinstance(obj, (list, tuple)):
-        return [make_json_serializable(item) for item in obj]
-    if hasattr(obj, 'value'):
-        # Enum
-        return make_json_serializable(obj.value)
-    if hasattr(obj, 'name') and hasattr(obj, '__class__'):
-        # Enum by name
-        return obj.name
-    # Fallback - конвертируем в строку
-    return str(obj)
-
-
-async def send_callback(url: str, data: dict):
-    """Отправить результаты в callback URL"""
-    # Предварительно преобразуем данные в JSON-сериализуемый формат
-    safe_data = make_json_serializable(data)
-
-    # Проверяем сериализуемость перед отправкой
+
+def sync_error_data(payload: Dict[str, Any], error: str) -> Dict[str, Any]:
+    """Callback об ошибке синхронизации (с project_id или channel_site_id в зависимости от типа импорта)"""
+    error_data = {
+        "status": "error",
+        "error": error
+    }
+    if payload.get("import_type") == "style_samples":
+        error_data["project_id"] = payload.get("project_id")
+    else:
+        error_data["channel_site_id"] = payload.get("channel_site_id")
+    return error_data
+
+
+def encode_callback(data: dict) -> bytes:
+    """Сериализовать данные callback в JSON (записи постов, datetime и Enum — за один проход)"""
     try:
-        json.dumps(safe_data)
+        return dumps_json(data)
     except (TypeError, ValueError) as e:
-        print(f"[CALLBACK] JSON serialization test failed: {e}")
+        print(f"[CALLBACK] JSON serialization failed: {e}")
         print(f"[CALLBACK] Problematic data keys: {list(data.keys()) if isinstance(data, dict) else type(data)}")
-        # Пробуем отправить без posts если проблема в них
-        if isinstance(safe_data, dict) and 'posts' in safe_data:
-            safe_data['posts'] = []
-            safe_data['error'] = f"JSON serialization failed: {e}"
-
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"[CALLBACK] Sending to {url}, posts count: {len(safe_data.get('posts', []))}")
-            response = await client.post(
-                url,
-                json=safe_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            print(f"[CALLBACK] Success, status: {response.status_code}")
-        except Exception as e:
-            print(f"[CALLBACK] Failed to send callback: {e}")
-            print(f"[CALLBACK] callback_url={url}")
+        # Пробуем отправить без posts, если проблема в них
+        if isinstance(data, dict) and "posts" in data:
+            data = dict(data, posts=[], error=f"JSON serialization failed: {e}")
+            return dumps_json(data)
+        raise
+
+
+async def send_callback(url: str, data: dict, compression: Optional[str] = None) -> bool:
+    """
+    Отправить результаты в callback URL. Возвращает True, если Rails принял данные
+
+    compression переопределяет CALLBACK_COMPRESSION для этого запроса
+    """
+    raw = encode_callback(data)
+    body, encoding = callback_compressor.compress(raw, callback_compressor.choose(url, compression))
+
+    started = time.perf_counter()
+    try:
+        print(
+            f"[CALLBACK] Sending to {url}, posts count: {len(data.get('posts', []))}, "
+            f"bytes: {len(raw)}" + (f", {encoding}: {len(body)}" if encoding else "")
+        )
+        response = await _post_callback(url, body, encoding)
+        if encoding and response.status_code == 415:
+            # Rails не умеет распаковывать эту кодировку — повторяем без сжатия
+            callback_compressor.reject(url, encoding)
+            body, encoding = raw, None
+            response = await _post_callback(url, body, encoding)
+        callback_compressor.record(len(raw), len(body), encoding)
+        response.raise_for_status()
+        metrics.CALLBACK_SECONDS.labels("json", "success").observe(time.perf_counter() - started)
+        print(f"[CALLBACK] Success, status: {response.status_code}")
+        return True
+    except Exception as e:
+        metrics.CALLBACK_SECONDS.labels("json", "error").observe(time.perf_counter() - started)
+        print(f"[CALLBACK] Failed to send callback: {e}")
+        print(f"[CALLBACK] callback_url={url}")
+        return False
+
+
+async def _post_callback(url: str, body: bytes, encoding: Optional[str]):
+    headers = {"Content-Type": "application/json"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return await http_pool.callback.post(url, content=body, headers=headers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+"""
+Скачивание медиа через клиент Pyrogram в локальное хранилище
+Файлы лежат по file_unique_id (один файл — одна копия, сколько бы постов его ни содержали)
+и отдаются сервисом по постоянным URL, без bot_token и лимита Bot API в 20 МБ
+"""
+
+import asyncio
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+import metrics
+from records import Media
+
+# Превью: самая маленькая миниатюра Telegram не меньше этой ширины
+THUMB_MIN_WIDTH = 160
+
+_SAFE_KEY = re.compile(r"[^A-Za-z0-9_-]")
+_SAFE_EXT = re.compile(r"^\.[a-z0-9]{1,8}$")
+_RELATIVE_PATH = re.compile(r"^[0-9a-f]{2}/[A-Za-z0-9_-]+\.[a-z0-9]{1,8}$")
+
+
+def load_secret(path: str) -> bytes:
+    """
+    Ключ подписи ссылок на медиа из файла; при первом запуске файл создаётся
+
+    Файл общий для всех воркеров и переживает перезапуск, поэтому выданные
+    ссылки остаются действительными.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    secret = os.urandom(32).hex().encode()
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+class MediaStore:
+    """
+    Хранилище файлов с адресацией по file_unique_id
+
+    Путь файла — root/<2 символа хеша>/<file_unique_id><ext>, URL — тот же путь
+    относительно base_url с подписью (HMAC пути на ключе secret): файлы скачаны
+    сессиями пользователей, в том числе из приватных каналов, поэтому по одному
+    file_unique_id файл не отдаётся. Файл пишется во временный и переименовывается, поэтому
+    по URL никогда не отдаётся недокачанный файл. Одновременные запросы одного файла
+    (в том числе из разных синхронизаций) скачивают его один раз.
+
+    Скачивания ограничены числом (concurrency) и объёмом в полёте (byte_budget):
+    файл начинает качаться, только когда его размер помещается в бюджет.
+
+    Каталог ограничен max_disk_bytes (0 — без ограничения): когда файлы его превышают,
+    удаляются давно не использованные (по mtime, он обновляется при каждом обращении),
+    пока не останется 90% лимита.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        base_url: str,
+        secret: bytes,
+        concurrency: int = 4,
+        byte_budget: int = 64 * 1024 * 1024,
+        max_file_size: int = 50 * 1024 * 1024,
+        max_disk_bytes: int = 0
+    ):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret
+        self.byte_budget = byte_budget
+        self.max_file_size = max_file_size
+        self.max_disk_bytes = max_disk_bytes
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._budget = asyncio.Condition()
+        self._in_flight_bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # Объём каталога: считается при открытии и уточняется при каждом вытеснении
+        self._disk_bytes = 0
+        self._evict_lock = asyncio.Lock()
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.hits = 0
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.skipped_too_big = 0
+        self.failures = 0
+
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in _scan(self.root))
+
+    def relative_path(self, key: str, ext: str) -> str:
+        # file_unique_id одного типа начинаются одинаково — каталог выбираем по хешу
+        key = _SAFE_KEY.sub("_", key)
+        return f"{hashlib.sha1(key.encode()).hexdigest()[:2]}/{key}{ext}"
+
+    def url(self, key: str, ext: str) -> str:
+        relative = self.relative_path(key, ext)
+        return f"{self.base_url}/{relative}?sig={self.signature(relative)}"
+
+    def signature(self, relative: str) -> str:
+        return hmac.new(self.secret, relative.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def file_path(self, relative: str, signature: str) -> Optional[str]:
+        """Путь файла для раздачи или None, если подпись не подходит или файла нет"""
+        if not _RELATIVE_PATH.match(relative) or not hmac.compare_digest(signature, self.signature(relative)):
+            return None
+        path = os.path.join(self.root, relative)
+        return path if _touch(path, self.max_disk_bytes > 0) else None
+
+    async def fetch(self, client: Client, media, key: str, ext: str) -> Optional[str]:
+        """
+        URL файла в хранилище; при необходимости файл скачивается через client
+
+        Args:
+            client: Запущенный клиент Pyrogram (сессия, у которой есть доступ к каналу)
+            media: Объект медиа Pyrogram (Photo, Video, Thumbnail ...), передаётся в stream_media
+            key: file_unique_id
+            ext: Расширение файла с точкой
+
+        Returns:
+            URL или None, если файл слишком большой или скачать не удалось
+        """
+        relative = self.relative_path(key, ext)
+        path = os.path.join(self.root, relative)
+        if _touch(path, self.max_disk_bytes > 0):
+            self.hits += 1
+            metrics.MEDIA_FILES.labels("hit").inc()
+            return self.url(key, ext)
+
+        in_flight = self._in_flight.get(relative)
+        if in_flight:
+            self.hits += 1
+            metrics.MEDIA_FILES.labels("hit").inc()
+            return await asyncio.shield(in_flight)
+
+        size = getattr(media, "file_size", None) or 0
+        if size > self.max_file_size:
+            self.skipped_too_big += 1
+            metrics.MEDIA_FILES.labels("too_big").inc()
+            return None
+
+        future = self._in_flight[relative] = asyncio.get_running_loop().create_future()
+        try:
+            url = await self._download(client, media, path, size, key, ext)
+            future.set_result(url)
+            return url
+        except BaseException as e:
+            future.set_result(None)
+            if isinstance(e, Exception):
+                self.failures += 1
+                metrics.MEDIA_FILES.labels("error").inc()
+                print(f"[MEDIA] Failed to download {key}: {type(e).__name__} - {e}")
+                return None
+            raise
+        finally:
+            del self._in_flight[relative]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "downloads": self.downloads,
+            "downloaded_bytes": self.downloaded_bytes,
+            "in_flight": len(self._in_flight),
+            "in_flight_bytes": self._in_flight_bytes,
+            "byte_budget": self.byte_budget,
+            "disk_bytes": self._disk_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+            "evicted": self.evicted,
+            "evicted_bytes": self.evicted_bytes,
+            "skipped_too_big": self.skipped_too_big,
+            "failures": self.failures
+        }
+
+    async def _download(self, client: Client, media, path: str, size: int, key: str, ext: str) -> str:
+        async with self._semaphore:
+            await self._reserve(size)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+                written = 0
+                # Файловые операции — в потоке, чтобы запись больших файлов не останавливала event loop
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    try:
+                        # stream_media отдаёт файл кусками по 1 МБ — целиком в памяти он не держится
+                        async for chunk in client.stream_media(media):
+                            await asyncio.to_thread(f.write, chunk)
+                            written += len(chunk)
+                            if written > self.max_file_size:
+                                raise ValueError(f"file is larger than {self.max_file_size} bytes")
+                    finally:
+                        await asyncio.to_thread(f.close)
+                    await asyncio.to_thread(os.replace, tmp_path, path)
+                finally:
+                    await asyncio.to_thread(_remove_if_exists, tmp_path)
+            finally:
+                await self._release(size)
+
+        self.downloads += 1
+        self.downloaded_bytes += written
+        self._disk_bytes += written
+        metrics.MEDIA_FILES.labels("downloaded").inc()
+        metrics.MEDIA_BYTES.inc(written)
+        if self.max_disk_bytes and self._disk_bytes > self.max_disk_bytes:
+            await self._evict()
+        return self.url(key, ext)
+
+    async def _evict(self):
+        """Удалить давно не использованные файлы, пока каталог не уменьшится до 90% лимита"""
+        async with self._evict_lock:
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            # Обход каталога — в потоке; его результат заодно учитывает файлы других воркеров
+            files = await asyncio.to_thread(_scan, self.root)
+            total = sum(size for _, size, _ in files)
+            target = self.max_disk_bytes * 0.9
+            victims = []
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                victims.append(path)
+                total -= size
+            removed = await asyncio.to_thread(_remove_files, victims)
+            self._disk_bytes = total
+            self.evicted += len(victims)
+            self.evicted_bytes += removed
+            print(f"[MEDIA] Evicted {len(victims)} files ({removed} bytes), {total} bytes left")
+
+    async def _reserve(self, size: int):
+        # Файл больше всего бюджета качается, когда остальные закончились
+        async with self._budget:
+            await self._budget.wait_for(
+                lambda: not self._in_flight_bytes or self._in_flight_bytes + size <= self.byte_budget
+            )
+            self._in_flight_bytes += size
+
+    async def _release(self, size: int):
+        async with self._budget:
+            self._in_flight_bytes -= size
+            self._budget.notify_all()
+
+
+class MediaDownloader:
+    """
+    Скачивание медиа постов одной синхронизации (тот же порядок работы, что у MediaUrlResolver)
+
+    submit() запускает скачивание файла и его превью, пока продолжается чтение
+    истории; fill() проставляет local_url и thumb_url в записи медиа.
+    """
+
+    def __init__(self, client: Client, store: MediaStore):
+        self.client = client
+        self.store = store
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._refs: Dict[str, int] = {}
+
+    def submit(self, media: List[Media], message: Message):
+        """Поставить в очередь скачивание медиа поста"""
+        source = message.photo or message.video or message.document or message.audio
+        if source is None:
+            return
+        for item in media:
+            key = item.file_unique_id
+            if not key:
+                continue
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._run(source, key, _extension(item, source)))
+            self._refs[key] = self._refs.get(key, 0) + 1
+
+    def is_ready(self, media: List[Media]) -> bool:
+        for item in media:
+            task = self._tasks.get(item.file_unique_id)
+            if task and not task.done():
+                return False
+        return True
+
+    async def fill(self, media: List[Media]):
+        """Дождаться скачивания и проставить local_url и thumb_url"""
+        for item in media:
+            key = item.file_unique_id
+            task = self._tasks.get(key)
+            if not task:
+                continue
+            item.local_url, item.thumb_url = await task
+            self._refs[key] -= 1
+            if not self._refs[key]:
+                del self._refs[key]
+                del self._tasks[key]
+
+    def cancel(self):
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    async def _run(self, source, key: str, ext: str) -> Tuple[Optional[str], Optional[str]]:
+        thumb = _thumbnail(source)
+        # Превью маленькое — качаем его первым, чтобы оно не ждало большой файл
+        thumb_url = await self.store.fetch(self.client, thumb, thumb.file_unique_id, ".jpg") if thumb else None
+        return await self.store.fetch(self.client, source, key, ext), thumb_url
+
+
+def _thumbnail(source):
+    """Самая маленькая миниатюра не уже THUMB_MIN_WIDTH (или самая большая из имеющихся)"""
+    thumbs = [thumb for thumb in (getattr(source, "thumbs", None) or []) if thumb.file_id and thumb.file_unique_id]
+    if not thumbs:
+        return None
+    thumbs.sort(key=lambda thumb: thumb.width or 0)
+    for thumb in thumbs:
+        if (thumb.width or 0) >= THUMB_MIN_WIDTH:
+            return thumb
+    return thumbs[-1]
+
+
+def _extension(item: Media, source) -> str:
+    if item.type == "photo":
+        return ".jpg"
+    file_name = getattr(source, "file_name", None) or ""
+    ext = os.path.splitext(file_name)[1].lower()
+    if not _SAFE_EXT.match(ext):
+        ext = mimetypes.guess_extension(getattr(source, "mime_type", None) or "") or ""
+    return ext if _SAFE_EXT.match(ext) else ".bin"
+
+
+def _scan(root: str) -> List[Tuple[float, int, str]]:
+    """(mtime, размер, путь) готовых файлов хранилища; недокачанные .part не учитываются"""
+    files = []
+    for directory in os.scandir(root):
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory.path):
+            if entry.name.endswith(".part") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    return files
+
+
+def _remove_files(paths: List[str]) -> int:
+    removed = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            # Уже удалён другим воркером
+            continue
+        removed += size
+    return removed
+
+
+def _touch(path: str, update_mtime: bool) -> bool:
+    """Есть ли файл; с update_mtime — ещё и отметить обращение для вытеснения"""
+    if not update_mtime:
+        return os.path.isfile(path)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.unlink(path)
@@ -0,0 +1,137 @@
+"""
+Метрики Prometheus
+Задержки маршрутов API, вызовов Pyrogram и getFile, FloodWait, объём синхронизаций, callback и медиа
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# При нескольких воркерах uvicorn метрики пишутся в общий каталог и собираются при чтении
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Вызовы Telegram и callback длятся от миллисекунд до десятков секунд
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+POSTS_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "parser_http_request_duration_seconds",
+    "Время обработки запроса к API сервиса",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+RPC_SECONDS = Histogram(
+    "parser_pyrogram_rpc_duration_seconds",
+    "Время вызова Pyrogram (get_chat_history — одна страница)",
+    ["method"],
+    buckets=LATENCY_BUCKETS
+)
+RPC_ERRORS = Counter(
+    "parser_pyrogram_rpc_errors_total",
+    "Ошибки вызовов Pyrogram",
+    ["method", "error"]
+)
+
+GETFILE_SECONDS = Histogram(
+    "parser_bot_api_getfile_duration_seconds",
+    "Время запроса getFile к Bot API (без попаданий в кеш)",
+    buckets=LATENCY_BUCKETS
+)
+GETFILE_FAILURES = Counter(
+    "parser_bot_api_getfile_failures_total",
+    "Неудачные запросы getFile",
+    ["reason"]
+)
+
+FLOOD_WAITS = Counter(
+    "parser_flood_waits_total",
+    "Количество FloodWait по сессиям",
+    ["session"]
+)
+FLOOD_WAIT_SECONDS = Counter(
+    "parser_flood_wait_seconds_total",
+    "Суммарное время FloodWait по сессиям",
+    ["session"]
+)
+
+SYNC_POSTS = Histogram(
+    "parser_sync_posts",
+    "Количество постов за одну синхронизацию",
+    ["delivery"],
+    buckets=POSTS_BUCKETS
+)
+SYNC_SECONDS = Histogram(
+    "parser_sync_duration_seconds",
+    "Длительность синхронизации канала",
+    ["delivery", "status"],
+    buckets=LATENCY_BUCKETS + (120, 300, 600)
+)
+SYNCS_IN_FLIGHT = Gauge(
+    "parser_syncs_in_flight",
+    "Выполняющиеся синхронизации",
+    multiprocess_mode="livesum"
+)
+
+CALLBACK_BYTES = Counter(
+    "parser_callback_bytes_total",
+    "Объём тел callback до сжатия (raw) и отправленный (sent)",
+    ["kind"]
+)
+CALLBACK_SECONDS = Histogram(
+    "parser_callback_duration_seconds",
+    "Время отправки callback в Rails",
+    ["format", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+MEDIA_FILES = Counter(
+    "parser_media_files_total",
+    "Файлы хранилища медиа: downloaded, hit (уже есть), too_big, error",
+    ["result"]
+)
+MEDIA_BYTES = Counter(
+    "parser_media_downloaded_bytes_total",
+    "Объём медиа, скачанного через Pyrogram"
+)
+
+AUTH_CLIENTS = Gauge(
+    "parser_auth_clients",
+    "Клиенты, ожидающие ввода кода авторизации",
+    multiprocess_mode="livemostrecent"
+)
+
+
+@contextmanager
+def rpc_timer(method: str) -> Iterator[None]:
+    """Замерить вызов Pyrogram и учесть его ошибку"""
+    started = time.perf_counter()
+    try:
+        yield
+    except StopAsyncIteration:
+        raise
+    except Exception as e:
+        RPC_ERRORS.labels(method, type(e).__name__).inc()
+        raise
+    finally:
+        RPC_SECONDS.labels(method).observe(time.perf_counter() - started)
+
+
+def render() -> bytes:
+    """Все метрики в текстовом формате Prometheus (в multiprocess-режиме — всех воркеров)"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def mark_process_dead():
+    """Воркер завершается — его live-метрики (gauge) больше не учитываются"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
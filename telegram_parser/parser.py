@@ -4,19 +4,41 @@ Telegram Channel Parser
 """
 
 import asyncio
+import time
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Deque, Callable
 
 import httpx
-from pyrogram import Client
+from pyrogram import Client, utils
 from pyrogram.types import Message
 from pyrogram.errors import (
     SessionPasswordNeeded,
     PhoneCodeInvalid,
     ChannelPrivate,
+    ChannelInvalid,
+    FloodWait,
+    PeerIdInvalid,
     UsernameNotOccupied
 )
 
+import metrics
+from client_pool import session_key, start_client
+from file_cache import FileUrlCache
+from media_store import MediaStore, MediaDownloader
+from peer_cache import PeerCache
+from rate_limiter import SessionRateLimiter
+from records import Post, Entity, Media, PhotoMedia, VideoMedia, DocumentMedia, AudioMedia
+
+# Pyrogram читает историю страницами по 100 сообщений
+HISTORY_PAGE_SIZE = 100
+
+# Максимум id в одном вызове messages.getMessages / channels.getMessages
+STATS_BATCH_SIZE = 100
+
+# Адрес Bot API (можно заменить на локальный telegram-bot-api сервер)
+BOT_API_URL = "https://api.telegram.org"
+
 
 class TelegramChannelParser:
     """
@@ -28,44 +50,138 @@ class TelegramChannelParser:
         api_id: int,
         api_hash: str,
         session_string: str,
-        bot_token: Optional[str] = None
+        bot_token: Optional[str] = None,
+        client: Optional[Client] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        media_concurrency: int = 8,
+        file_cache: Optional[FileUrlCache] = None,
+        peer_cache: Optional[PeerCache] = None,
+        rate_limiter: Optional[SessionRateLimiter] = None,
+        max_flood_wait: Optional[float] = None,
+        on_flood_wait: Optional[Callable[[int], None]] = None,
+        stats_concurrency: int = 4,
+        bot_api_url: str = BOT_API_URL,
+        history_concurrency: int = 4,
+        media_store: Optional[MediaStore] = None
     ):
         self.api_id = api_id
         self.api_hash = api_hash
         self.session_string = session_string
         self.bot_token = bot_token
-        self.client: Optional[Client] = None
+        self.bot_api_url = bot_api_url.rstrip("/")
+        # Клиент из пула уже запущен, и его жизненным циклом управляет пул
+        self.client: Optional[Client] = client
+        self._owns_client = client is None
+        # Общий keep-alive клиент для Bot API (если не передан — создаётся на каждый запрос)
+        self.http_client = http_client
+        # Сколько запросов getFile выполнять одновременно
+        self.media_concurrency = media_concurrency
+        # Кеш результатов getFile между синхронизациями
+        self.file_cache = file_cache
+        # Кеш разрешённых username (общий для всех запросов этой сессии)
+        self.peer_cache = peer_cache
+        self._session_key = session_key(session_string)
+        # Темп запросов сессии и повтор после FloodWait
+        self.rate_limiter = rate_limiter
+        self.max_flood_wait = max_flood_wait
+        self.on_flood_wait = on_flood_wait
+        # Сколько батчей get_messages выполнять одновременно
+        self.stats_concurrency = stats_concurrency
+        # Сколько диапазонов id читать одновременно в параллельном режиме истории
+        self.history_concurrency = max(1, history_concurrency)
+        # Хранилище, в которое медиа скачивается через этот клиент (local_url, thumb_url)
+        self.media_store = media_store
 
     async def start(self):
         """Запустить клиент Pyrogram"""
+        if not self._owns_client:
+            return
+
         self.client = Client(
             name="channel_parser",
             api_id=self.api_id,
             api_hash=self.api_hash,
             session_string=self.session_string,
-            in_memory=True
+            in_memory=True,
+            no_updates=True
         )
-        await self.client.start()
+        # Без диспетчера обновлений, GetState и get_me — парсеру они не нужны
+        await start_client(self.client, fast_start=True)
 
     async def stop(self):
         """Остановить клиент"""
-        if self.client:
-            await self.client.stop()
+        if self.client and self._owns_client and self.client.is_connected:
+            await self.client.disconnect()
 
     async def get_channel_history(
         self,
         channel_username: str,
-        limit: int = 1000
-    ) -> List[Dict[str, Any]]:
+        limit: int = 1000,
+        since_message_id: Optional[int] = None,
+        since_date: Optional[int] = None,
+        until_date: Optional[int] = None,
+        parallel: bool = False
+    ) -> List[Post]:
         """
         Получить историю сообщений канала
 
+        История читается от новых сообщений к старым. Если задан курсор,
+        чтение останавливается на первом уже известном сообщении.
+
         Args:
             channel_username: Username канала (без @)
             limit: Максимальное количество сообщений
+            since_message_id: Вернуть только сообщения с id больше этого
+            since_date: Вернуть только сообщения новее этого unix timestamp
+            until_date: Вернуть только сообщения не новее этого unix timestamp
+            parallel: Читать диапазоны id параллельно (для больших каналов)
 
         Returns:
-            Список сообщений в формате словаря
+            Список записей постов (records.Post)
+        """
+        return [
+            post async for post in self.iter_channel_history(
+                channel_username,
+                limit=limit,
+                since_message_id=since_message_id,
+                since_date=since_date,
+                until_date=until_date,
+                parallel=parallel
+            )
+        ]
+
+    async def iter_channel_history(
+        self,
+        channel_username: str,
+        limit: int = 1000,
+        since_message_id: Optional[int] = None,
+        since_date: Optional[int] = None,
+        until_date: Optional[int] = None,
+        parallel: bool = False
+    ) -> AsyncIterator[Post]:
+        """
+        Потоково получать историю канала (от новых к старым)
+
+        Посты отдаются по мере чтения, с уже заполненными URL медиа
+        (url — через Bot API, local_url и thumb_url — если задан media_store).
+        В памяти одновременно держится только окно постов, ожидающих getFile,
+        поэтому потребление памяти не зависит от limit.
+
+        В параллельном режиме границы периода переводятся в диапазон id
+        (id сообщений канала растут со временем), диапазон делится на батчи
+        по 100 id, и до history_concurrency батчей get_messages читаются
+        одновременно. Посты всё равно отдаются по порядку, от новых к старым.
+
+        Args:
+            channel_username: Username канала (без @)
+            limit: Максимальное количество сообщений
+            since_message_id: Вернуть только сообщения с id больше этого
+            since_date: Вернуть только сообщения новее этого unix timestamp
+            until_date: Вернуть только сообщения не новее этого unix timestamp
+            parallel: Читать диапазоны id параллельно
+
+        Yields:
+            Записи постов (records.Post)
         """
         if not self.client:
             raise RuntimeError("Client not started. Call start() first.")
@@ -73,25 +189,76 @@ class TelegramChannelParser:
         # Очищаем username от @
         username = channel_username.lstrip("@")
 
-        try:
-            # Получаем информацию о канале
-            chat = await self.client.get_chat(username)
-
-            posts = []
-            async for message in self.client.get_chat_history(
-                chat_id=chat.id,
-                limit=limit
-            ):
-                post_data = await self._parse_message(message)
-                if post_data:
-                    posts.append(post_data)
+        # URL медиа получаем параллельно, не задерживая чтение истории
+        resolver = MediaUrlResolver(self._get_file_url_via_bot_api, self.media_concurrency)
+        downloader = MediaDownloader(self.client, self.media_store) if self.media_store else None
+        # Окно постов, для которых ещё идут запросы getFile (порядок сохраняется)
+        window: Deque[Post] = deque()
+        window_size = max(1, self.media_concurrency) * 4
 
-            return posts
+        try:
+            chat_id = await self._resolve_chat_id(username)
+
+            if parallel:
+                messages = self._ranged_history_messages(chat_id, limit, since_message_id, since_date, until_date)
+            else:
+                messages = self._history_messages(chat_id, limit, until_date)
+
+            async for message in messages:
+                if since_message_id and message.id <= since_message_id:
+                    break
+                if since_date and message.date and message.date.timestamp() <= since_date:
+                    break
+                if until_date and message.date and message.date.timestamp() > until_date:
+                    continue
+
+                post_data = self._parse_message(message)
+                if not post_data:
+                    continue
+
+                if not post_data.media or (not self.bot_token and not downloader):
+                    if not window:
+                        yield post_data
+                        continue
+                else:
+                    if self.bot_token:
+                        resolver.submit(post_data.media)
+                    if downloader:
+                        downloader.submit(post_data.media, message)
+                window.append(post_data)
+
+                # Отдаём готовые посты из головы окна, не дожидаясь остальных
+                while window and (
+                    len(window) > window_size
+                    or (resolver.is_ready(window[0].media) and (not downloader or downloader.is_ready(window[0].media)))
+                ):
+                    head = window.popleft()
+                    await resolver.fill(head.media)
+                    if downloader:
+                        await downloader.fill(head.media)
+                    yield head
+
+            while window:
+                head = window.popleft()
+                await resolver.fill(head.media)
+                if downloader:
+                    await downloader.fill(head.media)
+                yield head
 
         except UsernameNotOccupied:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} не найден")
         except ChannelPrivate:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} приватный или вы не являетесь участником")
+        except (ChannelInvalid, PeerIdInvalid):
+            # Закешированный peer больше не действителен — при следующем запросе разрешим заново
+            self._invalidate_peer(username)
+            raise
+        finally:
+            resolver.cancel()
+            if downloader:
+                downloader.cancel()
 
     async def get_channel_info(
         self,
@@ -113,8 +280,14 @@ class TelegramChannelParser:
         username = channel_username.lstrip("@")
 
         try:
-            # Получаем информацию о канале
-            chat = await self.client.get_chat(username)
+            # Получаем информацию о канале (по закешированному id — без ResolveUsername)
+            peer = self.peer_cache.get(self._session_key, username) if self.peer_cache else None
+            if peer:
+                await self._seed_peer(peer)
+                chat = await self._invoke(self.client.get_chat, peer.id)
+            else:
+                chat = await self._invoke(self.client.get_chat, username)
+                await self._remember_peer(username, chat)
 
             # Получаем количество участников
             members_count = chat.members_count or 0
@@ -129,9 +302,15 @@ class TelegramChannelParser:
             }
 
         except UsernameNotOccupied:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} не найден")
         except ChannelPrivate:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} приватный или вы не являетесь участником")
+        except (ChannelInvalid, PeerIdInvalid):
+            # Закешированный peer больше не действителен — при следующем запросе разрешим заново
+            self._invalidate_peer(username)
+            raise
 
     async def get_messages_stats(
         self,
@@ -155,43 +334,271 @@ class TelegramChannelParser:
         username = channel_username.lstrip("@")
 
         try:
-            # Получаем информацию о канале
-            chat = await self.client.get_chat(username)
-
-            results = []
-            # Получаем сообщения по ID (батчами по 100)
-            for i in range(0, len(message_ids), 100):
-                batch_ids = message_ids[i:i + 100]
-                messages = await self.client.get_messages(
-                    chat_id=chat.id,
-                    message_ids=batch_ids
-                )
-
-                for message in messages:
-                    if message and not message.empty:
-                        results.append({
-                            "message_id": int(message.id) if message.id else 0,
-                            "views": int(message.views) if message.views else 0,
-                            "forwards": int(message.forwards) if message.forwards else 0,
-                            "reactions": self._parse_reactions(message.reactions) if message.reactions else {}
-                        })
-                    else:
-                        # Сообщение не найдено или удалено
-                        msg_id = batch_ids[messages.index(message)] if message in messages else 0
-                        results.append({
-                            "message_id": msg_id,
-                            "views": 0,
-                            "forwards": 0,
-                            "reactions": {},
-                            "not_found": True
-                        })
-
-            return results
+            chat_id = await self._resolve_chat_id(username)
+
+            # Батчи по 100 id запрашиваем параллельно; результат каждого батча
+            # сопоставляем с запрошенными id по позиции (Pyrogram сохраняет порядок)
+            semaphore = asyncio.Semaphore(max(1, self.stats_concurrency))
+
+            async def fetch_batch(batch_ids: List[int]) -> List[Dict[str, Any]]:
+                async with semaphore:
+                    messages = await self._invoke(
+                        self.client.get_messages,
+                        chat_id=chat_id,
+                        message_ids=batch_ids
+                    )
+                return [
+                    self._message_stats(message_id, message)
+                    for message_id, message in zip(batch_ids, messages)
+                ]
+
+            batches = await asyncio.gather(*(
+                fetch_batch(message_ids[i:i + STATS_BATCH_SIZE])
+                for i in range(0, len(message_ids), STATS_BATCH_SIZE)
+            ))
+
+            return [stats for batch in batches for stats in batch]
 
         except UsernameNotOccupied:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} не найден")
         except ChannelPrivate:
+            self._invalidate_peer(username)
             raise ValueError(f"Канал @{username} приватный или вы не являетесь участником")
+        except (ChannelInvalid, PeerIdInvalid):
+            # Закешированный peer больше не действителен — при следующем запросе разрешим заново
+            self._invalidate_peer(username)
+            raise
+
+    async def _resolve_chat_id(self, username: str) -> int:
+        """
+        Получить id канала по username
+
+        Если канал уже разрешался этой сессией, get_chat не вызывается.
+        """
+        if self.peer_cache:
+            peer = self.peer_cache.get(self._session_key, username)
+            if peer:
+                await self._seed_peer(peer)
+                return peer.id
+
+        chat = await self._invoke(self.client.get_chat, username)
+        await self._remember_peer(username, chat)
+        return chat.id
+
+    async def _invoke(self, method, *args, **kwargs):
+        """Вызвать метод Pyrogram через ограничитель темпа сессии (если он задан)"""
+        name = getattr(method, "__name__", "unknown")
+
+        async def timed(*args, **kwargs):
+            with metrics.rpc_timer(name):
+                return await method(*args, **kwargs)
+
+        if not self.rate_limiter:
+            return await timed(*args, **kwargs)
+
+        return await self.rate_limiter.call(
+            self._session_key,
+            timed,
+            *args,
+            max_wait=self.max_flood_wait,
+            on_wait=self.on_flood_wait,
+            **kwargs
+        )
+
+    async def _history_messages(
+        self,
+        chat_id: int,
+        limit: int,
+        until_date: Optional[int] = None
+    ) -> AsyncIterator[Message]:
+        """
+        get_chat_history с ограничением темпа и продолжением после FloodWait
+
+        Перед каждой страницей берётся токен сессии. При FloodWait чтение
+        продолжается с последнего полученного сообщения (offset_id).
+        С until_date чтение начинается сразу с конца периода (offset_date).
+        """
+        offset_date = _offset_date(until_date)
+        if not self.rate_limiter:
+            history = self.client.get_chat_history(chat_id=chat_id, limit=limit, offset_date=offset_date)
+            page_position = 0
+            try:
+                while True:
+                    try:
+                        message = await self._next_history_message(history, page_position)
+                    except StopAsyncIteration:
+                        return
+                    page_position += 1
+                    yield message
+            finally:
+                await history.aclose()
+
+        fetched = 0
+        offset_id = 0
+        attempt = 0
+        while not limit or fetched < limit:
+            history = self.client.get_chat_history(
+                chat_id=chat_id,
+                limit=limit - fetched if limit else 0,
+                offset_id=offset_id,
+                # После FloodWait продолжаем по offset_id
+                offset_date=offset_date if not offset_id else _offset_date(None)
+            )
+            page_position = 0
+            try:
+                while True:
+                    if page_position % HISTORY_PAGE_SIZE == 0:
+                        if page_position:
+                            self.rate_limiter.record_success(self._session_key)
+                        await self.rate_limiter.acquire(self._session_key)
+                    try:
+                        message = await self._next_history_message(history, page_position)
+                    except StopAsyncIteration:
+                        self.rate_limiter.record_success(self._session_key)
+                        return
+
+                    page_position += 1
+                    fetched += 1
+                    offset_id = message.id
+                    yield message
+            except FloodWait as e:
+                self.rate_limiter.record_flood_wait(
+                    self._session_key, e, attempt, self.max_flood_wait, self.on_flood_wait
+                )
+                attempt += 1
+            finally:
+                await history.aclose()
+
+    async def _ranged_history_messages(
+        self,
+        chat_id: int,
+        limit: int,
+        since_message_id: Optional[int],
+        since_date: Optional[int],
+        until_date: Optional[int]
+    ) -> AsyncIterator[Message]:
+        """
+        История по диапазонам id: батчи get_messages читаются параллельно, отдаются по порядку
+
+        Вперёд запрашивается не больше history_concurrency батчей; с ограничителем
+        темпа общее число одновременных запросов сессии дополнительно ограничено
+        SessionRateLimiter.slot(). Удалённые и пропущенные id приходят пустыми
+        сообщениями и пропускаются.
+        """
+        top_id = await self._newest_message_id(chat_id, until_date)
+        floor_id = since_message_id or 0
+        if since_date:
+            floor_id = max(floor_id, await self._newest_message_id(chat_id, since_date))
+        if top_id <= floor_id:
+            return
+
+        batches = (
+            list(range(high, max(floor_id, high - STATS_BATCH_SIZE), -1))
+            for high in range(top_id, floor_id, -STATS_BATCH_SIZE)
+        )
+        local_slots = asyncio.Semaphore(self.history_concurrency)
+
+        async def fetch_batch(batch_ids: List[int]) -> List[Message]:
+            slot = self.rate_limiter.slot(self._session_key) if self.rate_limiter else local_slots
+            async with slot:
+                messages = await self._invoke(
+                    self.client.get_messages,
+                    chat_id=chat_id,
+                    message_ids=batch_ids,
+                    replies=0
+                )
+            return messages if isinstance(messages, list) else [messages]
+
+        pending: Deque[asyncio.Task] = deque()
+        fetched = 0
+        try:
+            while True:
+                while len(pending) < self.history_concurrency:
+                    batch_ids = next(batches, None)
+                    if batch_ids is None:
+                        break
+                    pending.append(asyncio.create_task(fetch_batch(batch_ids)))
+                if not pending:
+                    return
+
+                for message in await pending.popleft():
+                    if not message or message.empty:
+                        continue
+                    yield message
+                    fetched += 1
+                    if limit and fetched >= limit:
+                        return
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _newest_message_id(self, chat_id: int, before_date: Optional[int] = None) -> int:
+        """id самого нового сообщения канала (не новее before_date, если задан); 0 — сообщений нет"""
+
+        async def get_chat_history(chat_id: int, offset_date: datetime) -> int:
+            async for message in self.client.get_chat_history(chat_id=chat_id, limit=1, offset_date=offset_date):
+                return message.id
+            return 0
+
+        return await self._invoke(get_chat_history, chat_id, _offset_date(before_date))
+
+    async def _next_history_message(self, history, page_position: int) -> Message:
+        """Следующее сообщение истории. На первом сообщении страницы Pyrogram делает RPC — его замеряем"""
+        if page_position % HISTORY_PAGE_SIZE:
+            return await history.__anext__()
+        with metrics.rpc_timer("get_chat_history"):
+            return await history.__anext__()
+
+    async def _seed_peer(self, peer):
+        """Положить peer в хранилище клиента (клиент мог быть перезапущен и не знать access_hash)"""
+        await self.client.storage.update_peers(
+            [(peer.id, peer.access_hash, peer.peer_type, peer.username, None)]
+        )
+
+    async def _remember_peer(self, username: str, chat):
+        """Сохранить разрешённый канал в общий кеш"""
+        if not self.peer_cache:
+            return
+
+        peer_type = chat.type.name.lower() if hasattr(chat.type, "name") else "channel"
+        if peer_type not in ("channel", "supergroup"):
+            return
+
+        # access_hash уже лежит в хранилище клиента после get_chat — RPC не нужен
+        input_peer = await self.client.resolve_peer(chat.id)
+        self.peer_cache.set(
+            self._session_key,
+            username,
+            id=chat.id,
+            access_hash=input_peer.access_hash,
+            peer_type=peer_type,
+            title=chat.title
+        )
+
+    def _invalidate_peer(self, username: str):
+        if self.peer_cache:
+            self.peer_cache.invalidate(self._session_key, username)
+
+    def _message_stats(self, message_id: int, message: Optional[Message]) -> Dict[str, Any]:
+        """Статистика одного сообщения (или заглушка, если оно не найдено или удалено)"""
+        if message and not message.empty:
+            return {
+                "message_id": int(message.id) if message.id else message_id,
+                "date": int(message.date.timestamp()) if message.date else None,
+                "views": int(message.views) if message.views else 0,
+                "forwards": int(message.forwards) if message.forwards else 0,
+                "reactions": self._parse_reactions(message.reactions) if message.reactions else {}
+            }
+
+        return {
+            "message_id": message_id,
+            "views": 0,
+            "forwards": 0,
+            "reactions": {},
+            "not_found": True
+        }
 
     def _parse_reactions(self, reactions) -> Dict[str, int]:
         """Преобразовать реакции сообщения в словарь"""
@@ -204,12 +611,17 @@ class TelegramChannelParser:
                     result[f"custom:{reaction.custom_emoji_id}"] = int(reaction.count) if hasattr(reaction, 'count') else 0
         return result
 
-    async def _get_file_url_via_bot_api(self, file_id: str) -> Optional[str]:
+    async def _get_file_url_via_bot_api(
+        self,
+        file_id: str,
+        file_unique_id: Optional[str] = None
+    ) -> Optional[str]:
         """
         Получить прямой URL файла через Telegram Bot API
 
         Args:
             file_id: Telegram file_id из сообщения
+            file_unique_id: Постоянный идентификатор файла (ключ кеша)
 
         Returns:
             Прямой URL для скачивания файла или None в случае ошибки
@@ -217,32 +629,54 @@ class TelegramChannelParser:
         if not self.bot_token:
             return None
 
-        try:
-            async with httpx.AsyncClient() as client:
-                # Получаем file_path через getFile API метод
-                response = await client.get(
-                    f"https://api.telegram.org/bot{self.bot_token}/getFile",
-                    params={"file_id": file_id},
-                    timeout=10.0
-                )
-                data = response.json()
-
-                if not data.get("ok"):
+        cache_key = None
+        if self.file_cache:
+            cache_key = FileUrlCache.make_key(self.bot_token, file_id, file_unique_id)
+            found, file_path = self.file_cache.get(cache_key)
+            if found:
+                if file_path is None:
                     return None
+                return f"{self.bot_api_url}/file/bot{self.bot_token}/{file_path}"
 
-                file_path = data["result"]["file_path"]
-
-                # Формируем прямой URL для скачивания
-                return f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+        started = time.perf_counter()
+        try:
+            # Получаем file_path через getFile API метод
+            url = f"{self.bot_api_url}/bot{self.bot_token}/getFile"
+            if self.http_client:
+                response = await self.http_client.get(url, params={"file_id": file_id})
+            else:
+                async with httpx.AsyncClient() as client:
+                    response = await client.get(url, params={"file_id": file_id}, timeout=10.0)
+            metrics.GETFILE_SECONDS.observe(time.perf_counter() - started)
+            data = response.json()
+
+            if not data.get("ok"):
+                metrics.GETFILE_FAILURES.labels(str(data.get("error_code") or response.status_code)).inc()
+                # 400 — окончательный отказ (файл больше 20 МБ, неверный file_id), его можно кешировать;
+                # 429 и 5xx — временные ошибки, их повторим в следующий раз
+                if cache_key and data.get("error_code") == 400:
+                    too_big = "too big" in str(data.get("description", "")).lower()
+                    self.file_cache.set_negative(cache_key, too_big=too_big)
+                return None
+
+            file_path = data["result"]["file_path"]
+            if cache_key:
+                self.file_cache.set(cache_key, file_path)
+
+            # Формируем прямой URL для скачивания
+            return f"{self.bot_api_url}/file/bot{self.bot_token}/{file_path}"
 
         except Exception as e:
             # Логируем ошибку, но не прерываем парсинг
+            metrics.GETFILE_FAILURES.labels(type(e).__name__).inc()
             print(f"Warning: Failed to get file URL via Bot API for {file_id}: {e}")
             return None
 
-    async def _parse_message(self, message: Message) -> Optional[Dict[str, Any]]:
+    def _parse_message(self, message: Message) -> Optional[Post]:
         """
-        Преобразовать сообщение Pyrogram в словарь
+        Преобразовать сообщение Pyrogram в запись поста
+
+        Поле url у медиа остаётся пустым — его заполняет MediaUrlResolver
         """
         # Пропускаем служебные сообщения
         if message.service:
@@ -258,52 +692,44 @@ class TelegramChannelParser:
         # Собираем медиа
         media = []
         if message.photo:
-            # Получаем URL через Bot API если доступен bot_token
-            file_url = await self._get_file_url_via_bot_api(message.photo.file_id)
-            media.append({
-                "type": "photo",
-                "file_id": message.photo.file_id,
-                "url": file_url,
-                "width": message.photo.width if hasattr(message.photo, 'width') else None,
-                "height": message.photo.height if hasattr(message.photo, 'height') else None
-            })
+            media.append(PhotoMedia(
+                file_id=message.photo.file_id,
+                file_unique_id=message.photo.file_unique_id,
+                width=getattr(message.photo, "width", None),
+                height=getattr(message.photo, "height", None)
+            ))
         elif message.video:
-            file_url = await self._get_file_url_via_bot_api(message.video.file_id)
-            media.append({
-                "type": "video",
-                "file_id": message.video.file_id,
-                "duration": message.video.duration,
-                "url": file_url
-            })
+            media.append(VideoMedia(
+                file_id=message.video.file_id,
+                file_unique_id=message.video.file_unique_id,
+                duration=message.video.duration
+            ))
         elif message.document:
-            file_url = await self._get_file_url_via_bot_api(message.document.file_id)
-            media.append({
-                "type": "document",
-                "file_id": message.document.file_id,
-                "file_name": message.document.file_name,
-                "url": file_url
-            })
+            media.append(DocumentMedia(
+                file_id=message.document.file_id,
+                file_unique_id=message.document.file_unique_id,
+                file_name=message.document.file_name
+            ))
         elif message.audio:
-            file_url = await self._get_file_url_via_bot_api(message.audio.file_id)
-            media.append({
-                "type": "audio",
-                "file_id": message.audio.file_id,
-                "duration": message.audio.duration,
-                "url": file_url
-            })
-
-        return {
-            "message_id": int(message.id) if message.id is not None else 0,
-            "date": int(message.date.timestamp()) if message.date else None,
-            "text": str(text) if text else "",
-            "views": int(message.views) if message.views else 0,
-            "forwards": int(message.forwards) if message.forwards else 0,
-            "media": media,
-            "has_media_spoiler": bool(message.has_media_spoiler) if hasattr(message, "has_media_spoiler") else False,
-            "entities": self._parse_entities(message.entities or message.caption_entities or [])
-        }
+            media.append(AudioMedia(
+                file_id=message.audio.file_id,
+                file_unique_id=message.audio.file_unique_id,
+                duration=message.audio.duration
+            ))
+
+        return Post(
+            message_id=int(message.id) if message.id is not None else 0,
+            date=int(message.date.timestamp()) if message.date else None,
+            text=str(text) if text else "",
+            views=int(message.views) if message.views else 0,
+            forwards=int(message.forwards) if message.forwards else 0,
+            edit_date=int(message.edit_date.timestamp()) if message.edit_date else None,
+            media=media,
+            has_media_spoiler=bool(getattr(message, "has_media_spoiler", False)),
+            entities=self._parse_entities(message.entities or message.caption_entities or [])
+        )
 
-    def _parse_entities(self, entities) -> List[Dict[str, Any]]:
+    def _parse_entities(self, entities) -> List[Entity]:
         """Преобразовать entities сообщения"""
         result = []
         for entity in entities:
@@ -318,15 +744,83 @@ class TelegramChannelParser:
             except Exception:
                 entity_type = "unknown"
 
-            result.append({
-                "type": entity_type,
-                "offset": int(entity.offset) if entity.offset is not None else 0,
-                "length": int(entity.length) if entity.length is not None else 0,
-                "url": str(entity.url) if hasattr(entity, "url") and entity.url else None
-            })
+            url = getattr(entity, "url", None)
+            result.append(Entity(
+                type=entity_type,
+                offset=int(entity.offset) if entity.offset is not None else 0,
+                length=int(entity.length) if entity.length is not None else 0,
+                url=str(url) if url else None
+            ))
         return result
 
 
+def _offset_date(timestamp: Optional[int]) -> datetime:
+    """offset_date для get_chat_history: сообщения не новее timestamp (Telegram отдаёт строго старше offset_date)"""
+    if timestamp is None:
+        return utils.zero_datetime()
+    return datetime.fromtimestamp(timestamp + 1)
+
+
+class MediaUrlResolver:
+    """
+    Параллельное получение URL медиа через Bot API
+
+    Задачи запускаются сразу при submit(), пока продолжается чтение истории,
+    а количество одновременных запросов ограничено семафором.
+    Одинаковые file_id запрашиваются один раз, пока ожидающие их посты не заполнены.
+    """
+
+    def __init__(self, resolve, concurrency: int = 8):
+        self._resolve = resolve
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._refs: Dict[str, int] = {}
+
+    def submit(self, media: List[Media]):
+        """Поставить в очередь получение URL для медиа поста"""
+        for item in media:
+            file_id = item.file_id
+            if not file_id:
+                continue
+            if file_id not in self._tasks:
+                self._tasks[file_id] = asyncio.create_task(
+                    self._run(file_id, item.file_unique_id)
+                )
+            self._refs[file_id] = self._refs.get(file_id, 0) + 1
+
+    def is_ready(self, media: List[Media]) -> bool:
+        """Все ли URL для медиа поста уже получены"""
+        for item in media:
+            task = self._tasks.get(item.file_id)
+            if task and not task.done():
+                return False
+        return True
+
+    async def fill(self, media: List[Media]):
+        """Дождаться URL для медиа поста и проставить их"""
+        for item in media:
+            file_id = item.file_id
+            task = self._tasks.get(file_id)
+            if not task:
+                continue
+            item.url = await task
+            # Задача больше не нужна ни одному посту — освобождаем память
+            self._refs[file_id] -= 1
+            if not self._refs[file_id]:
+                del self._refs[file_id]
+                del self._tasks[file_id]
+
+    def cancel(self):
+        """Отменить незавершённые запросы (например, при ошибке чтения истории)"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    async def _run(self, file_id: str, file_unique_id: Optional[str]) -> Optional[str]:
+        async with self._semaphore:
+            return await self._resolve(file_id, file_unique_id)
+
+
 class SessionGenerator:
     """
     Генератор session_string для Pyrogram
@@ -0,0 +1,104 @@
+"""
+Кеш разрешённых username каналов
+Позволяет не вызывать get_chat (ResolveUsername) на каждом запросе статистики и истории
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+class ResolvedPeer:
+    """Разрешённый канал: всё, что нужно клиенту для запросов без ResolveUsername"""
+
+    __slots__ = ("id", "access_hash", "peer_type", "username", "title", "expires_at")
+
+    def __init__(
+        self,
+        id: int,
+        access_hash: int,
+        peer_type: str,
+        username: Optional[str],
+        title: Optional[str],
+        expires_at: float
+    ):
+        self.id = id
+        self.access_hash = access_hash
+        self.peer_type = peer_type
+        self.username = username
+        self.title = title
+        self.expires_at = expires_at
+
+
+class PeerCache:
+    """
+    Кеш username → ResolvedPeer для каждой сессии
+
+    access_hash привязан к аккаунту, поэтому ключ включает хеш session_string.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._peers: "OrderedDict[Tuple[str, str], ResolvedPeer]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(session_key: str, username: str) -> Tuple[str, str]:
+        return session_key, username.lstrip("@").lower()
+
+    def get(self, session_key: str, username: str) -> Optional[ResolvedPeer]:
+        """Найти неистёкшую запись"""
+        key = self._key(session_key, username)
+        peer = self._peers.get(key)
+        if peer is None or peer.expires_at < time.monotonic():
+            if peer is not None:
+                del self._peers[key]
+            self.misses += 1
+            return None
+
+        self._peers.move_to_end(key)
+        self.hits += 1
+        return peer
+
+    def set(
+        self,
+        session_key: str,
+        username: str,
+        id: int,
+        access_hash: int,
+        peer_type: str,
+        title: Optional[str] = None
+    ) -> ResolvedPeer:
+        """Сохранить разрешённый канал"""
+        key = self._key(session_key, username)
+        peer = ResolvedPeer(
+            id=id,
+            access_hash=access_hash,
+            peer_type=peer_type,
+            username=key[1],
+            title=title,
+            expires_at=time.monotonic() + self.ttl
+        )
+        self._peers[key] = peer
+        self._peers.move_to_end(key)
+        while len(self._peers) > self.max_entries:
+            self._peers.popitem(last=False)
+        return peer
+
+    def invalidate(self, session_key: str, username: str):
+        """Удалить запись (канал стал приватным, username освобождён и т.п.)"""
+        if self._peers.pop(self._key(session_key, username), None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кеша"""
+        return {
+            "entries": len(self._peers),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,216 @@
+"""
+Ограничитель частоты запросов к Telegram для каждой сессии
+Token bucket с учётом FloodWait: при ожидании запросы сессии приостанавливаются,
+темп снижается и постепенно восстанавливается после успешных вызовов
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Callable, Awaitable, TypeVar, AsyncIterator
+
+from pyrogram.errors import FloodWait
+
+import metrics
+
+T = TypeVar("T")
+
+
+class _Bucket:
+    """Token bucket одной сессии"""
+
+    __slots__ = (
+        "rate", "base_rate", "burst", "tokens", "updated", "blocked_until", "lock", "slots",
+        "flood_waits", "flood_wait_seconds", "last_flood_wait", "users", "last_used"
+    )
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.rate = rate
+        self.base_rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.last_flood_wait: Optional[int] = None
+        # Сколько запросов сейчас ждут или держат слот, и когда сессия использовалась
+        self.users = 0
+        self.last_used = self.updated
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if self.blocked_until > now:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SessionRateLimiter:
+    """
+    Ограничитель запросов Pyrogram по сессиям
+
+    После FloodWait сессия блокируется на указанное Telegram время, а её темп
+    уменьшается вдвое (не ниже min_rate). Каждый успешный вызов возвращает
+    темп к базовому на recovery_step запросов в секунду.
+    Параллельные чтения истории одной сессии ограничены concurrency (см. slot()).
+    Состояние сессии, не использовавшейся дольше idle_ttl, удаляется.
+    """
+
+    def __init__(
+        self,
+        rate: float = 5.0,
+        burst: int = 10,
+        min_rate: float = 0.2,
+        recovery_step: float = 0.05,
+        max_flood_wait: float = 300.0,
+        max_retries: int = 3,
+        concurrency: int = 4,
+        idle_ttl: float = 3600.0
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery_step = recovery_step
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+        self.concurrency = max(1, concurrency)
+        self.idle_ttl = idle_ttl
+        self._buckets: Dict[str, _Bucket] = {}
+        self._next_prune = time.monotonic() + idle_ttl
+        self.pruned = 0
+
+    def _bucket(self, key: str) -> _Bucket:
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.rate, self.burst, self.concurrency)
+        bucket.last_used = now
+        return bucket
+
+    def _prune(self, now: float):
+        """Удалить сессии без запросов дольше idle_ttl (и без действующего FloodWait)"""
+        deadline = now - self.idle_ttl
+        idle = [
+            key for key, bucket in self._buckets.items()
+            if not bucket.users and bucket.last_used < deadline and bucket.blocked_until <= now
+        ]
+        for key in idle:
+            del self._buckets[key]
+        self.pruned += len(idle)
+        self._next_prune = now + min(self.idle_ttl, 600.0)
+
+    async def acquire(self, key: str):
+        """Дождаться разрешения на очередной запрос сессии"""
+        bucket = self._bucket(key)
+        bucket.users += 1
+        try:
+            await bucket.acquire()
+        finally:
+            bucket.users -= 1
+
+    @asynccontextmanager
+    async def slot(self, key: str) -> AsyncIterator[None]:
+        """Место для параллельного запроса сессии: не больше concurrency одновременно на все синхронизации"""
+        bucket = self._bucket(key)
+        bucket.users += 1
+        try:
+            async with bucket.slots:
+                yield
+        finally:
+            bucket.users -= 1
+            bucket.last_used = time.monotonic()
+
+    def record_success(self, key: str):
+        """Успешный вызов — постепенно возвращаем темп к базовому"""
+        bucket = self._bucket(key)
+        if bucket.rate < bucket.base_rate:
+            bucket.rate = min(bucket.base_rate, bucket.rate + self.recovery_step)
+
+    def record_flood_wait(
+        self,
+        key: str,
+        error: FloodWait,
+        attempt: int,
+        max_wait: Optional[float] = None,
+        on_wait: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Учесть FloodWait: заблокировать сессию и снизить темп
+
+        Пробрасывает исключение, если ожидание больше допустимого
+        или попытки исчерпаны — иначе следующий acquire() подождёт сам.
+        """
+        wait = int(error.value)
+        bucket = self._bucket(key)
+        bucket.flood_waits += 1
+        bucket.flood_wait_seconds += wait
+        bucket.last_flood_wait = wait
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + wait)
+        bucket.rate = max(self.min_rate, bucket.rate / 2)
+        bucket.tokens = 0
+        metrics.FLOOD_WAITS.labels(key[:8]).inc()
+        metrics.FLOOD_WAIT_SECONDS.labels(key[:8]).inc(wait)
+
+        ceiling = self.max_flood_wait if max_wait is None else max_wait
+        if wait > ceiling or attempt >= self.max_retries:
+            raise error
+
+        print(f"[LIMITER] FloodWait {wait}s for session {key[:8]}, retry {attempt + 1}/{self.max_retries}")
+        if on_wait:
+            on_wait(wait)
+
+    async def call(
+        self,
+        key: str,
+        fn: Callable[..., Awaitable[T]],
+        *args,
+        max_wait: Optional[float] = None,
+        on_wait: Optional[Callable[[int], None]] = None,
+        **kwargs
+    ) -> T:
+        """Выполнить вызов Pyrogram с ограничением темпа и повтором после FloodWait"""
+        attempt = 0
+        while True:
+            await self.acquire(key)
+            try:
+                result = await fn(*args, **kwargs)
+            except FloodWait as e:
+                self.record_flood_wait(key, e, attempt, max_wait, on_wait)
+                attempt += 1
+                continue
+            self.record_success(key)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние сессий, у которых были FloodWait"""
+        now = time.monotonic()
+        return {
+            "sessions": len(self._buckets),
+            "pruned": self.pruned,
+            "base_rate": self.rate,
+            "concurrency": self.concurrency,
+            "throttled": {
+                key[:8]: {
+                    "rate": round(bucket.rate, 3),
+                    "flood_waits": bucket.flood_waits,
+                    "flood_wait_seconds": bucket.flood_wait_seconds,
+                    "last_flood_wait": bucket.last_flood_wait,
+                    "blocked_for": max(0, round(bucket.blocked_until - now, 1))
+                }
+                for key, bucket in self._buckets.items()
+                if bucket.flood_waits
+            }
+        }
@@ -0,0 +1,94 @@
+"""
+Компактные записи постов для конвейера синхронизации
+Dataclass со __slots__ вместо вложенных словарей: меньше памяти на пост,
+а orjson сериализует их напрямую, за один проход
+
+Поля записей и их порядок — формат поста в callback Rails (см. README):
+новые поля добавляются со значением по умолчанию и описываются там же.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Union, Any
+
+import orjson
+
+
+@dataclass(slots=True)
+class Entity:
+    """Форматирование текста (bold, link и т.п.)"""
+    type: str
+    offset: int
+    length: int
+    url: Optional[str] = None
+
+
+@dataclass(slots=True, kw_only=True)
+class PhotoMedia:
+    type: str = "photo"
+    file_id: str
+    file_unique_id: Optional[str]
+    url: Optional[str] = None
+    local_url: Optional[str] = None
+    thumb_url: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+@dataclass(slots=True, kw_only=True)
+class VideoMedia:
+    type: str = "video"
+    file_id: str
+    file_unique_id: Optional[str]
+    duration: Optional[int] = None
+    url: Optional[str] = None
+    local_url: Optional[str] = None
+    thumb_url: Optional[str] = None
+
+
+@dataclass(slots=True, kw_only=True)
+class DocumentMedia:
+    type: str = "document"
+    file_id: str
+    file_unique_id: Optional[str]
+    file_name: Optional[str] = None
+    url: Optional[str] = None
+    local_url: Optional[str] = None
+    thumb_url: Optional[str] = None
+
+
+@dataclass(slots=True, kw_only=True)
+class AudioMedia:
+    type: str = "audio"
+    file_id: str
+    file_unique_id: Optional[str]
+    duration: Optional[int] = None
+    url: Optional[str] = None
+    local_url: Optional[str] = None
+    thumb_url: Optional[str] = None
+
+
+Media = Union[PhotoMedia, VideoMedia, DocumentMedia, AudioMedia]
+
+
+@dataclass(slots=True)
+class Post:
+    """Пост канала в том виде, в каком он уходит в callback Rails"""
+    message_id: int
+    date: Optional[int]
+    text: str
+    views: int
+    forwards: int
+    edit_date: Optional[int] = None
+    media: List[Media] = field(default_factory=list)
+    has_media_spoiler: bool = False
+    entities: List[Entity] = field(default_factory=list)
+
+
+def _default(obj: Any) -> Any:
+    # Всё, что orjson не знает (объекты Pyrogram и т.п.), отправляем строкой
+    return str(obj)
+
+
+def dumps(data: Any) -> bytes:
+    """Сериализовать данные callback (словари, записи, datetime, Enum) в JSON за один проход"""
+    return orjson.dumps(data, default=_default)
@@ -0,0 +1,170 @@
+"""
+Кеш ответов Telegram со stale-while-revalidate
+Повторные запросы за те же данные (например, /channel-info с дашборда) отдаются из памяти,
+устаревшие записи обновляются в фоне, одинаковые одновременные запросы делят один вызов Telegram
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Callable, Awaitable, Hashable
+
+from pyrogram.errors import FloodWait
+
+
+class CachedResponse:
+    """Запись кеша: значение, момент получения и когда можно снова пробовать обновить"""
+
+    __slots__ = ("value", "fetched_at", "retry_at")
+
+    def __init__(self, value: Any, fetched_at: float):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.retry_at = 0.0
+
+
+class ResponseCache:
+    """
+    Кеш с временем свежести (ttl) и окном stale-while-revalidate (stale_ttl)
+
+    - запись моложе ttl отдаётся как есть (hit);
+    - запись моложе ttl + stale_ttl отдаётся сразу (stale), а обновление запускается в фоне;
+    - более старая запись или её отсутствие — запрос ждёт обращения к Telegram (miss);
+    - force=True — запрос ждёт свежего значения (refresh).
+
+    На каждый ключ одновременно выполняется не больше одного обращения: остальные
+    запросы (и фоновое обновление) ждут его результата. Если фоновое обновление
+    не удалось, запись остаётся прежней, а новая попытка будет не раньше чем через
+    retry_interval (или через время FloodWait).
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        stale_ttl: float = 600.0,
+        max_entries: int = 10000,
+        retry_interval: float = 30.0
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.retry_interval = retry_interval
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._background: set = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.coalesced = 0
+        self.background_errors = 0
+
+    async def get(
+        self,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[Any]],
+        force: bool = False
+    ) -> Tuple[Any, str, float]:
+        """
+        Значение по ключу
+
+        Args:
+            key: Ключ (например, хеш сессии и username канала)
+            fetch: Корутина-фабрика обращения к Telegram; её ошибки получают все ждущие запросы
+            force: Не отдавать кешированное значение, дождаться нового
+
+        Returns:
+            (значение, источник: hit, stale, miss или refresh, возраст значения в секундах)
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and not force:
+            age = now - entry.fetched_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value, "hit", age
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._in_flight and entry.retry_at <= now:
+                    # Следующие запросы до начала обновления не запускают второе
+                    entry.retry_at = now + self.retry_interval
+                    task = asyncio.create_task(self._refresh(key, fetch))
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+                return entry.value, "stale", age
+
+        if force:
+            self.refreshes += 1
+        else:
+            self.misses += 1
+        value = await self._fetch(key, fetch)
+        return value, "refresh" if force else "miss", 0.0
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def close(self):
+        """Отменить фоновые обновления"""
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "background_errors": self.background_errors
+        }
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        in_flight = self._in_flight.get(key)
+        if in_flight:
+            self.coalesced += 1
+            # shield: отмена одного ждущего запроса не отменяет обращение для остальных
+            return await asyncio.shield(in_flight)
+
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение забирает тот, кто запустил обращение; ждущих может не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        try:
+            await self._fetch(key, fetch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.background_errors += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                delay = max(self.retry_interval, e.value if isinstance(e, FloodWait) else 0)
+                entry.retry_at = time.monotonic() + delay
+            print(f"[CACHE] Background refresh failed: {type(e).__name__} - {e}")
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = CachedResponse(value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
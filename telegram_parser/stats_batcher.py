@@ -0,0 +1,143 @@
+"""
+Объединение одновременных запросов /message-stats одного канала
+Запросы, пришедшие в течение короткого окна, выполняются одним get_chat и полными
+вызовами get_messages по 100 id; каждый запрос получает статистику только своих id
+"""
+
+import asyncio
+from typing import Dict, Any, List, Tuple, Callable, Awaitable
+
+from client_pool import session_key
+
+# Сигнатура функции, которая запрашивает статистику у Telegram:
+# (session_string, channel_username, message_ids) → статистика в порядке message_ids
+FetchStats = Callable[[str, str, List[int]], Awaitable[List[Dict[str, Any]]]]
+
+
+class _PendingStats:
+    """Запросы одного канала, ожидающие отправки"""
+
+    __slots__ = ("session_string", "channel_username", "ids", "waiters", "full")
+
+    def __init__(self, session_string: str, channel_username: str):
+        self.session_string = session_string
+        self.channel_username = channel_username
+        self.ids: Dict[int, None] = {}  # уникальные id в порядке поступления
+        self.waiters: List[Tuple[List[int], asyncio.Future]] = []
+        self.full = asyncio.Event()
+
+
+class StatsBatcher:
+    """
+    Окно объединения запросов статистики по ключу (хеш сессии, канал)
+
+    Первый запрос открывает окно длиной window секунд; запросы того же канала,
+    пришедшие за это время, добавляют свои id в ту же пачку. Пачка отправляется
+    по окончании окна или сразу, когда набралось max_ids уникальных id.
+    Ошибка Telegram (FloodWait, канал не найден) получают все запросы пачки.
+
+    При window=0 запросы выполняются по отдельности, как без объединения.
+    """
+
+    def __init__(self, fetch: FetchStats, window: float = 0.01, max_ids: int = 100):
+        self.fetch = fetch
+        self.window = window
+        self.max_ids = max_ids
+        self._pending: Dict[Tuple[str, str], _PendingStats] = {}
+        self._tasks: set = set()
+        self.requests = 0
+        self.batches = 0
+        self.requested_ids = 0
+        self.fetched_ids = 0
+
+    async def get(self, session_string: str, channel_username: str, message_ids: List[int]) -> List[Dict[str, Any]]:
+        """Статистика message_ids (в том же порядке, с повторами, если они есть в запросе)"""
+        self.requests += 1
+        self.requested_ids += len(message_ids)
+        if self.window <= 0:
+            self.batches += 1
+            self.fetched_ids += len(message_ids)
+            return await self.fetch(session_string, channel_username, message_ids)
+
+        key = (session_key(session_string), channel_username.lstrip("@").lower())
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingStats(session_string, channel_username)
+            task = asyncio.create_task(self._flush(key, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        future = asyncio.get_running_loop().create_future()
+        pending.waiters.append((message_ids, future))
+        pending.ids.update(dict.fromkeys(message_ids))
+        if len(pending.ids) >= self.max_ids:
+            # Пачка заполнена — следующие запросы открывают новое окно
+            del self._pending[key]
+            pending.full.set()
+
+        return await asyncio.shield(future)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "pending": len(self._pending),
+            "requested_ids": self.requested_ids,
+            "fetched_ids": self.fetched_ids
+        }
+
+    async def _flush(self, key: Tuple[str, str], pending: _PendingStats):
+        # Каждый запрос пачки должен получить результат или ошибку — иначе он зависнет
+        try:
+            await self._send(key, pending)
+        except asyncio.CancelledError:
+            for _, future in pending.waiters:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in pending.waiters:
+                if not future.done():
+                    future.set_exception(e)
+                    # Запрос мог быть отменён — тогда исключение некому забрать
+                    future.exception()
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+    async def _send(self, key: Tuple[str, str], pending: _PendingStats):
+        try:
+            await asyncio.wait_for(pending.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._pending.get(key) is pending:
+            del self._pending[key]
+
+        ids = list(pending.ids)
+        self.batches += 1
+        self.fetched_ids += len(ids)
+        if len(pending.waiters) > 1:
+            print(f"[STATS] Merged {len(pending.waiters)} requests for {pending.channel_username}: {len(ids)} ids")
+        stats = await self.fetch(pending.session_string, pending.channel_username, ids)
+
+        # Telegram может вернуть меньше сообщений, чем запрошено — недостающие как не найденные
+        by_id = dict(zip(ids, stats))
+        for message_ids, future in pending.waiters:
+            if not future.done():
+                future.set_result([by_id.get(message_id) or _not_found(message_id) for message_id in message_ids])
+
+
+def _not_found(message_id: int) -> Dict[str, Any]:
+    """Заглушка в том же виде, что у ненайденного сообщения в ответе /message-stats"""
+    return {
+        "message_id": message_id,
+        "views": 0,
+        "forwards": 0,
+        "reactions": {},
+        "not_found": True
+    }
@@ -0,0 +1,378 @@
+"""
+Наблюдение за статистикой опубликованных постов
+Сервис сам опрашивает Telegram по адаптивному расписанию и отправляет в Rails
+только сообщения, у которых изменились views, forwards или реакции
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple
+
+from client_pool import session_key
+
+# Возраст поста → множитель базового интервала опроса.
+# Свежие посты набирают просмотры быстро, старые почти не меняются.
+AGE_TIERS = (
+    (3600, 1),           # первый час
+    (24 * 3600, 4),      # первые сутки
+    (7 * 24 * 3600, 16),  # первая неделя
+)
+OLD_POST_MULTIPLIER = 64
+MAX_POLL_INTERVAL = 24 * 3600
+
+# Сообщения, взятые в опрос, откладываются на это время: другие процессы
+# их не возьмут, а если процесс упадёт посреди опроса, они вернутся сами
+CLAIM_LEASE = 300
+
+
+def poll_interval(base_interval: float, message_date: Optional[int], now: float) -> float:
+    """Интервал следующего опроса сообщения в зависимости от его возраста"""
+    if not message_date:
+        return base_interval
+
+    age = now - message_date
+    for max_age, multiplier in AGE_TIERS:
+        if age < max_age:
+            return min(MAX_POLL_INTERVAL, base_interval * multiplier)
+    return min(MAX_POLL_INTERVAL, base_interval * OLD_POST_MULTIPLIER)
+
+
+def stats_fingerprint(stats: Dict[str, Any]) -> str:
+    """Отпечаток значимых полей статистики: views, forwards, reactions, not_found"""
+    payload = json.dumps(
+        [stats.get("views"), stats.get("forwards"), stats.get("reactions"), bool(stats.get("not_found"))],
+        sort_keys=True
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+
+class StatsWatcher:
+    """
+    Реестр наблюдений (watch) за статистикой сообщений
+
+    Наблюдения хранятся в SQLite и переживают перезапуск. Каждый тик планировщик
+    забирает сообщения, которым пора обновиться, группирует их по сессии и каналу
+    (один вызов get_messages на группу) и отправляет в callback только изменения.
+    Планировщики нескольких процессов с общей базой не опрашивают одно сообщение дважды.
+
+    Наблюдение определяется хешем сессии (session_key), каналом и callback_url;
+    session_string хранится только для опроса. Наблюдение без ttl снимается
+    через default_ttl, повторная регистрация продлевает его.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fetch_stats: Callable[[str, str, List[int]], Awaitable[List[Dict[str, Any]]]],
+        send: Callable[[str, dict], Awaitable[bool]],
+        tick: float = 5.0,
+        concurrency: int = 4,
+        default_ttl: float = 7 * 24 * 3600
+    ):
+        self.path = path
+        self.fetch_stats = fetch_stats
+        self.send = send
+        self.tick = tick
+        self.concurrency = concurrency
+        self.default_ttl = default_ttl
+        self._db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+        self.pushes = 0
+        self.pushed_messages = 0
+        self.errors = 0
+
+    async def start(self):
+        """Открыть базу и запустить планировщик"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._migrate_session_key()
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS watches ("
+            " id TEXT PRIMARY KEY,"
+            " session_key TEXT NOT NULL,"
+            " session_string TEXT NOT NULL,"
+            " channel TEXT NOT NULL,"
+            " callback_url TEXT NOT NULL,"
+            " interval REAL NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL,"
+            " UNIQUE (session_key, channel, callback_url))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS watch_messages ("
+            " watch_id TEXT NOT NULL REFERENCES watches (id) ON DELETE CASCADE,"
+            " message_id INTEGER NOT NULL,"
+            " date INTEGER,"
+            " fingerprint TEXT,"
+            " next_poll_at REAL NOT NULL,"
+            " PRIMARY KEY (watch_id, message_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS watch_messages_due ON watch_messages (next_poll_at)")
+        # Бессрочные наблюдения из прежних версий получают срок
+        self._db.execute(
+            "UPDATE watches SET expires_at = ? WHERE expires_at IS NULL",
+            (time.time() + self.default_ttl,)
+        )
+        self._task = asyncio.create_task(self._loop())
+
+    def _migrate_session_key(self):
+        """Прежняя схема: session_string в уникальном ключе наблюдения — пересоздаём таблицу с session_key"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(watches)")}
+            if columns and "session_key" not in columns:
+                rows = self._db.execute(
+                    "SELECT id, session_string, channel, callback_url, interval, created_at, expires_at FROM watches"
+                ).fetchall()
+                # foreign_keys ещё выключены: DROP не удаляет сообщения наблюдений
+                self._db.execute("DROP TABLE watches")
+                self._db.execute(
+                    "CREATE TABLE watches ("
+                    " id TEXT PRIMARY KEY,"
+                    " session_key TEXT NOT NULL,"
+                    " session_string TEXT NOT NULL,"
+                    " channel TEXT NOT NULL,"
+                    " callback_url TEXT NOT NULL,"
+                    " interval REAL NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " expires_at REAL,"
+                    " UNIQUE (session_key, channel, callback_url))"
+                )
+                self._db.executemany(
+                    "INSERT INTO watches"
+                    " (id, session_key, session_string, channel, callback_url, interval, created_at, expires_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(row[0], session_key(row[1])) + row[1:] for row in rows]
+                )
+                print(f"[WATCH] Migrated {len(rows)} watches to session_key")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    async def close(self):
+        """Остановить планировщик"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def register(
+        self,
+        session_string: str,
+        channel_username: str,
+        message_ids: List[int],
+        callback_url: str,
+        interval: float,
+        ttl: Optional[float] = None
+    ) -> Tuple[str, int]:
+        """
+        Зарегистрировать наблюдение
+
+        Повторная регистрация для той же сессии, канала и callback_url добавляет
+        сообщения к существующему наблюдению, обновляет интервал и продлевает срок
+        (ttl, по умолчанию default_ttl).
+
+        Returns:
+            (watch_id, количество сообщений в наблюдении)
+        """
+        now = time.time()
+        channel = channel_username.lstrip("@").lower()
+        expires_at = now + (ttl or self.default_ttl)
+        key = session_key(session_string)
+
+        row = self._db.execute(
+            "SELECT id FROM watches WHERE session_key = ? AND channel = ? AND callback_url = ?",
+            (key, channel, callback_url)
+        ).fetchone()
+        if row:
+            watch_id = row[0]
+            self._db.execute(
+                "UPDATE watches SET interval = ?, expires_at = ? WHERE id = ?",
+                (interval, expires_at, watch_id)
+            )
+        else:
+            watch_id = str(uuid.uuid4())
+            self._db.execute(
+                "INSERT INTO watches"
+                " (id, session_key, session_string, channel, callback_url, interval, created_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (watch_id, key, session_string, channel, callback_url, interval, now, expires_at)
+            )
+
+        # Новые сообщения опрашиваются на ближайшем тике
+        self._db.executemany(
+            "INSERT OR IGNORE INTO watch_messages (watch_id, message_id, next_poll_at) VALUES (?, ?, ?)",
+            [(watch_id, int(message_id), now) for message_id in message_ids]
+        )
+        count = self._db.execute(
+            "SELECT COUNT(*) FROM watch_messages WHERE watch_id = ?", (watch_id,)
+        ).fetchone()[0]
+        return watch_id, count
+
+    def get(self, watch_id: str) -> Optional[Dict[str, Any]]:
+        """Описание наблюдения (без session_string)"""
+        row = self._db.execute(
+            "SELECT id, channel, callback_url, interval, created_at, expires_at,"
+            " (SELECT COUNT(*) FROM watch_messages WHERE watch_id = watches.id),"
+            " (SELECT MIN(next_poll_at) FROM watch_messages WHERE watch_id = watches.id)"
+            " FROM watches WHERE id = ?",
+            (watch_id,)
+        ).fetchone()
+        if not row:
+            return None
+
+        return {
+            "watch_id": row[0],
+            "channel_username": row[1],
+            "callback_url": row[2],
+            "interval": row[3],
+            "created_at": row[4],
+            "expires_at": row[5],
+            "messages": row[6],
+            "next_poll_at": row[7]
+        }
+
+    def remove(self, watch_id: str) -> bool:
+        """Удалить наблюдение"""
+        return self._db.execute("DELETE FROM watches WHERE id = ?", (watch_id,)).rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики наблюдателя"""
+        watches = self._db.execute("SELECT COUNT(*) FROM watches").fetchone()[0] if self._db else 0
+        messages = self._db.execute("SELECT COUNT(*) FROM watch_messages").fetchone()[0] if self._db else 0
+        return {
+            "watches": watches,
+            "messages": messages,
+            "polls": self.polls,
+            "pushes": self.pushes,
+            "pushed_messages": self.pushed_messages,
+            "errors": self.errors
+        }
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                self.errors += 1
+                print(f"[WATCH] Scheduler error: {type(e).__name__} - {e}")
+            await asyncio.sleep(self.tick)
+
+    async def run_due(self):
+        """Опросить все сообщения, которым пора обновиться"""
+        now = time.time()
+        self._db.execute("DELETE FROM watches WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+
+        # Забираем сообщения одним UPDATE — атомарно относительно других процессов
+        claimed = self._db.execute(
+            "UPDATE watch_messages SET next_poll_at = ? WHERE next_poll_at <= ?"
+            " RETURNING watch_id, message_id, date, fingerprint",
+            (now + CLAIM_LEASE, now)
+        ).fetchall()
+        if not claimed:
+            return
+
+        watch_ids = sorted({row[0] for row in claimed})
+        watches = {
+            row[0]: row for row in self._db.execute(
+                "SELECT id, session_string, channel, callback_url, interval FROM watches"
+                f" WHERE id IN ({', '.join('?' for _ in watch_ids)})",
+                watch_ids
+            )
+        }
+        rows = [
+            watches[watch_id] + (message_id, date, fingerprint)
+            for watch_id, message_id, date, fingerprint in claimed
+            if watch_id in watches
+        ]
+
+        # Группируем по сессии и каналу: разные наблюдения одного канала — один запрос
+        groups: Dict[Tuple[str, str], List[tuple]] = defaultdict(list)
+        for row in rows:
+            groups[(row[1], row[2])].append(row)
+
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def poll(key: Tuple[str, str], group: List[tuple]):
+            async with semaphore:
+                await self._poll_group(key[0], key[1], group)
+
+        await asyncio.gather(*(poll(key, group) for key, group in groups.items()))
+
+    async def _poll_group(self, session_string: str, channel: str, rows: List[tuple]):
+        message_ids = sorted({row[5] for row in rows})
+        self.polls += 1
+        try:
+            fresh = await self.fetch_stats(session_string, channel, message_ids)
+        except Exception as e:
+            self.errors += 1
+            print(f"[WATCH] Failed to fetch stats for {channel}: {type(e).__name__} - {e}")
+            # Повторим через базовый интервал, не дожидаясь адаптивного
+            retry_at = time.time() + min(row[4] for row in rows)
+            self._db.executemany(
+                "UPDATE watch_messages SET next_poll_at = ? WHERE watch_id = ? AND message_id = ?",
+                [(retry_at, row[0], row[5]) for row in rows]
+            )
+            return
+
+        by_id = {stats["message_id"]: stats for stats in fresh}
+        now = time.time()
+
+        # Раскладываем изменения по наблюдениям (у каждого свой callback)
+        changes: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        updates: Dict[str, List[tuple]] = defaultdict(list)
+        callbacks: Dict[str, str] = {}
+        for watch_id, _, _, callback_url, interval, message_id, date, fingerprint in rows:
+            stats = by_id.get(message_id)
+            if stats is None:
+                continue
+            date = stats.get("date") or date
+            new_fingerprint = stats_fingerprint(stats)
+            next_poll_at = now + poll_interval(interval, date, now)
+            callbacks[watch_id] = callback_url
+            if new_fingerprint != fingerprint:
+                changes[watch_id].append(stats)
+            updates[watch_id].append((date, new_fingerprint, next_poll_at, watch_id, message_id))
+
+        for watch_id, watch_updates in updates.items():
+            delivered = True
+            if changes[watch_id]:
+                delivered = await self.send(callbacks[watch_id], {
+                    "watch_id": watch_id,
+                    "channel_username": channel,
+                    "stats": changes[watch_id]
+                })
+                if delivered:
+                    self.pushes += 1
+                    self.pushed_messages += len(changes[watch_id])
+
+            if delivered:
+                self._db.executemany(
+                    "UPDATE watch_messages SET date = ?, fingerprint = ?, next_poll_at = ?"
+                    " WHERE watch_id = ? AND message_id = ?",
+                    watch_updates
+                )
+            else:
+                # Rails не принял изменения — отпечаток не обновляем, чтобы отправить их снова
+                self._db.executemany(
+                    "UPDATE watch_messages SET date = ?, next_poll_at = ? WHERE watch_id = ? AND message_id = ?",
+                    [(date, next_poll_at, w, m) for date, _, next_poll_at, w, m in watch_updates]
+                )
@@ -0,0 +1,86 @@
+"""
+Курсоры инкрементальной синхронизации
+Хранит последний отправленный в Rails пост для каждого канала и типа импорта
+"""
+
+import os
+import sqlite3
+import time
+from typing import Dict, Any, Optional
+
+
+class SyncCursorStore:
+    """
+    Хранилище курсоров (high-water mark) в локальной SQLite
+
+    Ключ — username канала, тип импорта и id получателя в Rails
+    (channel_site_id или project_id), так как один канал может
+    импортироваться в несколько мест.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Открыть (и при необходимости создать) базу"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sync_cursors ("
+            " channel TEXT NOT NULL,"
+            " import_type TEXT NOT NULL,"
+            " target_id TEXT NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " date INTEGER,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (channel, import_type, target_id))"
+        )
+
+    def close(self):
+        """Закрыть базу"""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def get(
+        self,
+        channel_username: str,
+        import_type: str,
+        target_id: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """Последний курсор или None, если канал ещё не синхронизировался"""
+        row = self._db.execute(
+            "SELECT message_id, date FROM sync_cursors"
+            " WHERE channel = ? AND import_type = ? AND target_id = ?",
+            self._key(channel_username, import_type, target_id)
+        ).fetchone()
+        if not row:
+            return None
+        return {"message_id": row[0], "date": row[1]}
+
+    def set(
+        self,
+        channel_username: str,
+        import_type: str,
+        target_id: Optional[str],
+        message_id: int,
+        date: Optional[int]
+    ):
+        """Сохранить курсор (только вперёд — старое значение не затирается меньшим)"""
+        self._db.execute(
+            "INSERT INTO sync_cursors (channel, import_type, target_id, message_id, date, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (channel, import_type, target_id) DO UPDATE SET"
+            " message_id = MAX(message_id, excluded.message_id),"
+            " date = MAX(COALESCE(date, 0), COALESCE(excluded.date, 0)),"
+            " updated_at = excluded.updated_at",
+            self._key(channel_username, import_type, target_id) + (message_id, date, time.time())
+        )
+
+    @staticmethod
+    def _key(channel_username: str, import_type: str, target_id: Optional[str]) -> tuple:
+        return channel_username.lstrip("@").lower(), import_type or "", target_id or ""